@@ -11,10 +11,26 @@ from transformers import (
     WhisperFeatureExtractor, WhisperTokenizer, WhisperProcessor,
     WhisperForConditionalGeneration, Seq2SeqTrainer, Seq2SeqTrainingArguments
 )
+from transformers.trainer_utils import get_last_checkpoint
 from datasets import load_dataset, Audio
 from dataclasses import dataclass
-from typing import Any, Dict, List, Union
-import evaluate
+from typing import Any, Dict, List, Optional, Union
+from feature_cache import FeatureCache
+from encoder_cache import EncoderStateCache, EncoderStateCollator, attach_encoder_rows, encoder_is_deterministic
+from packing import PackedDataset, clip_durations, plan_packs, packing_report
+from data_pipeline import FFmpegAudioDataset, PrefetchTrainerMixin, StallLogCallback, ffmpeg_decode
+from pcm_store import PCMStore, PCMAudioDataset
+from length_sampler import BucketSampler, LengthGroupedTrainerMixin, label_lengths, padding_report
+from autotune import autotune, describe
+from profiler import maybe_add_profiler
+from fast_eval import FastEvalTrainerMixin
+from asr_metrics import ErrorRateAccumulator
+from async_eval import AsyncEvalCallback, launch_evaluator, save_eval_set, split_cores
+from distill import DistillCollator, DistillationTrainerMixin, TeacherTargetDataset, TeacherTargets, check_compatible
+from lora import GenerationConfigCallback, apply_lora, save_adapter_and_merge, trainable_summary
+from diff import create as create_delta, describe as describe_delta
+from partial_checkpoint import PartialCheckpointTrainerMixin, benchmark_save, describe as describe_checkpoint
+from cpu_fastpath import CpuFastPathTrainerMixin, describe as describe_cpu, plan_cpu_fastpath
 
 # -----------------------------
 # 0. (Optional) Hugging Face auth
@@ -41,6 +57,12 @@ if device == "cuda":
 else:
     total_vram_gb = 0
     print("🟡 Using CPU")
+# bf16 autocast (if native), one thread per physical core, fused AdamW (CPU_FASTPATH=1, CPU_COMPILE=1)
+cpu_plan = None
+if device == "cpu" and os.getenv("CPU_FASTPATH", "0") != "0":
+    cpu_plan = plan_cpu_fastpath(compile_model=(os.getenv("CPU_COMPILE", "0") != "0"))
+    cpu_plan.apply()
+    print(describe_cpu(cpu_plan))
 
 # Adaptive parameters
 if total_vram_gb <= 4:
@@ -61,6 +83,54 @@ else:
 
 FULL_DATA = (os.getenv("FULL_DATA", "1") != "0")
 EPOCHS = int(os.getenv("EPOCHS", "1" if device != "cuda" else "3"))
+# Persist log-mel features across epochs/runs (enable with FEATURE_CACHE=1)
+FEATURE_CACHE = (os.getenv("FEATURE_CACHE", "0") != "0")
+FEATURE_CACHE_DIR = os.getenv("FEATURE_CACHE_DIR", "./feature-cache")
+# Delete cached features built with other extractor settings (FEATURE_CACHE_PRUNE=1)
+FEATURE_CACHE_PRUNE = (os.getenv("FEATURE_CACHE_PRUNE", "0") != "0")
+# Run a frozen encoder once and train the decoder from stored states (enable with ENCODER_CACHE=1)
+ENCODER_CACHE = (os.getenv("ENCODER_CACHE", "0") != "0")
+ENCODER_CACHE_DIR = os.getenv("ENCODER_CACHE_DIR", "./encoder-cache")
+# Pack several short training clips into each 30 s window (enable with PACK_UTTERANCES=1)
+PACK_UTTERANCES = (os.getenv("PACK_UTTERANCES", "0") != "0")
+# Build batches in a thread pool with a bounded prefetch queue (DATA_PIPELINE=1, PIPELINE_WORKERS=N)
+DATA_PIPELINE = (os.getenv("DATA_PIPELINE", "0") != "0")
+# Decode audio once into 16 kHz int16 shards instead of on every access (PCM_STORE=1)
+PCM_STORE = (os.getenv("PCM_STORE", "0") != "0")
+PCM_STORE_DIR = os.getenv("PCM_STORE_DIR", "./pcm-store")
+# Bucket training batches by label length (then duration) to cut label padding (LENGTH_GROUPING=1)
+LENGTH_GROUPING = (os.getenv("LENGTH_GROUPING", "0") != "0")
+# Probe this machine for batch size / accumulation instead of the VRAM tiers (AUTOTUNE=1)
+AUTOTUNE = (os.getenv("AUTOTUNE", "0") != "0")
+TARGET_BATCH = int(os.getenv("TARGET_BATCH", "16"))
+# Batched, length-sorted eval with the KV cache on (FAST_EVAL=1; EVAL_BATCH then defaults to 16)
+FAST_EVAL = (os.getenv("FAST_EVAL", "0") != "0")
+EVAL_BATCH = int(os.getenv("EVAL_BATCH", "16" if FAST_EVAL else "1"))
+EVAL_BEAMS = int(os.getenv("EVAL_BEAMS", "5"))  # 1 = greedy
+# Save-only training; a separate process on ASYNC_EVAL_CORES scores each checkpoint (ASYNC_EVAL=1)
+ASYNC_EVAL = (os.getenv("ASYNC_EVAL", "0") != "0")
+ASYNC_EVAL_CORES = int(os.getenv("ASYNC_EVAL_CORES", str(max(1, (os.cpu_count() or 4) // 4))))
+# Distil a fine-tuned larger Whisper into this one (DISTILL_TEACHER=./whisper-finetuned-medical)
+DISTILL_TEACHER = os.getenv("DISTILL_TEACHER", "")
+DISTILL_PSEUDO = (os.getenv("DISTILL_PSEUDO", "0") != "0")  # train on the teacher's transcripts
+DISTILL_TOPK = int(os.getenv("DISTILL_TOPK", "16"))
+DISTILL_ALPHA = float(os.getenv("DISTILL_ALPHA", "0.5"))
+DISTILL_TEMPERATURE = float(os.getenv("DISTILL_TEMPERATURE", "2.0"))
+DISTILL_CACHE_DIR = os.getenv("DISTILL_CACHE_DIR", "./teacher-cache")
+# Train low-rank adapters only; checkpoints hold just the adapter (LORA=1, LORA_R, LORA_ALPHA, LORA_LR)
+LORA = (os.getenv("LORA", "0") != "0")
+LORA_R = int(os.getenv("LORA_R", "8"))
+LORA_ALPHA = int(os.getenv("LORA_ALPHA", "16"))
+LORA_LR = float(os.getenv("LORA_LR", "1e-3"))
+# Also write the final model as a delta against the base (SAVE_DELTA=int8 or lowrank; 0 = off)
+SAVE_DELTA = os.getenv("SAVE_DELTA", "0")
+# Periodic checkpoints hold only trainable params + optimizer/scheduler/RNG, written in the background (PARTIAL_CHECKPOINTS=1)
+PARTIAL_CHECKPOINTS = (os.getenv("PARTIAL_CHECKPOINTS", "0") != "0")
+if PARTIAL_CHECKPOINTS and ASYNC_EVAL:
+    print("⚠️ The async evaluator needs full checkpoints; ignoring PARTIAL_CHECKPOINTS=1.")
+    PARTIAL_CHECKPOINTS = False
+# Resume from a checkpoint directory, or "last" for the newest one in the output dir (RESUME=...; "" = fresh run)
+RESUME = os.getenv("RESUME", "")
 print(f"🔧 Config -> samples={max_samples}, batch={batch_size}, grad_accum={grad_accum}, steps={max_steps}")
 freeze_encoder = (device != "cuda") or (max_samples <= 50)
 
@@ -74,9 +144,12 @@ if not FULL_DATA:
     ds = ds.select(range(min(max_samples, len(ds))))
 # Make our own train/val split from the full set
 dataset = ds.train_test_split(test_size=0.1, seed=42)
-# Avoid relying on torchcodec by disabling automatic decoding; we'll load audio manually in the collator.
-# Let datasets decode audio with torchcodec (default path)
-dataset = dataset.cast_column("audio", Audio(sampling_rate=16000))
+# Let datasets decode audio with torchcodec (default path); with DATA_PIPELINE=1 or PCM_STORE=1 rows
+# stay undecoded and FFmpeg decodes them (in the prefetch threads, or once into the PCM store)
+dataset = dataset.cast_column("audio", Audio(sampling_rate=16000, decode=not (DATA_PIPELINE or PCM_STORE)))
+pcm_stores = {}
+if PCM_STORE:
+    pcm_stores = {split: PCMStore.open_or_build(dataset[split], PCM_STORE_DIR) for split in dataset}
 
 # Find transcription column
 transcription_col = None
@@ -147,77 +220,209 @@ print("✅ Tokenized labels, columns now:", dataset['train'].column_names)
 class WhisperCollator:
     processor: Any
     pad_token_id: int
-    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
-        arrays = [f["audio"]["array"] for f in features]
-        srs = [f["audio"]["sampling_rate"] for f in features]
+    feature_cache: Optional[FeatureCache] = None
+    def extract(self, arrays: List[Any], sampling_rate: int, return_tensors: str = "pt"):
         # Use the full processor to ensure consistent padding to 3000 frames
-        proc = self.processor(
+        return self.processor(
             audio=arrays,
-            sampling_rate=srs[0],
-            return_tensors="pt",
+            sampling_rate=sampling_rate,
+            return_tensors=return_tensors,
             padding="max_length",
             max_length=self.processor.feature_extractor.n_samples,
             truncation=True,
-        )
-        inputs = {"input_features": proc["input_features"]}
+        )["input_features"]
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        arrays = [f["audio"]["array"] for f in features]
+        srs = [f["audio"]["sampling_rate"] for f in features]
+        if self.feature_cache is not None:
+            feats = self.feature_cache.get_or_compute(
+                arrays, srs[0], lambda missing: self.extract(missing, srs[0], return_tensors="np")
+            )
+            inputs = {"input_features": torch.from_numpy(feats)}
+        else:
+            inputs = {"input_features": self.extract(arrays, srs[0])}
         label_features = [{"input_ids": f["labels"]} for f in features]
         labels_batch = self.processor.tokenizer.pad(label_features, return_tensors="pt")
         labels = labels_batch["input_ids"].masked_fill(labels_batch["input_ids"] == self.pad_token_id, -100)
         inputs["labels"] = labels
         return inputs
 
-collator = WhisperCollator(processor, pad_token_id=tokenizer.pad_token_id)
+feature_cache = None
+if FEATURE_CACHE:
+    feature_cache = FeatureCache.for_extractor(
+        FEATURE_CACHE_DIR, processor.feature_extractor, sampling_rate=16000,
+        padding="max_length", max_length=processor.feature_extractor.n_samples, truncation=True,
+    )
+    if FEATURE_CACHE_PRUNE:
+        for stale in feature_cache.prune_stale():
+            print(f"🧹 Removed stale feature cache {stale}")
+    print(f"🗃️  Feature cache at {feature_cache.dir} ({len(feature_cache)} cached clips)")
+collator = WhisperCollator(processor, pad_token_id=tokenizer.pad_token_id, feature_cache=feature_cache)
+train_ds, eval_ds = dataset["train"], dataset["test"]
+if PCM_STORE:
+    train_ds = PCMAudioDataset(pcm_stores["train"], train_ds)
+    eval_ds = PCMAudioDataset(pcm_stores["test"], eval_ds)
+    print(f"💽 Reading audio from PCM store at {PCM_STORE_DIR}")
+elif DATA_PIPELINE:
+    train_ds, eval_ds = FFmpegAudioDataset(train_ds), FFmpegAudioDataset(eval_ds)
+
+# Teacher soft targets (and pseudo-labels), computed once per teacher/dataset and cached on disk
+teacher_targets = None
+if DISTILL_TEACHER and PACK_UTTERANCES:
+    print("⚠️ Distillation needs one clip per training row; skipping it with PACK_UTTERANCES=1.")
+elif DISTILL_TEACHER:
+    teacher = WhisperForConditionalGeneration.from_pretrained(DISTILL_TEACHER)
+    check_compatible(teacher, model)
+    teacher_targets = TeacherTargets.build(
+        DISTILL_CACHE_DIR, train_ds, teacher,
+        lambda rows: collator.extract([r["audio"]["array"] for r in rows], rows[0]["audio"]["sampling_rate"]),
+        pad_token_id=tokenizer.pad_token_id, top_k=DISTILL_TOPK, pseudo_labels=DISTILL_PSEUDO, device=device,
+        generate_kwargs=dict(language="hi", task="transcribe", num_beams=EVAL_BEAMS),
+        prompt_ids=tokenizer.convert_tokens_to_ids(["<|hi|>", "<|transcribe|>", "<|notimestamps|>"]),
+    )
+    del teacher
+    gc.collect()
+
+# Short clips: fill the 30 s window with several utterances instead of silence
+if PACK_UTTERANCES:
+    window_s = processor.feature_extractor.chunk_length
+    durations = clip_durations(train_ds)
+    clip_label_lengths = label_lengths(train_ds)
+    # Same label layout as the unpacked rows (no special tokens) and as eval (no timestamps)
+    packs = plan_packs(durations, clip_label_lengths, window_s=window_s, timestamps=False)
+    train_ds = PackedDataset(train_ds, packs, tokenizer, window_s=window_s,
+                             durations=durations, timestamps=False)
+    rep = packing_report(durations, packs, window_s=window_s)
+    print(f"📦 Packed {rep['clips']} clips into {rep['windows']} windows: "
+          f"{rep['audio_s_per_window_packed']:.1f}s audio/window vs {rep['audio_s_per_window_padded']:.1f}s padded "
+          f"({rep['efficiency_packed'] * 100:.0f}% vs {rep['efficiency_padded'] * 100:.0f}% of the window, "
+          f"{rep['encoder_window_reduction']:.1f}x fewer encoder windows)")
+
+# Frozen encoder: its output never changes, so compute it once and feed the decoder directly
+if freeze_encoder and ENCODER_CACHE:
+    if encoder_is_deterministic(model):
+        extract = lambda rows: collator.extract(
+            [r["audio"]["array"] for r in rows], rows[0]["audio"]["sampling_rate"]
+        )
+        # One cache for both splits: train rows first, eval rows after them
+        enc_cache = EncoderStateCache.build(
+            ENCODER_CACHE_DIR, torch.utils.data.ConcatDataset([train_ds, eval_ds]), model, extract, device=device,
+            fingerprint=f"{train_ds._fingerprint}:{eval_ds._fingerprint}",
+        )
+        train_ds, eval_ds = attach_encoder_rows(train_ds), attach_encoder_rows(eval_ds, offset=len(train_ds))
+        collator = EncoderStateCollator(enc_cache, processor, pad_token_id=tokenizer.pad_token_id)
+        print("🧊 Training decoder only from cached encoder states.")
+    else:
+        print("⚠️ Encoder has dropout/SpecAugment enabled; skipping encoder-state cache.")
+
+if teacher_targets is not None:
+    train_ds = TeacherTargetDataset(train_ds, teacher_targets)
+    collator = DistillCollator(collator)
+    print(f"🎓 Distilling from {DISTILL_TEACHER}: alpha={DISTILL_ALPHA}, T={DISTILL_TEMPERATURE}, top-{DISTILL_TOPK}")
+
+# Adapters go on after the caches are built; with a frozen encoder they stay in the decoder so its cache holds
+if LORA:
+    model = apply_lora(model, r=LORA_R, alpha=LORA_ALPHA, decoder_only=freeze_encoder)
+    print(trainable_summary(model))
 
 # -----------------------------
 # 6. Metrics
 # -----------------------------
-wer_metric = evaluate.load("wer")
-cer_metric = evaluate.load("cer")
-def compute_metrics(pred):
-    ids = pred.predictions
-    lbl = pred.label_ids
-    lbl[lbl == -100] = tokenizer.pad_token_id
-    pred_str = processor.tokenizer.batch_decode(ids, skip_special_tokens=True)
-    lbl_str  = processor.tokenizer.batch_decode(lbl, skip_special_tokens=True)
-    wer = wer_metric.compute(predictions=pred_str, references=lbl_str) * 100
-    cer = cer_metric.compute(predictions=pred_str, references=lbl_str) * 100
-    return {"wer": wer, "cer": cer}
+# WER/CER counted per eval batch (preprocess hook), so predictions are never held in memory
+error_rates = ErrorRateAccumulator(processor.tokenizer)
 
 # -----------------------------
 # 7. Training Arguments
 # -----------------------------
+if AUTOTUNE:
+    print("🔬 Autotuning batch size ...")
+    lengths = sorted(label_lengths(train_ds)) or [64]
+    tuned = autotune(
+        model, device, target_batch=TARGET_BATCH,
+        label_len=lengths[int(0.95 * (len(lengths) - 1))],
+        encoder_states=isinstance(getattr(collator, "collator", collator), EncoderStateCollator),
+        amp_dtype=torch.float16 if device == "cuda" else (torch.bfloat16 if cpu_plan and cpu_plan.bf16 else None),
+    )
+    print(describe(tuned))
+    batch_size, grad_accum = tuned.batch_size, tuned.grad_accum
+
 args = Seq2SeqTrainingArguments(
     output_dir="./whisper-tiny-test",
     per_device_train_batch_size=batch_size,
     gradient_accumulation_steps=grad_accum,
-    per_device_eval_batch_size=1,
+    per_device_eval_batch_size=EVAL_BATCH,
     fp16=(device=="cuda"),
-    learning_rate=1e-5,
+    learning_rate=LORA_LR if LORA else 1e-5,
     num_train_epochs=EPOCHS,
     logging_steps=10,
     eval_strategy="epoch",
     save_steps=500,
-    save_total_limit=1,
+    save_total_limit=None if ASYNC_EVAL else 1,  # keep checkpoints until the evaluator has scored them
     predict_with_generate=True,
-    generation_num_beams=5,
+    generation_num_beams=EVAL_BEAMS,
     label_smoothing_factor=0.1,
     dataloader_num_workers=0,
     remove_unused_columns=False,
+    label_names=["labels"],  # not inferable from a PEFT wrapper's forward signature
     report_to=[],
+    **(dict(save_strategy="epoch", load_best_model_at_end=True, metric_for_best_model="wer",
+            greater_is_better=False) if ASYNC_EVAL else {}),
+    **(cpu_plan.training_args() if cpu_plan else {}),
 )
 
 # -----------------------------
 # 8. Trainer
 # -----------------------------
-trainer = Seq2SeqTrainer(
+trainer_mixins = []
+if cpu_plan:
+    trainer_mixins.append(CpuFastPathTrainerMixin)
+if PARTIAL_CHECKPOINTS:
+    trainer_mixins.append(PartialCheckpointTrainerMixin)
+if teacher_targets is not None:
+    trainer_mixins.append(DistillationTrainerMixin)
+if FAST_EVAL:
+    trainer_mixins.append(FastEvalTrainerMixin)
+if LENGTH_GROUPING:
+    trainer_mixins.append(LengthGroupedTrainerMixin)
+if DATA_PIPELINE:
+    trainer_mixins.append(PrefetchTrainerMixin)
+trainer_cls = type("WhisperTrainer", (*trainer_mixins, Seq2SeqTrainer), {})
+trainer = trainer_cls(
     model=model,
     args=args,
-    train_dataset=dataset["train"],
-    eval_dataset=dataset["test"],
+    train_dataset=train_ds,
+    eval_dataset=eval_ds,
     data_collator=collator,
-    compute_metrics=compute_metrics,
+    compute_metrics=error_rates.compute_metrics,
+    preprocess_logits_for_metrics=error_rates.preprocess_logits_for_metrics,
     tokenizer=processor.tokenizer,
 )
+if cpu_plan:
+    trainer.cpu_plan = cpu_plan
+if teacher_targets is not None:
+    trainer.teacher_targets = teacher_targets
+    trainer.distill_alpha, trainer.distill_temperature = DISTILL_ALPHA, DISTILL_TEMPERATURE
+if LENGTH_GROUPING:
+    lengths = label_lengths(train_ds)
+    durations = train_ds.durations() if hasattr(train_ds, "durations") else None
+    trainer.length_sampler = BucketSampler(lengths, batch_size, durations=durations, seed=args.seed)
+    pad = padding_report(lengths, batch_size, trainer.length_sampler, seed=args.seed)
+    print(f"📏 Label padding: {pad['random'] * 100:.1f}% of tokens with random batches -> "
+          f"{pad['bucketed'] * 100:.1f}% with length buckets")
+if DATA_PIPELINE:
+    trainer.add_callback(StallLogCallback(os.path.join(args.output_dir, "step_timing.jsonl")))
+if ASYNC_EVAL:
+    train_cores, eval_cores = split_cores(ASYNC_EVAL_CORES)
+    os.sched_setaffinity(0, train_cores)
+    torch.set_num_threads(len(train_cores))
+    eval_set = os.path.join(args.output_dir, "async-eval")
+    save_eval_set(dataset["test"], processor, eval_set)
+    evaluator = launch_evaluator(args.output_dir, eval_set, eval_cores, num_beams=EVAL_BEAMS, batch_size=EVAL_BATCH)
+    trainer.add_callback(AsyncEvalCallback(args.output_dir, evaluator=evaluator))
+    print(f"🛰️  Async eval on cores {eval_cores[0]}-{eval_cores[-1]}, training on {len(train_cores)} cores")
+if LORA:
+    trainer.add_callback(GenerationConfigCallback())
+maybe_add_profiler(trainer)  # PROFILE=1
 
 # -----------------------------
 # 9. Clear Memory & Train
@@ -226,26 +431,48 @@ gc.collect()
 if device == "cuda": torch.cuda.empty_cache()
 model.to(device)
 
+resume_from = None
+if RESUME:
+    resume_from = get_last_checkpoint(args.output_dir) if RESUME == "last" else RESUME
+    if resume_from is None:
+        print(f"⚠️ No checkpoint in {args.output_dir}; starting fresh.")
+    else:
+        print(f"♻️  Resuming from {resume_from}")
+
 print("🚀 Starting training ...")
-trainer.train()
+trainer.train(resume_from_checkpoint=resume_from)
+if feature_cache is not None:
+    feature_cache.flush()
+    print(feature_cache.summary())
+if PARTIAL_CHECKPOINTS and not LORA:
+    print(describe_checkpoint(benchmark_save(trainer, model_name)))
 
 # -----------------------------
 # 10. Save & Evaluate
 # -----------------------------
-trainer.save_model("./whisper-tiny-test-final")
-processor.save_pretrained("./whisper-tiny-test-final")
+if LORA:
+    # Adapter-only directory (MBs) plus a merged full checkpoint that inference/export load as usual
+    print(save_adapter_and_merge(model, processor, "./whisper-tiny-test-adapter", "./whisper-tiny-test-final"))
+else:
+    trainer.save_model("./whisper-tiny-test-final")
+    processor.save_pretrained("./whisper-tiny-test-final")
+if SAVE_DELTA != "0":
+    print(describe_delta(create_delta("./whisper-tiny-test-final", "./whisper-tiny-test-delta", base=model_name,
+                                      mode=SAVE_DELTA)))
 
 print("🔎 Evaluating ...")
 res = trainer.evaluate()
 print("✅ Final eval WER:", res.get("eval_wer", res.get("wer", "N/A")))
+if feature_cache is not None:
+    print(feature_cache.summary())
 
 # -----------------------------
 # 11. Quick Inference Check
 # -----------------------------
 sample = dataset["test"][0]
 proc_infer = processor(
-    audio=sample["audio"]["array"],
-    sampling_rate=sample["audio"]["sampling_rate"],
+    audio=ffmpeg_decode(sample["audio"], 16000),  # passes already-decoded audio through
+    sampling_rate=16000,
     return_tensors="pt",
     padding="max_length",
     max_length=processor.feature_extractor.n_samples,
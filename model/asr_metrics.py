@@ -0,0 +1,189 @@
+"""
+Streaming WER/CER
+Local word/character error rates accumulated per eval batch, with a vectorized Levenshtein core
+
+Replaces `evaluate.load("wer")` / `evaluate.load("cer")`: nothing is
+downloaded, both rates come out of one pass, and only four counters are
+kept across an evaluation. Scores follow jiwer's corpus-level definition
+(total edits / total reference words or characters).
+
+Usage with a Trainer:
+    metrics = ErrorRateAccumulator(tokenizer)
+    Seq2SeqTrainer(..., compute_metrics=metrics.compute_metrics,
+                   preprocess_logits_for_metrics=metrics.preprocess_logits_for_metrics)
+
+`preprocess_logits_for_metrics` runs once per eval batch. It scores that
+batch and hands the Trainer a one-column placeholder instead of the
+predictions, so eval memory stays flat no matter how large the eval set is.
+Under torch.distributed each rank scores only its own batches this way, so
+`compute_metrics` sums the counters over all ranks before computing the rates.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+
+# -----------------------------
+# Edit distance
+# -----------------------------
+def levenshtein(ref: Sequence[int], hyp: Sequence[int]) -> int:
+    """
+    Edit distance between two integer sequences.
+
+    One numpy step per element of the shorter sequence. Each step takes the
+    deletion and substitution costs from the previous DP row, and the
+    insertion chain within the row is resolved with
+    `np.minimum.accumulate(row - j) + j`.
+    """
+    a = np.asarray(ref, dtype=np.int64)
+    b = np.asarray(hyp, dtype=np.int64)
+    if len(a) < len(b):
+        a, b = b, a  # distance is symmetric; loop over the shorter one
+    if len(b) == 0:
+        return int(len(a))
+    cols = np.arange(len(a) + 1, dtype=np.int64)
+    row = cols.copy()
+    for i, token in enumerate(b, start=1):
+        new = np.empty_like(row)
+        new[0] = i
+        np.minimum(row[1:] + 1, row[:-1] + (a != token), out=new[1:])
+        row = np.minimum.accumulate(new - cols) + cols
+    return int(row[-1])
+
+
+class _Vocab:
+    """Interns words as integers so word sequences can go through `levenshtein`."""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+
+    def encode(self, words: List[str]) -> List[int]:
+        return [self.ids.setdefault(w, len(self.ids)) for w in words]
+
+
+def _chars(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+# -----------------------------
+# Accumulator
+# -----------------------------
+class ErrorRateAccumulator:
+    """
+    Running word and character edit counts over decoded predictions.
+
+    `update` takes token ids (labels may hold -100), `update_text` takes
+    strings, `compute` returns `{"wer", "cer"}` in percent.
+    """
+
+    def __init__(self, tokenizer: Any = None, normalize: Optional[Callable[[str], str]] = None,
+                 metrics: Sequence[str] = ("wer", "cer")):
+        self.tokenizer = tokenizer
+        self.normalize = normalize
+        self.metrics = tuple(metrics)
+        self.reset()
+
+    def reset(self):
+        self._vocab = _Vocab()  # word ids only need to be consistent within one evaluation
+        self.word_edits = self.words = 0
+        self.char_edits = self.chars = 0
+        self.samples = 0
+        self._fed_by_hook = False
+
+    # -----------------------------
+    # Feeding
+    # -----------------------------
+    def _decode(self, ids: Any) -> List[str]:
+        if isinstance(ids, torch.Tensor):
+            ids = ids.detach().cpu().numpy()
+        ids = np.asarray(ids)
+        pad = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        ids = np.where(ids < 0, pad, ids)  # -100 in labels and in Trainer padding
+        return self.tokenizer.batch_decode(ids, skip_special_tokens=True)
+
+    def update_text(self, predictions: Sequence[str], references: Sequence[str]):
+        for hyp, ref in zip(predictions, references):
+            if self.normalize is not None:
+                hyp, ref = self.normalize(hyp), self.normalize(ref)
+            hyp_words, ref_words = hyp.split(), ref.split()
+            if "wer" in self.metrics:
+                self.word_edits += levenshtein(self._vocab.encode(ref_words), self._vocab.encode(hyp_words))
+                self.words += len(ref_words)
+            if "cer" in self.metrics:
+                ref_c, hyp_c = _chars(" ".join(ref_words)), _chars(" ".join(hyp_words))
+                self.char_edits += levenshtein(ref_c, hyp_c)
+                self.chars += len(ref_c)
+            self.samples += 1
+
+    def update(self, pred_ids: Any, label_ids: Any):
+        self.update_text(self._decode(pred_ids), self._decode(label_ids))
+
+    def all_reduce(self, hooked: bool) -> bool:
+        """
+        Sum the counters over all ranks if any rank was fed by the logits hook; call on every rank.
+
+        Hook-fed counters cover only the rank's own batches. Counters fed from
+        `compute_metrics` already cover every rank's (gathered) predictions and
+        are left alone. Returns whether the counters were summed.
+        """
+        dist = torch.distributed
+        if not (dist.is_available() and dist.is_initialized()) or dist.get_world_size() <= 1:
+            return False
+        device = "cuda" if dist.get_backend() == "nccl" else "cpu"
+        counts = torch.tensor([int(hooked), self.word_edits, self.words, self.char_edits, self.chars, self.samples],
+                              dtype=torch.int64, device=device)
+        dist.all_reduce(counts)
+        if counts[0] == 0:
+            return False
+        self.word_edits, self.words, self.char_edits, self.chars, self.samples = (int(v) for v in counts[1:].tolist())
+        return True
+
+    def compute(self) -> Dict[str, float]:
+        out = {}
+        if "wer" in self.metrics:
+            out["wer"] = 100.0 * self.word_edits / max(self.words, 1)
+        if "cer" in self.metrics:
+            out["cer"] = 100.0 * self.char_edits / max(self.chars, 1)
+        return out
+
+    # -----------------------------
+    # Trainer hooks
+    # -----------------------------
+    def preprocess_logits_for_metrics(self, logits: Any, labels: torch.Tensor) -> torch.Tensor:
+        """
+        Per-batch Trainer hook: score the batch and return a placeholder.
+
+        Generated ids (`predict_with_generate`) are used as-is. Raw decoder
+        logits are reduced with argmax first, which is the only case where
+        argmax is meaningful.
+        """
+        if isinstance(logits, tuple):
+            logits = logits[0]
+        ids = logits.argmax(dim=-1) if logits.is_floating_point() else logits
+        self.update(ids, labels)
+        self._fed_by_hook = True
+        return torch.zeros((ids.shape[0], 1), dtype=torch.long, device=ids.device)
+
+    def compute_metrics(self, pred: Any, compute_result: bool = True) -> Dict[str, float]:
+        """
+        `compute_metrics` for the Trainer.
+
+        Works with or without the logits hook, and with
+        `batch_eval_metrics=True`, where it is called once per batch and
+        `compute_result` marks the last call. Under torch.distributed every
+        rank must make the final call.
+        """
+        hooked = self._fed_by_hook
+        if not hooked and len(pred.label_ids):
+            preds = pred.predictions[0] if isinstance(pred.predictions, tuple) else pred.predictions
+            if np.issubdtype(np.asarray(preds).dtype, np.floating):
+                preds = np.asarray(preds).argmax(axis=-1)
+            self.update(preds, pred.label_ids)
+        if not compute_result:
+            return {}
+        self.all_reduce(hooked)
+        result = self.compute()
+        self.reset()
+        return result
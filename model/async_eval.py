@@ -0,0 +1,264 @@
+"""
+Out-of-process checkpoint evaluation
+The trainer only saves checkpoints; a separate evaluator process, pinned to its own cores, scores them
+
+Trainer side (`AsyncEvalCallback`):
+  * suppresses the in-process eval that `eval_strategy` would trigger,
+  * picks up `<checkpoint>/async_eval.json` results as they appear and feeds
+    them into `state.best_metric` / `state.best_model_checkpoint`, so
+    checkpoint rotation and `load_best_model_at_end` work as usual,
+  * on the last save, waits for outstanding scores before the Trainer picks
+    the best model.
+
+Evaluator side (run by `launch_evaluator`, or by hand):
+    python async_eval.py --watch ./whisper-tiny-test --eval-set ./whisper-tiny-test/async-eval --cores 12-15
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from transformers import TrainerCallback
+
+RESULT_FILE = "async_eval.json"
+STOP_FILE = "async_eval.stop"
+
+
+# -----------------------------
+# Shared helpers
+# -----------------------------
+def checkpoints(output_dir: str) -> List[str]:
+    """Complete checkpoints under `output_dir` (trainer_state.json is written last), oldest first."""
+    found = []
+    for path in glob.glob(os.path.join(output_dir, "checkpoint-*")):
+        m = re.search(r"checkpoint-(\d+)$", path)
+        if m and os.path.exists(os.path.join(path, "trainer_state.json")):
+            found.append((int(m.group(1)), path))
+    return [p for _, p in sorted(found)]
+
+
+def read_result(checkpoint: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(checkpoint, RESULT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path: str, obj: Dict[str, Any]):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)  # atomic: the trainer never reads a half-written file
+
+
+def split_cores(eval_cores: int) -> Tuple[List[int], List[int]]:
+    """(trainer cores, evaluator cores): the evaluator gets the last `eval_cores` allowed CPUs."""
+    cpus = sorted(os.sched_getaffinity(0))
+    eval_cores = max(1, min(eval_cores, len(cpus) - 1))
+    return cpus[:-eval_cores], cpus[-eval_cores:]
+
+
+def _parse_cores(spec: str) -> List[int]:
+    cores = []
+    for part in spec.split(","):
+        lo, _, hi = part.partition("-")
+        cores.extend(range(int(lo), int(hi or lo) + 1))
+    return cores
+
+
+def save_eval_set(dataset: Any, processor: Any, path: str):
+    """Write the eval split (audio + `labels`) and the processor where the evaluator can load them."""
+    marker = os.path.join(path, "fingerprint")
+    fingerprint = getattr(dataset, "_fingerprint", str(len(dataset)))
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read().strip() == fingerprint:
+                return
+    dataset.save_to_disk(os.path.join(path, "dataset"))
+    processor.save_pretrained(os.path.join(path, "processor"))
+    with open(marker, "w") as f:
+        f.write(fingerprint)
+
+
+# -----------------------------
+# Trainer side
+# -----------------------------
+def launch_evaluator(output_dir: str, eval_set: str, cores: Sequence[int], num_beams: int = 1,
+                     batch_size: int = 16, log_path: Optional[str] = None) -> subprocess.Popen:
+    """Start the watcher process on `cores` (CPU only, so the GPU stays with training)."""
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES="", OMP_NUM_THREADS=str(len(cores)), MKL_NUM_THREADS=str(len(cores)))
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--watch", output_dir, "--eval-set", eval_set,
+        "--cores", ",".join(map(str, cores)), "--beams", str(num_beams), "--batch-size", str(batch_size),
+    ]
+    os.makedirs(output_dir, exist_ok=True)
+    stop = os.path.join(output_dir, STOP_FILE)
+    if os.path.exists(stop):
+        os.remove(stop)
+    log = open(log_path or os.path.join(output_dir, "async_eval.log"), "a")
+    return subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+class AsyncEvalCallback(TrainerCallback):
+    """Replaces in-process eval with results from the evaluator process (see module docstring)."""
+
+    def __init__(self, output_dir: str, evaluator: Optional[subprocess.Popen] = None,
+                 poll_s: float = 10.0, final_timeout_s: float = 1800.0):
+        self.output_dir = output_dir
+        self.evaluator = evaluator
+        self.poll_s = poll_s
+        self.final_timeout_s = final_timeout_s
+        self._seen = set()
+        self._last_poll = 0.0
+
+    def _collect(self, args, state):
+        for ckpt in checkpoints(self.output_dir):
+            if ckpt in self._seen:
+                continue
+            res = read_result(ckpt)
+            if res is None:
+                continue
+            self._seen.add(ckpt)
+            state.log_history.append({**res["metrics"], "step": res["step"], "async_eval": True})
+            print(f"🛰️  Async eval {os.path.basename(ckpt)}: "
+                  + ", ".join(f"{k}={v:.2f}" for k, v in res["metrics"].items() if isinstance(v, float)))
+            key = args.metric_for_best_model
+            if not key:
+                continue
+            key = key if key.startswith("eval_") else f"eval_{key}"
+            value = res["metrics"].get(key)
+            if value is None:
+                continue
+            better = (state.best_metric is None
+                      or (value > state.best_metric if args.greater_is_better else value < state.best_metric))
+            if better:
+                state.best_metric = value
+                state.best_model_checkpoint = ckpt
+
+    def _evaluator_alive(self) -> bool:
+        return self.evaluator is None or self.evaluator.poll() is None
+
+    def on_step_end(self, args, state, control, **kwargs):
+        control.should_evaluate = False
+        now = time.monotonic()
+        if now - self._last_poll >= self.poll_s:
+            self._last_poll = now
+            self._collect(args, state)
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        control.should_evaluate = False
+
+    def on_save(self, args, state, control, **kwargs):
+        self._collect(args, state)
+        if state.global_step < state.max_steps:
+            return
+        # Last checkpoint: the Trainer picks the best model right after this, so wait for the scores
+        deadline = time.monotonic() + self.final_timeout_s
+        pending = [c for c in checkpoints(self.output_dir) if c not in self._seen]
+        if pending:
+            print(f"⏳ Waiting for async eval of {len(pending)} checkpoint(s) ...")
+        while pending and time.monotonic() < deadline and self._evaluator_alive():
+            time.sleep(1.0)
+            self._collect(args, state)
+            pending = [c for c in checkpoints(self.output_dir) if c not in self._seen]
+        if pending:
+            print(f"⚠️ {len(pending)} checkpoint(s) left unscored; best-model selection uses the rest.")
+
+    def on_train_end(self, args, state, control, **kwargs):
+        open(os.path.join(self.output_dir, STOP_FILE), "w").close()
+
+
+# -----------------------------
+# Evaluator side
+# -----------------------------
+def score_checkpoint(checkpoint: str, dataset: Any, processor: Any, num_beams: int = 1,
+                     batch_size: int = 16) -> Dict[str, float]:
+    """WER/CER of one checkpoint on `dataset`, generating with the KV cache on and length-sorted batches."""
+    import torch
+
+    from asr_metrics import ErrorRateAccumulator
+    from data_pipeline import ffmpeg_decode
+    from lora import load_model
+
+    model = load_model(checkpoint).eval()  # full or adapter-only (LORA=1) checkpoint
+    model.config.use_cache = model.generation_config.use_cache = True
+    tokenizer = processor.tokenizer
+    sr = processor.feature_extractor.sampling_rate
+    acc = ErrorRateAccumulator(tokenizer)
+    lengths = [len(l) for l in dataset["labels"]]
+    order = sorted(range(len(dataset)), key=lambda i: lengths[i], reverse=True)
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for b in range(0, len(order), batch_size):
+            rows = [dataset[i] for i in order[b:b + batch_size]]
+            # Eval sets saved with undecoded audio (DATA_PIPELINE=1) go through FFmpeg
+            feats = processor.feature_extractor(
+                [ffmpeg_decode(r["audio"], sr) for r in rows], sampling_rate=sr,
+                return_tensors="pt",
+            ).input_features
+            out = model.generate(feats, num_beams=num_beams, use_cache=True)
+            acc.update_text(tokenizer.batch_decode(out, skip_special_tokens=True),
+                            tokenizer.batch_decode([r["labels"] for r in rows], skip_special_tokens=True))
+    runtime = time.perf_counter() - start
+    metrics = {f"eval_{k}": v for k, v in acc.compute().items()}
+    metrics.update({"eval_runtime": round(runtime, 4), "eval_samples_per_second": round(len(dataset) / runtime, 3)})
+    return metrics
+
+
+def watch(output_dir: str, eval_set: str, num_beams: int = 1, batch_size: int = 16, poll_s: float = 5.0):
+    """Score every new checkpoint in `output_dir` until the trainer writes the stop file."""
+    from datasets import load_from_disk
+    from transformers import WhisperProcessor
+
+    dataset = load_from_disk(os.path.join(eval_set, "dataset"))
+    processor = WhisperProcessor.from_pretrained(os.path.join(eval_set, "processor"))
+    print(f"🛰️  Watching {output_dir} ({len(dataset)} eval clips, beams={num_beams})", flush=True)
+    while True:
+        stopping = os.path.exists(os.path.join(output_dir, STOP_FILE))
+        todo = [c for c in checkpoints(output_dir) if read_result(c) is None]
+        for ckpt in todo:
+            step = int(ckpt.rsplit("-", 1)[1])
+            try:
+                metrics = score_checkpoint(ckpt, dataset, processor, num_beams=num_beams, batch_size=batch_size)
+            except (OSError, ValueError) as err:
+                # Rotated away by save_total_limit while we were loading it
+                print(f"⚠️ Skipping {ckpt}: {err}", flush=True)
+                continue
+            if not os.path.isdir(ckpt):
+                continue
+            _write_json(os.path.join(ckpt, RESULT_FILE), {"step": step, "checkpoint": ckpt, "metrics": metrics})
+            with open(os.path.join(output_dir, "async_eval.jsonl"), "a") as f:
+                f.write(json.dumps({"step": step, **metrics}) + "\n")
+            print(f"✅ {os.path.basename(ckpt)}: {metrics}", flush=True)
+        if stopping and not todo:
+            return
+        time.sleep(poll_s)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score Trainer checkpoints out of process as they are saved")
+    parser.add_argument("--watch", required=True, help="Trainer output_dir")
+    parser.add_argument("--eval-set", required=True, help="Directory written by save_eval_set()")
+    parser.add_argument("--cores", default=None, help="CPU list for this process, e.g. 12-15 or 0,2,4")
+    parser.add_argument("--beams", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.cores:
+        cores = _parse_cores(args.cores)
+        os.sched_setaffinity(0, cores)
+        import torch
+        torch.set_num_threads(len(cores))
+    watch(args.watch, args.eval_set, num_beams=args.beams, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
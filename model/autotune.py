@@ -0,0 +1,223 @@
+"""
+Hardware-aware batch-size autotuner
+Probes real forward/backward steps with growing batches and picks batch size + gradient accumulation
+
+Results are cached per machine, device, model and step type in
+~/.cache/curalynx/autotune.json (override with AUTOTUNE_CACHE), so only the
+first run pays for probing.
+"""
+
+import json
+import math
+import os
+import platform
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import torch
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "curalynx", "autotune.json")
+
+
+@dataclass
+class TuneResult:
+    batch_size: int
+    grad_accum: int
+    samples_per_s: float
+    probes: List[Dict[str, Any]] = field(default_factory=list)
+    cached: bool = False
+
+
+# -----------------------------
+# Memory helpers
+# -----------------------------
+def available_memory(device: str) -> int:
+    """Free bytes on `device` (MemAvailable on CPU)."""
+    if device == "cuda":
+        free, _ = torch.cuda.mem_get_info()
+        return int(free)
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available)
+    except ImportError:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    raise RuntimeError("Cannot determine available RAM (install psutil)")
+
+
+def _current_rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _reset_peak_rss():
+    """Restart VmHWM from the current RSS, so earlier peaks (e.g. dataset preparation) are not counted."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    """High-water RSS of this process (VmHWM), which also catches peaks between samples."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return _current_rss()
+
+
+def _is_oom(err: BaseException) -> bool:
+    oom_cls = getattr(torch.cuda, "OutOfMemoryError", None)
+    return (oom_cls is not None and isinstance(err, oom_cls)) or "out of memory" in str(err).lower()
+
+
+# -----------------------------
+# Probing
+# -----------------------------
+def _synthetic_batch(model: Any, batch_size: int, label_len: int, device: str,
+                     encoder_states: bool) -> Dict[str, Any]:
+    cfg = model.config
+    labels = torch.randint(0, cfg.vocab_size, (batch_size, label_len), device=device)
+    if encoder_states:
+        from transformers.modeling_outputs import BaseModelOutput
+        hidden = torch.randn(batch_size, cfg.max_source_positions, cfg.d_model, device=device)
+        return {"encoder_outputs": BaseModelOutput(last_hidden_state=hidden), "labels": labels}
+    frames = 2 * cfg.max_source_positions
+    feats = torch.randn(batch_size, cfg.num_mel_bins, frames, device=device)
+    return {"input_features": feats, "labels": labels}
+
+
+def probe(model: Any, batch_size: int, device: str, label_len: int = 64, steps: int = 2,
+          encoder_states: bool = False, amp_dtype: Optional[torch.dtype] = None,
+          base_rss: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Time `steps` forward+backward passes; reports throughput and memory used, or OOM.
+
+    On CPU, memory used is the peak RSS above `base_rss` (default: the RSS
+    now). Pass the RSS from before the first probe: memory freed back to
+    the allocator stays resident, so a base re-read between probes would
+    hide it.
+    """
+    model.train()
+    if device == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        base = _current_rss() if base_rss is None else base_rss
+    peak = 0
+    try:
+        elapsed = 0.0
+        for step in range(steps + 1):  # first step is warm-up
+            batch = _synthetic_batch(model, batch_size, label_len, device, encoder_states)
+            start = time.perf_counter()
+            with torch.autocast(device_type=device, dtype=amp_dtype, enabled=amp_dtype is not None):
+                loss = model(**batch).loss
+            if device != "cuda":
+                peak = max(peak, _current_rss() - base)
+            loss.backward()
+            if device == "cuda":
+                torch.cuda.synchronize()
+            else:
+                peak = max(peak, _current_rss() - base)
+            if step > 0:
+                elapsed += time.perf_counter() - start
+            model.zero_grad(set_to_none=True)
+            del batch, loss
+        if device == "cuda":
+            peak = torch.cuda.max_memory_allocated() - base
+        else:
+            peak = max(peak, _peak_rss() - base)
+        return {"batch_size": batch_size, "ok": True, "samples_per_s": batch_size * steps / elapsed, "mem_bytes": int(peak)}
+    except RuntimeError as err:
+        if not _is_oom(err):
+            raise
+        model.zero_grad(set_to_none=True)
+        if device == "cuda":
+            torch.cuda.empty_cache()
+        return {"batch_size": batch_size, "ok": False, "samples_per_s": 0.0, "mem_bytes": 0}
+
+
+def _cache_key(model: Any, device: str, label_len: int, encoder_states: bool,
+               amp_dtype: Optional[torch.dtype] = None) -> str:
+    if device == "cuda":
+        hw = torch.cuda.get_device_name(0)
+    else:
+        hw = f"{platform.processor() or platform.machine()}x{os.cpu_count()}"
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    name = getattr(model.config, "_name_or_path", type(model).__name__)
+    return "|".join([platform.node(), device, hw, name, f"trainable={trainable}", f"labels={label_len}",
+                     f"enc_states={int(encoder_states)}", f"amp={str(amp_dtype).replace('torch.', '')}",
+                     f"torch={torch.__version__}"])
+
+
+def autotune(model: Any, device: str, target_batch: int = 16, max_batch: int = 64, label_len: int = 64,
+             encoder_states: bool = False, headroom: float = 0.85, cache_path: Optional[str] = None,
+             amp_dtype: Optional[torch.dtype] = None) -> TuneResult:
+    """
+    Largest fitting / fastest per-device batch and the accumulation that reaches `target_batch`.
+
+    Batches grow 1, 2, 4, ... until a probe runs out of memory, memory use
+    extrapolated to the next size would exceed `headroom` of what is free
+    (after reserving AdamW state for the trainable parameters), or `max_batch`.
+
+    On CPU an out-of-memory is a SIGKILL from the kernel rather than an
+    exception, so that extrapolation is the only guard. It uses the peak
+    RSS of each probe above the RSS before the first one, measured against
+    the RAM that was available at that point.
+    """
+    cache_path = cache_path or os.getenv("AUTOTUNE_CACHE", DEFAULT_CACHE)
+    key = _cache_key(model, device, label_len, encoder_states, amp_dtype)
+    cache: Dict[str, Any] = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    if key in cache:
+        hit = cache[key]
+        bs = min(hit["batch_size"], target_batch)
+        return TuneResult(bs, max(1, math.ceil(target_batch / bs)), hit["samples_per_s"], hit["probes"], cached=True)
+
+    model.to(device)
+    trainable_bytes = sum(p.numel() * p.element_size() for p in model.parameters() if p.requires_grad)
+    base_rss = None
+    if device != "cuda":
+        _reset_peak_rss()
+        base_rss = _current_rss()
+    budget = available_memory(device) * headroom - 2 * trainable_bytes  # AdamW exp_avg + exp_avg_sq
+    probes: List[Dict[str, Any]] = []
+    bs = 1
+    while bs <= max_batch:
+        res = probe(model, bs, device, label_len=label_len, encoder_states=encoder_states, amp_dtype=amp_dtype,
+                    base_rss=base_rss)
+        probes.append(res)
+        print(f"   🔬 batch={bs:3d}: " + (f"{res['samples_per_s']:.2f} samples/s, {res['mem_bytes'] / 1024**2:.0f} MB"
+                                          if res["ok"] else "out of memory"))
+        if not res["ok"] or res["mem_bytes"] * 2 > budget:
+            break
+        bs *= 2
+
+    fitting = [p for p in probes if p["ok"]]
+    if not fitting:
+        raise RuntimeError("Even batch_size=1 does not fit on this device")
+    best = max(fitting, key=lambda p: (p["samples_per_s"], p["batch_size"]))
+    cache[key] = {"batch_size": best["batch_size"], "samples_per_s": best["samples_per_s"], "probes": probes}
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=2)
+
+    bs = min(best["batch_size"], target_batch)
+    return TuneResult(bs, max(1, math.ceil(target_batch / bs)), best["samples_per_s"], probes)
+
+
+def describe(result: TuneResult) -> str:
+    src = "cached" if result.cached else "probed"
+    return (f"⚙️  Autotune ({src}): batch={result.batch_size}, grad_accum={result.grad_accum} "
+            f"(effective {result.batch_size * result.grad_accum}), ~{result.samples_per_s:.2f} samples/s")
@@ -0,0 +1,333 @@
+"""
+Parallel audio decode + prefetch pipeline
+Thread-pool workers feed a bounded queue of ready batches so the training thread never waits on FFmpeg
+
+Decoding runs FFmpeg as a subprocess per clip instead of going through
+torchcodec inside forked DataLoader workers. The interpreter is never forked,
+so the `sys.modules['torchcodec'] = None` workaround is not needed on this
+path, and the heavy work (FFmpeg, torch STFT) releases the GIL, so threads
+scale across cores.
+"""
+
+import copy
+import io
+import json
+import os
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import torch
+from accelerate import skip_first_batches as accelerate_skip_first_batches
+from accelerate.state import GradientState
+from transformers import Seq2SeqTrainer, TrainerCallback
+
+from fast_features import log_mel_batch
+
+
+def default_workers() -> int:
+    return int(os.getenv("PIPELINE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+
+# -----------------------------
+# Decoding
+# -----------------------------
+def ffmpeg_decode(audio: Dict[str, Any], sampling_rate: int = 16000) -> np.ndarray:
+    """
+    Decode an undecoded `datasets` audio entry (`{"bytes", "path"}`) to mono float32 PCM.
+
+    Already-decoded entries (`{"array", "sampling_rate"}`) at the right rate
+    are passed through.
+    """
+    if audio.get("array") is not None and audio.get("sampling_rate") == sampling_rate:
+        return np.asarray(audio["array"], dtype=np.float32)
+    data = audio.get("bytes")
+    source = "pipe:0" if data else audio["path"]
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "1",
+        "-i", source, "-f", "f32le", "-ac", "1", "-ar", str(sampling_rate), "pipe:1",
+    ]
+    proc = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed on {audio.get('path')}: {proc.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(proc.stdout, dtype=np.float32)
+
+
+class FFmpegAudioDataset(torch.utils.data.Dataset):
+    """
+    Rows of a `decode=False` dataset with the audio decoded by FFmpeg on access.
+
+    Rows keep the `{"audio": {"array", "sampling_rate"}}` layout, so
+    collators, packing and caches work unchanged. Decoding happens in the
+    thread that reads the row, which is a `PrefetchLoader` worker during
+    training. String keys return columns without touching audio.
+    """
+
+    def __init__(self, dataset: Any, audio_column: str = "audio", sampling_rate: int = 16000):
+        self.dataset = dataset
+        self.audio_column = audio_column
+        self.sampling_rate = sampling_rate
+        self._fingerprint = f"ffmpeg-{getattr(dataset, '_fingerprint', len(dataset))}"
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self.dataset.column_names)
+
+    @property
+    def labels(self) -> List[Any]:
+        return self.dataset["labels"]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.dataset[key]
+        row = dict(self.dataset[key])
+        row[self.audio_column] = {"array": ffmpeg_decode(row[self.audio_column], self.sampling_rate),
+                                  "sampling_rate": self.sampling_rate}
+        return row
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+@dataclass
+class DecodingCollator:
+    """Decode, extract log-mel features and pad labels for raw `{"audio", "text"}` rows."""
+    processor: Any
+    text_column: str = "text"
+    sampling_rate: int = 16000
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        arrays = [ffmpeg_decode(f["audio"], self.sampling_rate) for f in features]
+        batch = {"input_features": torch.from_numpy(log_mel_batch(arrays, self.processor.feature_extractor))}
+
+        tokenizer = self.processor.tokenizer
+        label_features = [
+            {"input_ids": f["labels"] if "labels" in f else tokenizer(f[self.text_column]).input_ids}
+            for f in features
+        ]
+        labels_batch = tokenizer.pad(label_features, return_tensors="pt")
+        labels = labels_batch["input_ids"].masked_fill(labels_batch.attention_mask.ne(1), -100)
+        if (labels[:, 0] == tokenizer.bos_token_id).all().cpu().item():
+            labels = labels[:, 1:]
+        batch["labels"] = labels
+        return batch
+
+
+# -----------------------------
+# Prefetching loader
+# -----------------------------
+@dataclass
+class StallStats:
+    """Time the consumer spent blocked waiting for the next batch."""
+    batches: int = 0
+    wait_s: float = 0.0
+    history: List[float] = field(default_factory=list)
+
+    def record(self, wait: float):
+        self.batches += 1
+        self.wait_s += wait
+        self.history.append(wait)
+
+
+def _pin(obj: Any) -> Any:
+    if isinstance(obj, torch.Tensor):
+        return obj.pin_memory()
+    if isinstance(obj, dict):
+        return type(obj)({k: _pin(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_pin(v) for v in obj)
+    return obj
+
+
+class PrefetchLoader:
+    """
+    Drop-in for the Trainer's DataLoader.
+
+    Batches are built by `num_workers` threads and at most `prefetch` finished
+    or in-flight batches are held at once (a bounded queue), yielded in order.
+    Like accelerate's own loaders, it registers with `GradientState` while
+    iterating and flags its last batch (`end_of_dataloader`), so gradient
+    accumulation syncs at the end of an epoch. `skip_first_batches(n)` gives
+    the same epoch without its first `n` batches, for resuming mid-epoch.
+    """
+
+    def __init__(self, dataset: Any, collate_fn: Callable, batch_size: int, shuffle: bool = True,
+                 drop_last: bool = False, num_workers: Optional[int] = None, prefetch: int = 8,
+                 pin_memory: bool = False, seed: int = 42, sampler: Optional[Any] = None):
+        self.dataset = dataset
+        self.collate_fn = collate_fn
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_workers = num_workers or default_workers()
+        self.prefetch = max(prefetch, self.num_workers)
+        self.pin_memory = pin_memory
+        self.seed = seed
+        self.sampler = sampler
+        self.epoch = 0
+        self.skip_batches = 0
+        self.stats = StallStats()
+        self.end_of_dataloader = False
+        self.remainder = -1  # no padding duplicates for gather_for_metrics to drop
+
+    def _num_samples(self) -> int:
+        # A sampler may cover only part of the dataset (e.g. one rank's shard)
+        return len(self.sampler) if self.sampler is not None else len(self.dataset)
+
+    def __len__(self) -> int:
+        n = self._num_samples()
+        batches = n // self.batch_size if self.drop_last else -(-n // self.batch_size)
+        return max(batches - self.skip_batches, 0)
+
+    def skip_first_batches(self, num_batches: int) -> "PrefetchLoader":
+        """A copy that yields the current epoch from batch `num_batches` on (same order, shared stall stats)."""
+        loader = copy.copy(self)
+        loader.skip_batches = self.skip_batches + num_batches
+        return loader
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+    def _batches(self) -> List[List[int]]:
+        n = len(self.dataset)
+        if self.sampler is not None:
+            order = list(self.sampler)
+        elif self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(n, generator=g).tolist()
+        else:
+            order = list(range(n))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        return batches[self.skip_batches:]
+
+    def _load(self, indices: List[int]) -> Any:
+        batch = self.collate_fn([self.dataset[i] for i in indices])
+        return _pin(batch) if self.pin_memory else batch
+
+    def __iter__(self) -> Iterator[Any]:
+        batches = iter(self._batches())
+        pending = deque()
+        gradient_state = GradientState()
+        self.end_of_dataloader = False
+        gradient_state._add_dataloader(self)
+        try:
+            with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="prefetch") as pool:
+                for indices in batches:
+                    pending.append(pool.submit(self._load, indices))
+                    if len(pending) >= self.prefetch:
+                        break
+                while pending:
+                    start = time.perf_counter()
+                    batch = pending.popleft().result()
+                    self.stats.record(time.perf_counter() - start)
+                    nxt = next(batches, None)
+                    if nxt is not None:
+                        pending.append(pool.submit(self._load, nxt))
+                    else:
+                        self.end_of_dataloader = not pending
+                    yield batch
+        finally:
+            gradient_state._remove_dataloader(self)
+
+
+def skip_first_batches(dataloader: Any, num_batches: int = 0) -> Any:
+    """`accelerate.skip_first_batches` that keeps a `PrefetchLoader` a `PrefetchLoader`."""
+    if isinstance(dataloader, PrefetchLoader):
+        return dataloader.skip_first_batches(num_batches)
+    return accelerate_skip_first_batches(dataloader, num_batches)
+
+
+class PrefetchTrainerMixin:
+    """
+    Makes a Trainer build its train/eval loaders as `PrefetchLoader`s.
+
+    When resuming mid-epoch, the Trainer drops the batches already trained on
+    with accelerate's `skip_first_batches`, which only rebuilds torch
+    DataLoaders. `train()` routes that call to `PrefetchLoader.skip_first_batches`.
+    """
+
+    pipeline_workers: Optional[int] = None
+    pipeline_prefetch: int = 8
+
+    def _prefetch_loader(self, dataset: Any, batch_size: int, shuffle: bool, sampler: Any = None) -> PrefetchLoader:
+        return PrefetchLoader(
+            dataset, self.data_collator, batch_size, shuffle=shuffle, sampler=sampler,
+            drop_last=self.args.dataloader_drop_last, num_workers=self.pipeline_workers,
+            prefetch=self.pipeline_prefetch,
+            pin_memory=self.args.dataloader_pin_memory and torch.cuda.is_available(),
+            seed=self.args.seed,
+        )
+
+    def get_train_dataloader(self):
+        return self._prefetch_loader(self.train_dataset, self._train_batch_size, shuffle=True,
+                                     sampler=self._get_train_sampler())
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        return self._prefetch_loader(dataset, self.args.eval_batch_size, shuffle=False)
+
+    def train(self, *args, **kwargs):
+        import transformers.trainer as trainer_module
+
+        original = trainer_module.skip_first_batches
+        trainer_module.skip_first_batches = skip_first_batches
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            trainer_module.skip_first_batches = original
+
+
+class PrefetchSeq2SeqTrainer(PrefetchTrainerMixin, Seq2SeqTrainer):
+    pass
+
+
+class StallLogCallback(TrainerCallback):
+    """Per-step data-stall log (JSONL) plus a running summary at each logging step."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.loader: Optional[PrefetchLoader] = None
+        self._seen_wait = 0.0
+        self._last_end = None
+        self._fh: Optional[io.TextIOBase] = None
+
+    def on_train_begin(self, args, state, control, train_dataloader=None, **kwargs):
+        if isinstance(train_dataloader, PrefetchLoader):
+            self.loader = train_dataloader
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fh = open(self.path, "w")
+        self._last_end = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        stall = 0.0
+        if self.loader is not None:
+            stall = self.loader.stats.wait_s - self._seen_wait
+            self._seen_wait = self.loader.stats.wait_s
+        step_s = now - self._last_end
+        self._last_end = now
+        if self._fh is not None:
+            self._fh.write(json.dumps({"step": state.global_step, "step_s": step_s, "data_stall_s": stall}) + "\n")
+        if args.logging_steps and state.global_step % args.logging_steps == 0 and self.loader is not None:
+            s = self.loader.stats
+            print(f"⏱️  step {state.global_step}: {step_s * 1000:.0f} ms, data stall {stall * 1000:.1f} ms "
+                  f"(avg {s.wait_s / max(s.batches, 1) * 1000:.1f} ms/batch over {s.batches} batches)")
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
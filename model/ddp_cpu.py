@@ -0,0 +1,310 @@
+"""
+Multi-process data-parallel CPU training
+Runs a training script as N gloo DDP ranks, each pinned to a NUMA node with its own threads and data shard
+
+One process with one big thread pool scales poorly past a socket. Threads
+fight over memory bandwidth on the remote node and the pool's
+synchronisation costs grow with its size. The launcher instead starts one
+rank per NUMA node, or several per node on large sockets.
+
+  * each rank gets a slice of one node's physical cores (via `numactl
+    --membind/--physcpubind` when installed, else sched_setaffinity) and a
+    matching thread count;
+  * the standard `RANK` / `WORLD_SIZE` / `MASTER_ADDR` env lets the HF
+    Trainer wrap the model in DDP over gloo, which all-reduces gradients
+    after every backward;
+  * the Trainer's dataloader gives each rank its own shard. Loaders that
+    bypass accelerate (data_pipeline.PrefetchLoader) are sharded by
+    `RankShardTrainerMixin`.
+
+Several machines: run the launcher on each with the same `--nnodes`,
+`--master-addr` and `--master-port` and its own `--node-rank`
+(set GLOO_SOCKET_IFNAME if the hosts have several interfaces).
+
+Usage:
+    python ddp_cpu.py run --nproc 2 -- train.py
+    python ddp_cpu.py run --nproc 2 --nnodes 2 --node-rank 0 --master-addr 10.0.0.1 -- train.py
+    python ddp_cpu.py bench --ranks 1,2,4 --target-wer 40 -- train.py     # samples/s and time-to-WER per rank count
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+from transformers import TrainerCallback
+
+from cpu_fastpath import numa_nodes, physical_cores
+
+
+# -----------------------------
+# Placement
+# -----------------------------
+def rank_placement(nproc: int) -> List[Dict[str, Any]]:
+    """
+    `{"node", "cores"}` for each local rank.
+
+    With at most one rank per NUMA node, each rank owns a whole node. With
+    more ranks than nodes, each node's physical cores are split evenly
+    among its ranks.
+    """
+    nodes = sorted(numa_nodes().items())
+    per_node = math.ceil(nproc / len(nodes))
+    placement = []
+    for node, cpus in nodes:
+        cores = physical_cores(cpus)
+        share = max(1, len(cores) // per_node)
+        for i in range(per_node):
+            if len(placement) == nproc:
+                break
+            placement.append({"node": node, "cores": cores[i * share:(i + 1) * share] or cores})
+    return placement
+
+
+def _cpulist(cores: Sequence[int]) -> str:
+    return ",".join(str(c) for c in cores)
+
+
+def launch(script: Sequence[str], nproc: int, nnodes: int = 1, node_rank: int = 0,
+           master_addr: str = "127.0.0.1", master_port: int = 29500, env: Optional[Dict[str, str]] = None) -> int:
+    """Start `nproc` local ranks of `python <script...>` and wait; returns the first non-zero exit code."""
+    numactl = shutil.which("numactl")
+    world = nproc * nnodes
+    procs = []
+    for local_rank, place in enumerate(rank_placement(nproc)):
+        rank_env = {
+            **os.environ, **(env or {}),
+            "RANK": str(node_rank * nproc + local_rank), "LOCAL_RANK": str(local_rank),
+            "WORLD_SIZE": str(world), "LOCAL_WORLD_SIZE": str(nproc),
+            "MASTER_ADDR": master_addr, "MASTER_PORT": str(master_port),
+            "OMP_NUM_THREADS": str(len(place["cores"])), "DDP_CORES": _cpulist(place["cores"]),
+        }
+        cmd = [sys.executable, *script]
+        preexec = None
+        if numactl:
+            cmd = [numactl, f"--membind={place['node']}", f"--physcpubind={_cpulist(place['cores'])}", *cmd]
+        else:
+            preexec = (lambda cores: lambda: os.sched_setaffinity(0, cores))(place["cores"])
+        print(f"🧵 rank {rank_env['RANK']}/{world}: NUMA node {place['node']}, "
+              f"{len(place['cores'])} cores ({place['cores'][0]}-{place['cores'][-1]})")
+        procs.append(subprocess.Popen(cmd, env=rank_env, preexec_fn=preexec))
+
+    code = 0
+    try:
+        while procs:
+            for p in list(procs):
+                ret = p.poll()
+                if ret is None:
+                    continue
+                procs.remove(p)
+                if ret != 0 and code == 0:
+                    code = ret
+                    for other in procs:  # one rank failing leaves the rest blocked in collectives
+                        other.send_signal(signal.SIGTERM)
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        for p in procs:
+            p.send_signal(signal.SIGINT)
+        raise
+    return code
+
+
+# -----------------------------
+# Rank side
+# -----------------------------
+@dataclass
+class RankInfo:
+    rank: int
+    local_rank: int
+    world_size: int
+    cores: List[int]
+
+    @property
+    def is_main(self) -> bool:
+        return self.rank == 0
+
+    def training_args(self) -> Dict[str, Any]:
+        """Overrides for `Seq2SeqTrainingArguments` under this launcher."""
+        return {"ddp_backend": "gloo", "ddp_find_unused_parameters": False}
+
+
+def init_rank(timeout_s: int = 1800) -> Optional[RankInfo]:
+    """
+    Join the gloo process group when started by the launcher (None otherwise).
+
+    Call before any torch work. It sizes the thread pool to this rank's
+    cores. The group is created here so that `wait_for_main()` can be used
+    before the Trainer exists; the Trainer then reuses it.
+    """
+    world = int(os.getenv("WORLD_SIZE", "1"))
+    if world <= 1:
+        return None
+    cores = [int(c) for c in os.getenv("DDP_CORES", "").split(",") if c] or sorted(os.sched_getaffinity(0))
+    torch.set_num_threads(len(cores))
+    if not torch.distributed.is_initialized():
+        torch.distributed.init_process_group("gloo", timeout=timedelta(seconds=timeout_s))
+    return RankInfo(int(os.environ["RANK"]), int(os.getenv("LOCAL_RANK", "0")), world, cores)
+
+
+def wait_for_main(info: Optional[RankInfo]):
+    """Non-main ranks block here until the main rank calls `release_main()` (e.g. around dataset caching)."""
+    if info is not None and not info.is_main:
+        torch.distributed.barrier()
+
+
+def release_main(info: Optional[RankInfo]):
+    if info is not None and info.is_main:
+        torch.distributed.barrier()
+
+
+class RankShardSampler(torch.utils.data.Sampler):
+    """
+    This rank's batches of `sampler`'s order: consecutive `batch_size` chunks dealt round-robin.
+
+    Whole batches are dealt, so length-bucketed batches stay intact. Every
+    rank gets the same number of batches, so no rank waits in an all-reduce
+    that the others never enter.
+    """
+
+    def __init__(self, sampler: Any, batch_size: int, rank: int, world_size: int):
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.rank = rank
+        self.world_size = world_size
+
+    def set_epoch(self, epoch: int):
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+    def _batches(self) -> int:
+        return math.ceil(len(self.sampler) / self.batch_size) // self.world_size
+
+    def __len__(self) -> int:
+        return self._batches() * self.batch_size
+
+    def __iter__(self):
+        order = list(self.sampler)
+        for b in range(self._batches()):
+            start = (b * self.world_size + self.rank) * self.batch_size
+            yield from order[start:start + self.batch_size]
+
+
+class RankShardTrainerMixin:
+    """Trainer mixin for loaders that accelerate does not shard (PrefetchTrainerMixin): shard the sampler."""
+
+    def _get_train_sampler(self, *args, **kwargs):
+        sampler = super()._get_train_sampler(*args, **kwargs)
+        if self.args.world_size <= 1:
+            return sampler
+        if sampler is None:
+            sampler = torch.utils.data.SequentialSampler(self.train_dataset)
+        return RankShardSampler(sampler, self._train_batch_size, self.args.process_index, self.args.world_size)
+
+
+class RunSummaryCallback(TrainerCallback):
+    """Writes throughput and the wall-clock time of every evaluation to JSON (main rank), for `bench`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.start = None
+        self.evals: List[Dict[str, float]] = []
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start = time.perf_counter()
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        if self.start is not None and metrics:
+            self.evals.append({"elapsed_s": time.perf_counter() - self.start, "step": state.global_step,
+                               "wer": metrics.get("eval_wer")})
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if not state.is_world_process_zero:
+            return
+        elapsed = time.perf_counter() - self.start
+        samples = state.global_step * args.per_device_train_batch_size * args.gradient_accumulation_steps * args.world_size
+        with open(self.path, "w") as f:
+            json.dump({"world_size": args.world_size, "steps": state.global_step, "train_s": elapsed,
+                       "samples_per_s": samples / elapsed, "evals": self.evals}, f, indent=2)
+
+
+# -----------------------------
+# Scaling benchmark
+# -----------------------------
+def bench(script: Sequence[str], ranks: Sequence[int], target_wer: Optional[float] = None,
+          master_port: int = 29500) -> List[Dict[str, Any]]:
+    """Run `script` at each rank count on this machine and collect its `RunSummaryCallback` output."""
+    results = []
+    tmp = tempfile.mkdtemp(prefix="ddp-bench-")
+    for n in ranks:
+        path = os.path.join(tmp, f"ranks-{n}.json")
+        print(f"\n🏁 {n} rank(s)")
+        code = launch(script, n, master_port=master_port + n, env={"DDP_SUMMARY": path})
+        if code != 0 or not os.path.exists(path):
+            results.append({"ranks": n, "failed": True})
+            continue
+        with open(path) as f:
+            summary = json.load(f)
+        hits = [e for e in summary["evals"] if target_wer is not None and e["wer"] is not None and e["wer"] <= target_wer]
+        results.append({
+            "ranks": n, "failed": False, "samples_per_s": summary["samples_per_s"], "train_s": summary["train_s"],
+            "time_to_target_s": hits[0]["elapsed_s"] if hits else None,
+            "final_wer": summary["evals"][-1]["wer"] if summary["evals"] else None,
+        })
+    return results
+
+
+def print_bench(results: Sequence[Dict[str, Any]], target_wer: Optional[float]):
+    base = next((r for r in results if not r["failed"]), None)
+    if base is None:
+        print("❌ Every run failed")
+        return
+    print(f"\n📊 DDP scaling (gloo, NUMA-pinned ranks)")
+    print(f"| ranks | samples/s | speedup | efficiency | train s | time to WER<={target_wer} | final WER |")
+    print("|---:|---:|---:|---:|---:|---:|---:|")
+    for r in results:
+        if r["failed"]:
+            print(f"| {r['ranks']} | failed | | | | | |")
+            continue
+        speedup = r["samples_per_s"] / base["samples_per_s"]
+        ttt = f"{r['time_to_target_s']:.0f}s" if r["time_to_target_s"] is not None else "not reached"
+        wer = f"{r['final_wer']:.2f}" if r["final_wer"] is not None else "-"
+        print(f"| {r['ranks']} | {r['samples_per_s']:.2f} | {speedup:.2f}x | "
+              f"{100 * speedup * base['ranks'] / r['ranks']:.0f}% | {r['train_s']:.0f} | {ttt} | {wer} |")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NUMA-pinned gloo DDP launcher for CPU training")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="Launch this node's ranks")
+    run.add_argument("--nproc", type=int, default=len(numa_nodes()), help="Ranks on this node (default: NUMA nodes)")
+    run.add_argument("--nnodes", type=int, default=1)
+    run.add_argument("--node-rank", type=int, default=0)
+    run.add_argument("--master-addr", default="127.0.0.1")
+    run.add_argument("--master-port", type=int, default=29500)
+    run.add_argument("script", nargs=argparse.REMAINDER, help="-- train.py [args]")
+    b = sub.add_parser("bench", help="1/2/4-rank scaling on this machine")
+    b.add_argument("--ranks", default="1,2,4")
+    b.add_argument("--target-wer", type=float, default=None)
+    b.add_argument("--master-port", type=int, default=29500)
+    b.add_argument("script", nargs=argparse.REMAINDER, help="-- train.py [args]")
+    args = parser.parse_args()
+
+    script = (args.script[1:] if args.script[:1] == ["--"] else args.script) or ["train.py"]
+    if args.cmd == "run":
+        sys.exit(launch(script, args.nproc, args.nnodes, args.node_rank, args.master_addr, args.master_port))
+    results = bench(script, [int(r) for r in args.ranks.split(",")], args.target_wer, args.master_port)
+    print_bench(results, args.target_wer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Checkpoint deltas against the base Whisper model
+Stores only what fine-tuning changed, as int8 or low-rank deltas in one safetensors file, and rebuilds from the cached base
+
+A fine-tuned checkpoint differs from `openai/whisper-tiny`/`-small` in far
+fewer bytes than it stores. With a frozen encoder, half of the tensors are
+bit-identical to the base, and the rest moved by small amounts. `create()`
+compares every tensor with the base:
+
+  * unchanged tensors are skipped;
+  * matrices are stored as `tuned - base`, either int8 with one fp32 scale per
+    row (`int8`) or as a truncated SVD `u @ v` in fp16 (`lowrank`). A
+    low-rank delta falls back to int8 when it would not be smaller, or when
+    it misses more than `lowrank_tol` of the delta's norm;
+  * vectors (biases, LayerNorm) are stored as fp32 deltas, and tensors the
+    base does not have are stored whole.
+
+The delta directory holds `delta.safetensors` plus the checkpoint's config,
+generation config and processor files. `load()` opens the file memory-mapped
+and adds each delta into the base weights in place, one tensor at a time, so
+at no point is a second copy of the model in memory.
+
+Usage:
+    python diff.py create --model ./whisper-tiny-test-final --base openai/whisper-tiny --out ./whisper-tiny-test-delta
+    python diff.py apply --delta ./whisper-tiny-test-delta --out ./whisper-tiny-rebuilt
+"""
+
+import argparse
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional
+
+import torch
+from transformers import WhisperForConditionalGeneration
+
+DELTA_FILE = "delta.safetensors"
+FORMAT = "whisper-delta/1"
+# Everything from the checkpoint directory except its weights
+_SIDECAR_SUFFIXES = (".json", ".txt", ".model", ".tiktoken")
+_WEIGHT_FILES = {"model.safetensors", "model.safetensors.index.json", "pytorch_model.bin", "pytorch_model.bin.index.json"}
+
+
+# -----------------------------
+# Encoding
+# -----------------------------
+def quantize_rows(delta: torch.Tensor):
+    """Symmetric int8 with one fp32 scale per row (dim 0)."""
+    rows = delta.reshape(delta.shape[0], -1)
+    scale = rows.abs().amax(dim=1).clamp_min(1e-12) / 127.0
+    q = torch.round(rows / scale[:, None]).clamp(-127, 127).to(torch.int8)
+    return q.reshape(delta.shape), scale.float()
+
+
+def dequantize_rows(q: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
+    return (q.reshape(q.shape[0], -1).float() * scale[:, None]).reshape(q.shape)
+
+
+def low_rank(delta: torch.Tensor, rank: int, tol: float):
+    """`(u, v)` with `u @ v ~= delta`, or None if it is not both smaller than int8 and within `tol`."""
+    m, n = delta.shape
+    rank = min(rank, m, n)
+    # fp16 factors vs int8 + per-row scale
+    if rank * (m + n) * 2 >= m * n + 4 * m:
+        return None
+    u, s, vh = torch.linalg.svd(delta.float(), full_matrices=False)
+    u, v = u[:, :rank] * s[:rank], vh[:rank]
+    err = torch.linalg.norm(delta - u @ v) / torch.linalg.norm(delta).clamp_min(1e-12)
+    if err > tol:
+        return None
+    return u.half().contiguous(), v.half().contiguous()
+
+
+def encode_delta(base: Dict[str, torch.Tensor], tuned: Dict[str, torch.Tensor], mode: str = "int8",
+                 rank: int = 32, lowrank_tol: float = 0.05):
+    """`(tensors, stats)` to write: entries are named `<param>::<kind>` with kind in q/scale/u/v/d/full."""
+    if mode not in ("int8", "lowrank"):
+        raise ValueError(f"Unknown delta mode {mode!r} (expected int8 or lowrank)")
+    out: Dict[str, torch.Tensor] = {}
+    stats = {"tensors": 0, "skipped": 0, "int8": 0, "lowrank": 0, "dense": 0, "full": 0}
+    for name, t in tuned.items():
+        stats["tensors"] += 1
+        b = base.get(name)
+        if b is not None and b.shape == t.shape and torch.equal(b, t):
+            stats["skipped"] += 1
+            continue
+        if b is None or b.shape != t.shape or not t.is_floating_point():
+            out[f"{name}::full"] = t.contiguous()
+            stats["full"] += 1
+            continue
+        delta = t.float() - b.float()
+        if delta.dim() < 2:
+            out[f"{name}::d"] = delta.contiguous()
+            stats["dense"] += 1
+            continue
+        factors = low_rank(delta, rank, lowrank_tol) if mode == "lowrank" and delta.dim() == 2 else None
+        if factors is not None:
+            out[f"{name}::u"], out[f"{name}::v"] = factors
+            stats["lowrank"] += 1
+        else:
+            out[f"{name}::q"], out[f"{name}::scale"] = quantize_rows(delta)
+            stats["int8"] += 1
+    return out, stats
+
+
+def _unique_state_dict(model: torch.nn.Module) -> Dict[str, torch.Tensor]:
+    # Tied weights (proj_out / embed_tokens) appear once; the other name is re-tied on load
+    seen, state = set(), {}
+    for name, t in model.state_dict().items():
+        if t.data_ptr() in seen:
+            continue
+        seen.add(t.data_ptr())
+        state[name] = t
+    return state
+
+
+def create(model_dir: str, out_dir: str, base: str = "openai/whisper-tiny", mode: str = "int8",
+           rank: int = 32, lowrank_tol: float = 0.05) -> Dict[str, Any]:
+    """Write the delta of `model_dir` against `base` to `out_dir`; returns sizes, counts and rebuild error."""
+    from safetensors.torch import save_file
+
+    tuned_model = WhisperForConditionalGeneration.from_pretrained(model_dir)
+    base_model = WhisperForConditionalGeneration.from_pretrained(base)
+    tuned = _unique_state_dict(tuned_model)
+    start = time.perf_counter()
+    tensors, stats = encode_delta(base_model.state_dict(), tuned, mode=mode, rank=rank, lowrank_tol=lowrank_tol)
+    encode_s = time.perf_counter() - start
+
+    os.makedirs(out_dir, exist_ok=True)
+    meta = {"format": FORMAT, "base": base, "mode": mode, "rank": str(rank)}
+    save_file(tensors, os.path.join(out_dir, DELTA_FILE), metadata=meta)
+    for f in os.listdir(model_dir):
+        if f.endswith(_SIDECAR_SUFFIXES) and f not in _WEIGHT_FILES and os.path.isfile(os.path.join(model_dir, f)):
+            shutil.copy2(os.path.join(model_dir, f), os.path.join(out_dir, f))
+
+    start = time.perf_counter()
+    rebuilt = load(out_dir)
+    load_s = time.perf_counter() - start
+    rebuilt_sd = rebuilt.state_dict()
+    max_err = max((float((rebuilt_sd[k].float() - v.float()).abs().max()) for k, v in tuned.items()
+                   if v.is_floating_point() and v.numel()), default=0.0)
+    return {
+        **stats,
+        "mode": mode,
+        "full_mb": _weights_mb(model_dir),
+        "delta_mb": os.path.getsize(os.path.join(out_dir, DELTA_FILE)) / 1024**2,
+        "max_abs_error": max_err,
+        "encode_s": encode_s,
+        "load_s": load_s,
+    }
+
+
+def _weights_mb(model_dir: str) -> float:
+    return sum(os.path.getsize(os.path.join(model_dir, f)) for f in os.listdir(model_dir)
+               if f.endswith((".safetensors", ".bin"))) / 1024**2
+
+
+# -----------------------------
+# Decoding
+# -----------------------------
+def is_delta_dir(path: str) -> bool:
+    return os.path.exists(os.path.join(path, DELTA_FILE))
+
+
+def load(delta_dir: str, base: Optional[str] = None, torch_dtype: Optional[torch.dtype] = None) -> WhisperForConditionalGeneration:
+    """
+    The fine-tuned model: the base (from the HF cache or a local path) with the deltas added in place.
+
+    `delta.safetensors` is memory-mapped; each entry is read, applied to its
+    parameter and dropped before the next.
+    """
+    from safetensors import safe_open
+    from transformers import GenerationConfig, WhisperConfig
+
+    path = os.path.join(delta_dir, DELTA_FILE)
+    with safe_open(path, framework="pt") as f:
+        meta = f.metadata() or {}
+        if meta.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a {FORMAT} file (format={meta.get('format')!r})")
+        config = WhisperConfig.from_pretrained(delta_dir) if os.path.exists(os.path.join(delta_dir, "config.json")) else None
+        model = WhisperForConditionalGeneration.from_pretrained(base or meta["base"], config=config)
+        params = dict(model.named_parameters(remove_duplicate=False))
+        params.update(dict(model.named_buffers(remove_duplicate=False)))
+        with torch.no_grad():
+            for key in sorted(f.keys()):
+                name, kind = key.rsplit("::", 1)
+                target = params[name]
+                if kind == "full":
+                    target.copy_(f.get_tensor(key))
+                elif kind == "d":
+                    target.add_(f.get_tensor(key).to(target.dtype))
+                elif kind == "q":
+                    target.add_(dequantize_rows(f.get_tensor(key), f.get_tensor(f"{name}::scale")).to(target.dtype))
+                elif kind == "u":
+                    target.add_((f.get_tensor(key).float() @ f.get_tensor(f"{name}::v").float()).to(target.dtype))
+    if os.path.exists(os.path.join(delta_dir, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(delta_dir)
+    if torch_dtype is not None:
+        model = model.to(torch_dtype)
+    return model.eval()
+
+
+def apply(delta_dir: str, out_dir: str, base: Optional[str] = None):
+    """Materialize a full checkpoint directory from a delta (for tools that only read full checkpoints)."""
+    load(delta_dir, base).save_pretrained(out_dir)
+    for f in os.listdir(delta_dir):
+        if f != DELTA_FILE and os.path.isfile(os.path.join(delta_dir, f)) and not os.path.exists(os.path.join(out_dir, f)):
+            shutil.copy2(os.path.join(delta_dir, f), os.path.join(out_dir, f))
+
+
+def describe(r: Dict[str, Any]) -> str:
+    return (f"🧮 Delta ({r['mode']}): {r['delta_mb']:.1f} MB vs {r['full_mb']:.0f} MB full "
+            f"({r['full_mb'] / max(r['delta_mb'], 1e-9):.1f}x smaller); {r['skipped']}/{r['tensors']} tensors unchanged, "
+            f"{r['int8']} int8, {r['lowrank']} low-rank, {r['dense']} dense, {r['full']} full; "
+            f"max abs error {r['max_abs_error']:.2e}, rebuild {r['load_s']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact fine-tuned Whisper checkpoints as deltas against the base")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("create", help="Write a delta directory for a fine-tuned checkpoint")
+    c.add_argument("--model", required=True)
+    c.add_argument("--base", default="openai/whisper-tiny")
+    c.add_argument("--out", default=None, help="Delta dir (default: <model>-delta)")
+    c.add_argument("--mode", choices=("int8", "lowrank"), default="int8")
+    c.add_argument("--rank", type=int, default=32)
+    c.add_argument("--lowrank-tol", type=float, default=0.05)
+    a = sub.add_parser("apply", help="Rebuild a full checkpoint from a delta directory")
+    a.add_argument("--delta", required=True)
+    a.add_argument("--out", required=True)
+    a.add_argument("--base", default=None, help="Base model (default: the one recorded in the delta)")
+    args = parser.parse_args()
+
+    if args.cmd == "create":
+        out = args.out or f"{args.model.rstrip('/')}-delta"
+        print(describe(create(args.model, out, base=args.base, mode=args.mode, rank=args.rank,
+                              lowrank_tol=args.lowrank_tol)))
+        print(f"✅ Wrote {out}")
+    else:
+        start = time.perf_counter()
+        apply(args.delta, args.out, base=args.base)
+        print(f"✅ Rebuilt {args.out} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
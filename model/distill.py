@@ -0,0 +1,274 @@
+"""
+Knowledge distillation from a fine-tuned Whisper teacher
+Teacher top-k logits (and optional pseudo-labels) cached once on disk; the student trains on KL + CE
+
+The teacher, e.g. the whisper-small fine-tuned by finetume_whisper.py, is run
+once over the training set. For every label position it stores the top-k
+logits and their token ids. With `pseudo_labels=True` it first transcribes
+each clip, and its transcript replaces the reference labels. The soft
+targets are then computed on those labels, fed to the teacher behind the
+same `<|startoftranscript|>` + language/task prompt it decodes with.
+Everything lands in `<cache_dir>/teacher-<key>/`, where the key covers the
+teacher weights, the dataset fingerprint and the settings, so later runs
+skip the teacher.
+
+The student (whisper-tiny) trains with
+
+    loss = alpha * T^2 * KL(softmax(teacher_topk / T) || softmax(student / T)) + (1 - alpha) * CE(labels)
+
+The KL is taken over the teacher's top-k tokens. Teacher and student must
+share the tokenizer and mel settings, which all multilingual Whisper sizes
+up to large-v2 do.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers.models.whisper.modeling_whisper import shift_tokens_right
+
+from encoder_cache import weights_fingerprint
+
+
+def check_compatible(teacher: Any, student: Any):
+    """Soft targets only line up if both models share the vocabulary and the log-mel input."""
+    for field in ("vocab_size", "num_mel_bins"):
+        t, s = getattr(teacher.config, field), getattr(student.config, field)
+        if t != s:
+            raise ValueError(f"Teacher and student differ in {field}: {t} vs {s}")
+
+
+class TeacherTargets:
+    """
+    Per-clip teacher outputs, stored flat with row offsets.
+
+    `labels.npy` holds the label ids the logits were computed on. These are
+    the references, or the teacher's transcripts when pseudo-labelling.
+    `topk_ids.npy` (int32) and `topk_logits.npy` (fp16) have one `(k,)` row
+    per label token. `offsets.npy` marks where each clip starts. The arrays
+    are memory-mapped, so the cache costs no RAM.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.top_k = self.meta["top_k"]
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.label_ids = np.load(os.path.join(path, "labels.npy"), mmap_mode="r")
+        self.topk_ids = np.load(os.path.join(path, "topk_ids.npy"), mmap_mode="r")
+        self.topk_logits = np.load(os.path.join(path, "topk_logits.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def labels(self, row: int) -> List[int]:
+        return self.label_ids[self.offsets[row]:self.offsets[row + 1]].tolist()
+
+    def batch(self, rows: Sequence[int], seq_len: int) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Top-k `(ids, logits)` padded to `(B, seq_len, k)`, plus each row's length."""
+        ids = np.zeros((len(rows), seq_len, self.top_k), dtype=np.int64)
+        logits = np.zeros((len(rows), seq_len, self.top_k), dtype=np.float32)
+        lengths = np.zeros(len(rows), dtype=np.int64)
+        for b, r in enumerate(rows):
+            lo, hi = self.offsets[r], self.offsets[r + 1]
+            n = min(hi - lo, seq_len)
+            ids[b, :n] = self.topk_ids[lo:lo + n]
+            logits[b, :n] = self.topk_logits[lo:lo + n]
+            lengths[b] = hi - lo
+        return torch.from_numpy(ids), torch.from_numpy(logits), torch.from_numpy(lengths)
+
+    @classmethod
+    def build(cls, cache_dir: str, dataset: Any, teacher: Any, extract_features: Any, pad_token_id: int,
+              top_k: int = 16, pseudo_labels: bool = False, device: str = "cpu", batch_size: int = 8,
+              fingerprint: Optional[str] = None, generate_kwargs: Optional[Dict[str, Any]] = None,
+              prompt_ids: Sequence[int] = ()) -> "TeacherTargets":
+        """
+        Run `teacher` over `dataset` once (or reuse a previous run's cache).
+
+        `extract_features(rows)` returns padded `input_features` for a list of
+        dataset rows, as for `EncoderStateCache.build`. `generate_kwargs` go to
+        `teacher.generate` when pseudo-labelling (e.g. `language`, `num_beams`).
+        `prompt_ids` (e.g. `<|hi|><|transcribe|><|notimestamps|>`) follow the
+        decoder start token in the teacher's input; the stored targets still
+        cover only the label tokens, so they line up with the student's labels.
+        """
+        generate_kwargs = dict(generate_kwargs or {})
+        fingerprint = fingerprint or getattr(dataset, "_fingerprint", None) or str(len(dataset))
+        settings = json.dumps({"top_k": top_k, "pseudo": pseudo_labels, "generate": generate_kwargs,
+                               "prompt": list(prompt_ids)}, sort_keys=True, default=str)
+        key = hashlib.sha1(f"{weights_fingerprint(teacher)}:{fingerprint}:{settings}".encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"teacher-{key}")
+        if os.path.exists(os.path.join(path, "meta.json")):
+            print(f"🎓 Reusing cached teacher targets: {path}")
+            return cls(path)
+
+        print(f"🎓 Running teacher over {len(dataset)} clips (top-{top_k}"
+              f"{', pseudo-labels' if pseudo_labels else ''}) -> {path}")
+        eot = teacher.generation_config.eos_token_id
+        max_len = teacher.config.max_target_positions
+        start_ids = [teacher.config.decoder_start_token_id] + list(prompt_ids)
+        n_prompt = len(start_ids)
+        teacher = teacher.to(device).eval()
+        dtype = next(teacher.parameters()).dtype
+        offsets, all_labels, all_ids, all_logits = [0], [], [], []
+        relabelled = 0
+        with torch.no_grad():
+            for start in range(0, len(dataset), batch_size):
+                rows = [dataset[i] for i in range(start, min(start + batch_size, len(dataset)))]
+                feats = extract_features(rows).to(device, dtype=dtype)
+                labels = [list(r["labels"]) for r in rows]
+                if pseudo_labels:
+                    generated = teacher.generate(feats, **generate_kwargs)
+                    for b, seq in enumerate(generated.tolist()):
+                        # Whisper's special and timestamp tokens all sit at or above <|endoftext|>
+                        text = [t for t in seq if t < eot][:max_len - n_prompt + 1]
+                        if text and text != labels[b]:
+                            labels[b] = text
+                            relabelled += 1
+                width = max(1, max(len(l) for l in labels))
+                if n_prompt + width - 1 > max_len:
+                    raise ValueError(f"Labels of {width} tokens do not fit behind the {n_prompt}-token teacher prompt "
+                                     f"({max_len} decoder positions)")
+                # Decoder input: start + prompt + labels[:-1]; position n_prompt - 1 + i predicts label i
+                decoder_ids = torch.full((len(rows), n_prompt + width - 1), pad_token_id, dtype=torch.long)
+                decoder_ids[:, :n_prompt] = torch.tensor(start_ids, dtype=torch.long)
+                for b, l in enumerate(labels):
+                    decoder_ids[b, n_prompt:n_prompt + len(l) - 1] = torch.tensor(l[:-1], dtype=torch.long)
+                logits = teacher(input_features=feats, decoder_input_ids=decoder_ids.to(device)).logits
+                logits = logits[:, n_prompt - 1:].float()
+                values, ids = logits.topk(top_k, dim=-1)
+                for b, l in enumerate(labels):
+                    all_labels.append(np.asarray(l, dtype=np.int32))
+                    all_ids.append(ids[b, :len(l)].cpu().numpy().astype(np.int32))
+                    all_logits.append(values[b, :len(l)].cpu().numpy().astype(np.float16))
+                    offsets.append(offsets[-1] + len(l))
+
+        tmp = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        np.save(os.path.join(tmp, "labels.npy"), np.concatenate(all_labels) if all_labels else np.zeros(0, np.int32))
+        np.save(os.path.join(tmp, "topk_ids.npy"), np.concatenate(all_ids) if all_ids else np.zeros((0, top_k), np.int32))
+        np.save(os.path.join(tmp, "topk_logits.npy"),
+                np.concatenate(all_logits) if all_logits else np.zeros((0, top_k), np.float16))
+        # meta.json written last: its presence marks a complete cache
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"rows": len(dataset), "tokens": offsets[-1], "top_k": top_k, "pseudo_labels": pseudo_labels,
+                       "relabelled": relabelled, "teacher": str(getattr(teacher.config, "_name_or_path", ""))}, f)
+        os.replace(tmp, path)
+        if pseudo_labels:
+            print(f"🎓 Teacher transcripts differ from the references on {relabelled}/{len(dataset)} clips")
+        return cls(path)
+
+
+class TeacherTargetDataset(torch.utils.data.Dataset):
+    """
+    Rows of `dataset` tagged with `distill_row` and carrying the labels the teacher targets were built on.
+
+    Wrap the final training dataset (after encoder-row attachment), one row
+    per clip in the order the targets were built. Other attributes
+    (`durations()`, `_fingerprint`, ...) are forwarded to `dataset`.
+    """
+
+    def __init__(self, dataset: Any, targets: TeacherTargets):
+        if len(dataset) != len(targets):
+            raise ValueError(f"Teacher targets cover {len(targets)} clips but the dataset has {len(dataset)} rows")
+        self.dataset = dataset
+        self.targets = targets
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getattr__(self, name: str):
+        if name in ("dataset", "targets"):
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    @property
+    def labels(self) -> List[List[int]]:
+        return [self.targets.labels(i) for i in range(len(self))]
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        row = dict(self.dataset[i])
+        row["labels"] = self.targets.labels(i)
+        row["distill_row"] = i
+        return row
+
+
+@dataclass
+class DistillCollator:
+    """Wraps any collator and passes `distill_row` through as a tensor."""
+    collator: Any
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        batch = self.collator(features)
+        if "distill_row" in features[0]:
+            batch["distill_row"] = torch.tensor([f["distill_row"] for f in features], dtype=torch.long)
+        return batch
+
+
+def distillation_loss(student_logits: torch.Tensor, labels: torch.Tensor, teacher_ids: torch.Tensor,
+                      teacher_logits: torch.Tensor, alpha: float = 0.5, temperature: float = 2.0,
+                      label_smoothing: float = 0.0) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """`(loss, kd, ce)` over the non-padding label positions."""
+    mask = labels != -100
+    logits = student_logits.float()
+    ce = F.cross_entropy(logits[mask], labels[mask], label_smoothing=label_smoothing)
+    t = temperature
+    teacher_p = F.softmax(teacher_logits[mask] / t, dim=-1)
+    student_logp = F.log_softmax(logits[mask] / t, dim=-1).gather(-1, teacher_ids[mask])
+    kd = (teacher_p * (torch.log(teacher_p.clamp_min(1e-12)) - student_logp)).sum(-1).mean() * t * t
+    return alpha * kd + (1.0 - alpha) * ce, kd, ce
+
+
+class DistillationTrainerMixin:
+    """
+    Replaces the training loss by KL to cached teacher targets plus CE.
+
+    Set `trainer.teacher_targets` (plus `distill_alpha` and
+    `distill_temperature`) after construction. Batches without `distill_row`,
+    such as evaluation batches, use the stock loss.
+    """
+
+    teacher_targets: Optional[TeacherTargets] = None
+    distill_alpha: float = 0.5
+    distill_temperature: float = 2.0
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        rows = inputs.pop("distill_row", None)
+        if rows is None or self.teacher_targets is None:
+            return super().compute_loss(model, inputs, return_outputs=return_outputs, **kwargs)
+        # Without labels the model skips its own CE, which distillation_loss computes anyway
+        labels = inputs.pop("labels")
+        if "decoder_input_ids" not in inputs:
+            config = self.model.config
+            inputs["decoder_input_ids"] = shift_tokens_right(labels, config.pad_token_id, config.decoder_start_token_id)
+        outputs = model(**inputs)
+        ids, logits, lengths = self.teacher_targets.batch(rows.tolist(), labels.shape[1])
+        if not torch.equal(lengths.to(labels.device), (labels != -100).sum(1)):
+            raise ValueError("Teacher targets do not match the batch labels; rebuild the teacher cache")
+        loss, kd, ce = distillation_loss(
+            outputs.logits, labels, ids.to(labels.device), logits.to(labels.device),
+            alpha=self.distill_alpha, temperature=self.distill_temperature,
+            label_smoothing=self.args.label_smoothing_factor,
+        )
+        # Summed as tensors (no device sync per micro-batch) and averaged over the logging window
+        sums = getattr(self, "_distill_sums", None)
+        if sums is None:
+            sums = self._distill_sums = {"kd_loss": 0.0, "ce_loss": 0.0, "n": 0}
+        sums["kd_loss"] = sums["kd_loss"] + kd.detach()
+        sums["ce_loss"] = sums["ce_loss"] + ce.detach()
+        sums["n"] += 1
+        return (loss, outputs) if return_outputs else loss
+
+    def log(self, logs: Dict[str, float], *args, **kwargs):
+        sums = getattr(self, "_distill_sums", None)
+        if sums and sums["n"] and "loss" in logs:
+            logs = {**logs, "kd_loss": float(sums["kd_loss"]) / sums["n"], "ce_loss": float(sums["ce_loss"]) / sums["n"]}
+            self._distill_sums = None
+        return super().log(logs, *args, **kwargs)
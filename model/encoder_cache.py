@@ -0,0 +1,130 @@
+"""
+Frozen-encoder output cache
+Runs the Whisper encoder once per clip and trains the decoder from fp16 memory-mapped states
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+
+def encoder_is_deterministic(model: Any) -> bool:
+    """Cached states are only exact if nothing random happens inside the encoder."""
+    cfg = model.config
+    return (
+        not getattr(cfg, "apply_spec_augment", False)
+        and float(getattr(cfg, "dropout", 0.0)) == 0.0
+        and float(getattr(cfg, "attention_dropout", 0.0)) == 0.0
+        and float(getattr(cfg, "activation_dropout", 0.0)) == 0.0
+        and float(getattr(cfg, "encoder_layerdrop", 0.0)) == 0.0
+        and all(not p.requires_grad for p in model.model.encoder.parameters())
+    )
+
+
+def weights_fingerprint(model: Any, module: Any = None) -> str:
+    """Checkpoint name plus a checksum of every parameter of `module` (default: the whole model)."""
+    h = hashlib.sha1()
+    h.update(str(getattr(model.config, "_name_or_path", "")).encode("utf-8"))
+    with torch.no_grad():
+        for name, p in (module if module is not None else model).named_parameters():
+            h.update(name.encode("utf-8"))
+            h.update(f"{p.detach().double().sum().item():.10e}".encode("ascii"))
+    return h.hexdigest()[:16]
+
+
+def _encoder_fingerprint(model: Any) -> str:
+    return weights_fingerprint(model, model.model.encoder)
+
+
+class EncoderStateCache:
+    """`last_hidden_state` for every row of a dataset, stored as an fp16 memmap."""
+
+    def __init__(self, path: str, rows: int, seq_len: int, d_model: int, mode: str = "r"):
+        self.path = path
+        self.shape = (rows, seq_len, d_model)
+        self.states = np.memmap(path, dtype=np.float16, mode=mode, shape=self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def batch(self, rows: List[int], dtype: torch.dtype = torch.float32) -> torch.Tensor:
+        return torch.from_numpy(np.stack([self.states[r] for r in rows])).to(dtype)
+
+    @classmethod
+    def build(cls, cache_dir: str, dataset: Any, model: Any, extract_features: Any,
+              device: str = "cpu", batch_size: int = 8,
+              fingerprint: Optional[str] = None) -> "EncoderStateCache":
+        """
+        Encode `dataset` once (or reuse a previous run's file).
+
+        `extract_features(rows)` must return padded `input_features` for a list
+        of dataset rows, e.g. a collator's feature path. `fingerprint` identifies
+        the dataset contents; it defaults to the `datasets` fingerprint.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        fingerprint = fingerprint or getattr(dataset, "_fingerprint", None) or str(len(dataset))
+        key = hashlib.sha1(f"{_encoder_fingerprint(model)}:{fingerprint}".encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"encoder-{key}.f16")
+        meta_path = path + ".json"
+        d_model = model.config.d_model
+        seq_len = model.config.max_source_positions
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("complete"):
+                print(f"🧊 Reusing cached encoder states: {path}")
+                return cls(path, meta["rows"], meta["seq_len"], meta["d_model"])
+
+        print(f"🧊 Precomputing encoder states for {len(dataset)} clips -> {path}")
+        cache = cls(path, len(dataset), seq_len, d_model, mode="w+")
+        encoder = model.model.encoder.to(device)
+        was_training = encoder.training
+        encoder.eval()
+        with torch.no_grad():
+            for start in range(0, len(dataset), batch_size):
+                rows = [dataset[i] for i in range(start, min(start + batch_size, len(dataset)))]
+                feats = extract_features(rows).to(device, dtype=next(encoder.parameters()).dtype)
+                hidden = encoder(feats).last_hidden_state
+                cache.states[start:start + len(rows)] = hidden.to(torch.float16).cpu().numpy()
+        encoder.train(was_training)
+        cache.states.flush()
+        with open(meta_path, "w") as f:
+            json.dump({"rows": len(dataset), "seq_len": seq_len, "d_model": d_model, "complete": True}, f)
+        return cls(path, len(dataset), seq_len, d_model)
+
+
+def attach_encoder_rows(dataset: Any, offset: int = 0, drop_columns: Sequence[str] = ("audio",)) -> Any:
+    """
+    Replace the audio column by a row index into the encoder cache.
+
+    Non-`datasets` inputs (e.g. `PackedDataset`) must expose their label
+    sequences as `.labels`; they become a plain list of rows.
+    """
+    if not hasattr(dataset, "add_column"):
+        return [{"encoder_row": offset + i, "labels": labels} for i, labels in enumerate(dataset.labels)]
+    dataset = dataset.add_column("encoder_row", list(range(offset, offset + len(dataset))))
+    drop = [c for c in drop_columns if c in dataset.column_names]
+    return dataset.remove_columns(drop) if drop else dataset
+
+
+@dataclass
+class EncoderStateCollator:
+    """Batches cached encoder states as `encoder_outputs`, so the encoder is skipped in forward and generate."""
+    cache: EncoderStateCache
+    processor: Any
+    pad_token_id: int
+    dtype: torch.dtype = torch.float32
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        hidden = self.cache.batch([f["encoder_row"] for f in features], dtype=self.dtype)
+        label_features = [{"input_ids": f["labels"]} for f in features]
+        labels_batch = self.processor.tokenizer.pad(label_features, return_tensors="pt")
+        labels = labels_batch["input_ids"].masked_fill(labels_batch["input_ids"] == self.pad_token_id, -100)
+        return {"encoder_outputs": BaseModelOutput(last_hidden_state=hidden), "labels": labels}
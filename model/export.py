@@ -0,0 +1,316 @@
+"""
+Inference export: ONNX (optimum) and CTranslate2, int8 on CPU
+Converts a fine-tuned checkpoint, checks WER parity against PyTorch and compares latency/memory
+
+Every engine sits behind the same `Backend.transcribe(audio)` /
+`Backend.generate_text(features)` interface. `load_backend("pytorch" |
+"onnx" | "onnx-int8" | "ct2-int8" | "pytorch-int8", path)` returns one, so
+callers can swap engines without changing code (pytorch-int8 artifacts come
+from quantize.py).
+
+Optional dependencies (a backend is skipped if its package is missing):
+    pip install "optimum[onnxruntime]"      # onnx, onnx-int8
+    pip install ctranslate2                 # ct2-int8
+
+Usage:
+    python export.py --model ./whisper-finetuned-medical --subset en --samples 50
+"""
+
+import abc
+import argparse
+import glob
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+from asr_metrics import ErrorRateAccumulator
+from inference import SAMPLING_RATE, load_processor
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+_WEIGHT_FILES = {
+    "pytorch": ["*.safetensors", "*.bin"],
+    "onnx": ["encoder_model.onnx*", "decoder_model.onnx*", "decoder_with_past_model.onnx*"],
+    "onnx-int8": ["*_quantized.onnx"],
+    "ct2-int8": ["model.bin"],
+}
+
+
+def weights_size_mb(kind: str, path: str) -> float:
+    files = {p for pattern in _WEIGHT_FILES[kind] for p in glob.glob(os.path.join(path, pattern))}
+    return sum(os.path.getsize(p) for p in files) / 1024**2
+
+
+# -----------------------------
+# Backends
+# -----------------------------
+class Backend(abc.ABC):
+    """Log-mel features (or raw 16 kHz audio) in, text out."""
+
+    name = "base"
+
+    def __init__(self, path: str, processor: Any, num_beams: int = 1, max_length: int = 225,
+                 language: Optional[str] = None):
+        self.path = path
+        self.processor = processor
+        self.num_beams = num_beams
+        self.max_length = max_length
+        self.language = language  # None: the engine detects it
+
+    def _lang_kwargs(self) -> Dict[str, str]:
+        return {"language": self.language, "task": "transcribe"} if self.language else {}
+
+    @abc.abstractmethod
+    def generate_ids(self, features: np.ndarray) -> List[List[int]]:
+        """Token ids for a (batch, n_mels, frames) float32 feature array."""
+
+    def generate_text(self, features: np.ndarray) -> List[str]:
+        ids = self.generate_ids(np.ascontiguousarray(features, dtype=np.float32))
+        return [t.strip() for t in self.processor.tokenizer.batch_decode(ids, skip_special_tokens=True)]
+
+    def transcribe(self, audio: Sequence[np.ndarray]) -> List[str]:
+        feats = self.processor.feature_extractor(list(audio), sampling_rate=SAMPLING_RATE, return_tensors="np")
+        return self.generate_text(feats.input_features)
+
+
+class PyTorchBackend(Backend):
+    name = "pytorch"
+
+    def __init__(self, path: str, processor: Any, **kwargs: Any):
+        super().__init__(path, processor, **kwargs)
+        from transformers import WhisperForConditionalGeneration
+
+        self.model = WhisperForConditionalGeneration.from_pretrained(path).eval()
+        self.model.config.use_cache = True
+
+    @torch.inference_mode()
+    def generate_ids(self, features: np.ndarray) -> List[List[int]]:
+        out = self.model.generate(torch.from_numpy(features), num_beams=self.num_beams,
+                                  max_length=self.max_length, use_cache=True, **self._lang_kwargs())
+        return out.tolist()
+
+
+class OnnxBackend(Backend):
+    """optimum's ORTModelForSpeechSeq2Seq: encoder + decoder + decoder-with-past graphs."""
+
+    name = "onnx"
+
+    def __init__(self, path: str, processor: Any, quantized: bool = False, **kwargs: Any):
+        super().__init__(path, processor, **kwargs)
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+
+        files = {}
+        if quantized:
+            self.name = "onnx-int8"
+            files = {
+                "encoder_file_name": "encoder_model_quantized.onnx",
+                "decoder_file_name": "decoder_model_quantized.onnx",
+                "decoder_with_past_file_name": "decoder_with_past_model_quantized.onnx",
+            }
+        self.model = ORTModelForSpeechSeq2Seq.from_pretrained(path, use_cache=True, provider="CPUExecutionProvider", **files)
+
+    def generate_ids(self, features: np.ndarray) -> List[List[int]]:
+        out = self.model.generate(input_features=torch.from_numpy(features), num_beams=self.num_beams,
+                                  max_length=self.max_length, **self._lang_kwargs())
+        return out.tolist()
+
+
+class CT2Backend(Backend):
+    name = "ct2-int8"
+
+    def __init__(self, path: str, processor: Any, compute_type: str = "int8", threads: int = 0, **kwargs: Any):
+        super().__init__(path, processor, **kwargs)
+        import ctranslate2
+
+        self._ct2 = ctranslate2
+        self.model = ctranslate2.models.Whisper(path, device="cpu", compute_type=compute_type, intra_threads=threads)
+
+    def generate_ids(self, features: np.ndarray) -> List[List[int]]:
+        feats = self._ct2.StorageView.from_array(features)
+        if self.language:
+            langs = [f"<|{self.language}|>"] * len(features)
+        else:
+            langs = [r[0][0] for r in self.model.detect_language(feats)]
+        prompts = [["<|startoftranscript|>", lang, "<|transcribe|>", "<|notimestamps|>"] for lang in langs]
+        results = self.model.generate(feats, prompts, beam_size=self.num_beams, max_length=self.max_length)
+        return [r.sequences_ids[0] for r in results]
+
+
+def load_backend(kind: str, path: str, processor: Any, **kwargs: Any) -> Backend:
+    if kind == "pytorch":
+        return PyTorchBackend(path, processor, **kwargs)
+    if kind == "onnx":
+        return OnnxBackend(path, processor, **kwargs)
+    if kind == "onnx-int8":
+        return OnnxBackend(path, processor, quantized=True, **kwargs)
+    if kind == "ct2-int8":
+        return CT2Backend(path, processor, **kwargs)
+    if kind == "pytorch-int8":
+        from quantize import QuantizedBackend
+        return QuantizedBackend(path, processor, **kwargs)
+    raise ValueError(f"Unknown backend {kind!r}")
+
+
+def transcribe(audio: Sequence[np.ndarray], backend: Backend) -> List[str]:
+    """Backend-agnostic entry point: 16 kHz float32 clips in, transcripts out."""
+    return backend.transcribe(audio)
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def export_onnx(model_dir: str, out_dir: str, quantize: bool = True) -> str:
+    """Export encoder / decoder / decoder-with-past to ONNX, plus dynamic int8 copies of each graph."""
+    from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+
+    model = ORTModelForSpeechSeq2Seq.from_pretrained(model_dir, export=True, use_cache=True)
+    model.save_pretrained(out_dir)
+    load_processor(model_dir).save_pretrained(out_dir)
+    if quantize:
+        from optimum.onnxruntime import ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        for name in ("encoder_model.onnx", "decoder_model.onnx", "decoder_with_past_model.onnx"):
+            ORTQuantizer.from_pretrained(out_dir, file_name=name).quantize(save_dir=out_dir, quantization_config=qconfig)
+    return out_dir
+
+
+def export_ct2(model_dir: str, out_dir: str, quantization: str = "int8") -> str:
+    """Convert to CTranslate2 with int8 weights (also loadable by faster-whisper)."""
+    from ctranslate2.converters import TransformersConverter
+
+    processor = load_processor(model_dir)
+    staged = model_dir
+    if not os.path.exists(os.path.join(model_dir, "tokenizer.json")):
+        # Checkpoints saved with only the feature extractor: stage a copy with the full processor
+        staged = f"{out_dir}.src"
+        shutil.copytree(model_dir, staged, dirs_exist_ok=True)
+        processor.save_pretrained(staged)
+    copy = [f for f in ("tokenizer.json", "preprocessor_config.json") if os.path.exists(os.path.join(staged, f))]
+    TransformersConverter(staged, copy_files=copy).convert(out_dir, quantization=quantization, force=True)
+    if staged != model_dir:
+        shutil.rmtree(staged, ignore_errors=True)
+    return out_dir
+
+
+# -----------------------------
+# Parity + comparison
+# -----------------------------
+def evaluate_backend(backend: Backend, rows: Iterable[Dict[str, Any]], batch_size: int = 1) -> Dict[str, float]:
+    """WER/CER and per-utterance latency over rows of `{"input_features", "labels"}`."""
+    acc = ErrorRateAccumulator(backend.processor.tokenizer)
+    latencies = []
+    rows = list(rows)
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        feats = np.stack([np.asarray(r["input_features"], dtype=np.float32) for r in batch])
+        start = time.perf_counter()
+        hyps = backend.generate_text(feats)
+        latencies.append((time.perf_counter() - start) / len(batch))
+        refs = backend.processor.tokenizer.batch_decode([r["labels"] for r in batch], skip_special_tokens=True)
+        acc.update_text(hyps, refs)
+    lat = np.asarray(latencies) * 1000
+    return {**acc.compute(), "latency_ms_mean": float(lat.mean()), "latency_ms_p50": float(np.percentile(lat, 50)),
+            "latency_ms_p95": float(np.percentile(lat, 95))}
+
+
+def compare(model_dir: str, rows: Sequence[Dict[str, Any]], export_root: Optional[str] = None,
+            backends: Sequence[str] = ("onnx", "ct2"), num_beams: int = 1, language: Optional[str] = None,
+            max_wer_delta: float = 1.0) -> List[Dict[str, Any]]:
+    """
+    Export, then score PyTorch and every exported engine on `rows` and print the comparison table.
+
+    Each exported engine is flagged `parity_ok` when its WER is within
+    `max_wer_delta` points of PyTorch.
+    """
+    export_root = export_root or f"{model_dir.rstrip('/')}-export"
+    processor = load_processor(model_dir)
+    targets = [("pytorch", model_dir)]
+    if "onnx" in backends:
+        try:
+            path = export_onnx(model_dir, os.path.join(export_root, "onnx"))
+            targets += [("onnx", path), ("onnx-int8", path)]
+        except ImportError as err:
+            print(f"⚠️ Skipping ONNX export ({err}); pip install 'optimum[onnxruntime]'")
+    if "ct2" in backends:
+        try:
+            targets.append(("ct2-int8", export_ct2(model_dir, os.path.join(export_root, "ct2-int8"))))
+        except ImportError as err:
+            print(f"⚠️ Skipping CTranslate2 export ({err}); pip install ctranslate2")
+
+    table: List[Dict[str, Any]] = []
+    for kind, path in targets:
+        before = _rss_mb()
+        start = time.perf_counter()
+        backend = load_backend(kind, path, processor, num_beams=num_beams, language=language)
+        load_s = time.perf_counter() - start
+        backend.generate_text(np.asarray(rows[0]["input_features"], dtype=np.float32)[None])  # warm-up
+        res = evaluate_backend(backend, rows)
+        table.append({"backend": kind, "size_mb": weights_size_mb(kind, path), "load_s": load_s,
+                      "rss_mb": _rss_mb() - before, **res})
+        del backend
+
+    ref = table[0]["wer"]
+    for row in table:
+        row["wer_delta"] = row["wer"] - ref
+        row["parity_ok"] = abs(row["wer_delta"]) <= max_wer_delta
+    print_table(table, len(rows))
+    return table
+
+
+def print_table(table: Sequence[Dict[str, Any]], n: int):
+    print(f"\n📊 Inference backends on {n} eval utterances (batch 1, CPU)")
+    print("| backend | size MB | load s | +RSS MB | latency ms (mean / p50 / p95) | WER | ΔWER | CER | parity |")
+    print("|---|---:|---:|---:|---:|---:|---:|---:|:---:|")
+    for r in table:
+        print(f"| {r['backend']} | {r['size_mb']:.0f} | {r['load_s']:.1f} | {r['rss_mb']:.0f} | "
+              f"{r['latency_ms_mean']:.0f} / {r['latency_ms_p50']:.0f} / {r['latency_ms_p95']:.0f} | "
+              f"{r['wer']:.2f} | {r['wer_delta']:+.2f} | {r['cer']:.2f} | {'✅' if r['parity_ok'] else '❌'} |")
+
+
+def eval_rows(dataset_id: str, subset: str, samples: int, processor: Any, split: str = "test",
+              test_size: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Features + labels for `samples` clips; with `test_size`, from the held-out part of a.py's split."""
+    from datasets import load_dataset, Audio
+
+    ds = load_dataset(dataset_id, subset, split=split)
+    if test_size:
+        ds = ds.train_test_split(test_size=test_size, seed=42)["test"]
+    ds = ds.select(range(min(samples, len(ds))))
+    ds = ds.cast_column("audio", Audio(sampling_rate=SAMPLING_RATE))
+    rows = []
+    for r in ds:
+        feats = processor.feature_extractor(r["audio"]["array"], sampling_rate=SAMPLING_RATE).input_features[0]
+        rows.append({"input_features": feats, "labels": processor.tokenizer(r["text"]).input_ids})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a fine-tuned Whisper checkpoint and compare inference engines")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--out", default=None, help="Export root (default: <model>-export)")
+    parser.add_argument("--backends", default="onnx,ct2")
+    parser.add_argument("--dataset", default="ekacare/eka-medical-asr-evaluation-dataset")
+    parser.add_argument("--subset", default="en")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--beams", type=int, default=1)
+    parser.add_argument("--language", default=None, help="e.g. en; default: each engine detects it")
+    parser.add_argument("--max-wer-delta", type=float, default=1.0)
+    args = parser.parse_args()
+
+    rows = eval_rows(args.dataset, args.subset, args.samples, load_processor(args.model))
+    compare(args.model, rows, args.out, backends=args.backends.split(","), num_beams=args.beams,
+            language=args.language, max_wer_delta=args.max_wer_delta)
+
+
+if __name__ == "__main__":
+    main()
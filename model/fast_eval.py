@@ -0,0 +1,167 @@
+"""
+Fast batched evaluation
+Generate-based eval with the KV cache on, length-sorted batches and greedy/beam chosen per run
+
+Training keeps `use_cache=False` (needed with gradient checkpointing), which
+`Seq2SeqTrainer` carries into eval, so every generated token re-runs the
+whole decoder prefix. This engine turns the cache back on for the duration
+of `evaluate()` only. Clips are batched in order of audio length (or label
+length), so sequences in a batch finish at about the same step.
+
+Search and batch size come from the training arguments
+(`generation_num_beams`, `per_device_eval_batch_size`); the scripts expose
+them as EVAL_BEAMS (1 = greedy) and EVAL_BATCH so they can be picked per run.
+
+With several ranks (ddp_cpu.py) the length-sorted batches are dealt
+round-robin, so each rank generates over 1/N of the eval set. The
+`ErrorRateAccumulator` hook then sums its counters across ranks; without the
+hook, predictions are gathered to every rank before `compute_metrics`.
+"""
+
+import math
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+from transformers import EvalPrediction
+
+from length_sampler import label_lengths
+
+
+def eval_order(dataset: Any) -> List[int]:
+    """Indices sorted longest-first by audio duration, falling back to label length; never decodes audio."""
+    keys = None
+    if hasattr(dataset, "durations"):
+        keys = list(dataset.durations())
+    elif "duration" in getattr(dataset, "column_names", []):
+        keys = [float(d) for d in dataset["duration"]]
+    else:
+        try:
+            keys = label_lengths(dataset)
+        except (KeyError, TypeError, ValueError):
+            pass
+    if keys is None:
+        return list(range(len(dataset)))
+    return sorted(range(len(dataset)), key=lambda i: keys[i], reverse=True)
+
+
+def _pad_rows(rows: List[np.ndarray], value: int) -> np.ndarray:
+    width = max((r.shape[-1] for r in rows), default=0)
+    out = np.full((sum(r.shape[0] for r in rows), width), value, dtype=np.int64)
+    n = 0
+    for r in rows:
+        out[n:n + r.shape[0], :r.shape[-1]] = r
+        n += r.shape[0]
+    return out
+
+
+class FastEvalTrainerMixin:
+    """
+    Trainer mixin replacing `evaluate()` with a cached-KV, length-batched generate loop.
+
+    Predictions and labels go to the usual `compute_metrics(EvalPrediction)`,
+    and the same WER/CER keys come back together with throughput numbers
+    (`*_samples_per_second`, `*_tokens_per_second`, `*_audio_seconds_per_second`).
+    """
+
+    def _eval_generation_kwargs(self, gen_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        kwargs = dict(gen_kwargs)
+        kwargs["num_beams"] = kwargs.get("num_beams") or self.args.generation_num_beams or 1
+        if "max_length" not in kwargs and "max_new_tokens" not in kwargs and self.args.generation_max_length:
+            kwargs["max_length"] = self.args.generation_max_length
+        kwargs["use_cache"] = True
+        return kwargs
+
+    def _eval_shard(self, order: List[int], batch_size: int) -> List[int]:
+        """This rank's whole batches of `order`, dealt round-robin."""
+        rank, world = self.args.process_index, self.args.world_size
+        if world <= 1:
+            return order
+        return [i for b in range(rank * batch_size, len(order), world * batch_size) for i in order[b:b + batch_size]]
+
+    def _eval_batches(self, dataset: Any, batch_size: int):
+        order = self._eval_shard(eval_order(dataset), batch_size)
+        if hasattr(self, "_prefetch_loader"):
+            # PrefetchTrainerMixin: decode/collate in its thread pool, in our order
+            return self._prefetch_loader(dataset, batch_size, shuffle=False, sampler=order)
+        return torch.utils.data.DataLoader(
+            dataset, batch_size=batch_size, sampler=order, collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers, pin_memory=self.args.dataloader_pin_memory,
+        )
+
+    def _sum_across_ranks(self, value: float) -> float:
+        t = torch.tensor([value], dtype=torch.float64, device="cpu" if self.args.ddp_backend == "gloo" else self.args.device)
+        torch.distributed.all_reduce(t)
+        return float(t.item())
+
+    def evaluate(self, eval_dataset=None, ignore_keys=None, metric_key_prefix: str = "eval", **gen_kwargs):
+        dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        batch_size = self.args.eval_batch_size
+        kwargs = self._eval_generation_kwargs(gen_kwargs)
+        pad_id = self.model.config.pad_token_id
+        if pad_id is None:
+            pad_id = self.model.config.eos_token_id
+
+        model = self.model
+        was_training = model.training
+        saved_cache = (model.config.use_cache, model.generation_config.use_cache)
+        model.eval()
+        model.config.use_cache = model.generation_config.use_cache = True
+
+        preds, labels = [], []
+        tokens = 0
+        start = time.perf_counter()
+        try:
+            with torch.inference_mode():
+                for batch in self._eval_batches(dataset, batch_size):
+                    batch = self._prepare_inputs(batch)
+                    batch_labels = batch.pop("labels", None)
+                    with self.autocast_smart_context_manager():
+                        out = model.generate(**batch, **kwargs)
+                    out = out.sequences if hasattr(out, "sequences") else out
+                    tokens += int((out != pad_id).sum())
+                    if self.preprocess_logits_for_metrics is not None and batch_labels is not None:
+                        out = self.preprocess_logits_for_metrics(out, batch_labels)
+                    preds.append(out.cpu().numpy())
+                    if batch_labels is not None:
+                        labels.append(batch_labels.cpu().numpy())
+        finally:
+            model.config.use_cache, model.generation_config.use_cache = saved_cache
+            if was_training:
+                model.train()
+        distributed = self.args.world_size > 1
+        if distributed:
+            # Wait for the slowest rank, so runtime and throughput cover the whole eval set
+            torch.distributed.barrier()
+            tokens = int(self._sum_across_ranks(tokens))
+        runtime = time.perf_counter() - start
+
+        metrics: Dict[str, float] = {}
+        if self.compute_metrics is not None and (labels or distributed):
+            if distributed and self.preprocess_logits_for_metrics is None:
+                gathered = [None] * self.args.world_size
+                torch.distributed.all_gather_object(gathered, (preds, labels))
+                preds = [p for rank_preds, _ in gathered for p in rank_preds]
+                labels = [l for _, rank_labels in gathered for l in rank_labels]
+            pred = EvalPrediction(predictions=_pad_rows(preds, pad_id), label_ids=_pad_rows(labels, -100))
+            metrics.update(self.compute_metrics(pred))  # every rank: the metric reduces its counters across ranks
+        n = len(dataset)
+        metrics.update({
+            "runtime": round(runtime, 4),
+            "samples_per_second": round(n / runtime, 3),
+            "steps_per_second": round(math.ceil(n / batch_size) / runtime, 3),
+            "tokens_per_second": round(tokens / runtime, 3),
+            "num_beams": kwargs["num_beams"],
+        })
+        if hasattr(dataset, "durations"):
+            metrics["audio_seconds_per_second"] = round(sum(dataset.durations()) / runtime, 3)
+        metrics = {f"{metric_key_prefix}_{k}": v for k, v in metrics.items()}
+        if self.is_world_process_zero():
+            print(f"🧪 Eval: {n} clips in {runtime:.1f}s ({n / runtime:.2f} clips/s, {tokens / runtime:.0f} tokens/s, "
+                  f"batch={batch_size}, beams={kwargs['num_beams']}, kv-cache on"
+                  f"{f', {self.args.world_size} ranks' if distributed else ''})")
+
+        self.log(metrics)
+        self.control = self.callback_handler.on_evaluate(self.args, self.state, self.control, metrics)
+        return metrics
@@ -0,0 +1,195 @@
+"""
+Persistent log-mel feature cache
+Content-hashed, memory-mapped shards so Whisper features are computed once per clip
+"""
+
+import atexit
+import glob
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Feature-extractor fields that change the produced log-mel values.
+# `mel_filters` is derived from these, so it is left out of the key.
+_CONFIG_SKIP_KEYS = {"mel_filters", "processor_class", "feature_extractor_type"}
+
+
+def extractor_config_key(feature_extractor: Any, sampling_rate: int, **call_kwargs) -> str:
+    """Hash of the extractor settings, input sampling rate and call arguments."""
+    config = {k: v for k, v in feature_extractor.to_dict().items() if k not in _CONFIG_SKIP_KEYS}
+    payload = json.dumps(
+        {"extractor": config, "sampling_rate": int(sampling_rate), "call": call_kwargs},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def audio_key(array: Any, sampling_rate: int) -> str:
+    """Content hash of a single waveform."""
+    data = np.ascontiguousarray(array, dtype=np.float32)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(int(sampling_rate)).encode("ascii"))
+    h.update(data.tobytes())
+    return h.hexdigest()
+
+
+def _publish(tmp: str, path: str):
+    """Move `tmp` to `path`, raising FileExistsError instead of replacing an existing file."""
+    try:
+        os.link(tmp, path)  # atomic, and fails if `path` exists
+    finally:
+        os.unlink(tmp)
+
+
+class FeatureCache:
+    """
+    On-disk cache of `input_features` keyed by audio hash.
+
+    Layout: `<root>/<config_key>/shard-<uuid>.npy` holds a stacked float32
+    array and `shard-<uuid>.json` lists the audio keys of its rows. The JSON
+    sidecar is written last, so a shard only becomes visible once complete.
+    Shard names are random and a shard is never overwritten, so several writer
+    processes (or a later run that reuses a PID) never touch an existing file.
+    Changing the sampling rate or any extractor setting yields a new
+    `config_key`, i.e. a fresh cache.
+    """
+
+    def __init__(self, root: str, config_key: str, shard_size: int = 64):
+        self.root = root
+        self.config_key = config_key
+        self.dir = os.path.join(root, config_key)
+        self.shard_size = shard_size
+        self.hits = 0
+        self.misses = 0
+        self._index: Dict[str, Tuple[str, int]] = {}
+        self._shards: Dict[str, np.ndarray] = {}
+        self._pending: Dict[str, np.ndarray] = {}
+        os.makedirs(self.dir, exist_ok=True)
+        self._load_index()
+        atexit.register(self.flush)
+
+    @classmethod
+    def for_extractor(cls, root: str, feature_extractor: Any, sampling_rate: int,
+                      shard_size: int = 64, **call_kwargs) -> "FeatureCache":
+        key = extractor_config_key(feature_extractor, sampling_rate, **call_kwargs)
+        cache = cls(root, key, shard_size=shard_size)
+        meta_path = os.path.join(cache.dir, "meta.json")
+        if not os.path.exists(meta_path):
+            with open(meta_path, "w") as f:
+                json.dump({"sampling_rate": int(sampling_rate), "call": call_kwargs}, f, default=str)
+        return cache
+
+    # -----------------------------
+    # Index / shard handling
+    # -----------------------------
+    def _load_index(self):
+        for sidecar in sorted(glob.glob(os.path.join(self.dir, "shard-*.json"))):
+            shard = sidecar[:-len(".json")] + ".npy"
+            if not os.path.exists(shard):
+                continue
+            with open(sidecar) as f:
+                keys = json.load(f)
+            for row, key in enumerate(keys):
+                self._index.setdefault(key, (shard, row))
+
+    def _shard(self, path: str) -> np.ndarray:
+        arr = self._shards.get(path)
+        if arr is None:
+            arr = np.load(path, mmap_mode="r")
+            self._shards[path] = arr
+        return arr
+
+    def __len__(self) -> int:
+        return len(self._index) + len(self._pending)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._pending or key in self._index
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return a read-only, zero-copy view of the cached features (or None)."""
+        if key in self._pending:
+            return self._pending[key]
+        loc = self._index.get(key)
+        if loc is None:
+            return None
+        shard, row = loc
+        return self._shard(shard)[row]
+
+    def put(self, key: str, features: np.ndarray):
+        if key in self:
+            return
+        self._pending[key] = np.asarray(features, dtype=np.float32)
+        if len(self._pending) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Write pending features to a new shard."""
+        if not self._pending:
+            return
+        keys = list(self._pending)
+        stacked = np.stack([self._pending[k] for k in keys])
+        base = os.path.join(self.dir, f"shard-{uuid.uuid4().hex}")
+        with open(base + ".npy.tmp", "wb") as f:
+            np.save(f, stacked)
+        _publish(base + ".npy.tmp", base + ".npy")
+        with open(base + ".json.tmp", "w") as f:
+            json.dump(keys, f)
+        _publish(base + ".json.tmp", base + ".json")
+        for row, key in enumerate(keys):
+            self._index[key] = (base + ".npy", row)
+        self._pending.clear()
+
+    # -----------------------------
+    # Batch lookup used by collators
+    # -----------------------------
+    def get_or_compute(self, arrays: Sequence[Any], sampling_rate: int,
+                       compute: Callable[[List[Any]], np.ndarray]) -> np.ndarray:
+        """
+        Features for `arrays`, computing only the cache misses.
+
+        `compute` receives the list of missing waveforms and must return an
+        array of shape (len(missing), n_mels, n_frames).
+        """
+        keys = [audio_key(a, sampling_rate) for a in arrays]
+        out: List[Optional[np.ndarray]] = [self.get(k) for k in keys]
+        missing = [i for i, feat in enumerate(out) if feat is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            computed = compute([arrays[i] for i in missing])
+            for i, feat in zip(missing, computed):
+                self.put(keys[i], feat)
+                out[i] = feat
+        return np.stack(out)
+
+    # -----------------------------
+    # Reporting / maintenance
+    # -----------------------------
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "entries": len(self),
+        }
+
+    def summary(self) -> str:
+        s = self.stats()
+        return (f"🗃️  Feature cache [{self.config_key}]: {s['hits']} hits / {s['misses']} misses "
+                f"({s['hit_rate'] * 100:.1f}% hit rate, {s['entries']} entries)")
+
+    def prune_stale(self) -> List[str]:
+        """Delete cache directories built with a different extractor config."""
+        removed = []
+        for path in glob.glob(os.path.join(self.root, "*")):
+            if os.path.isdir(path) and os.path.basename(path) != self.config_key:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+        return removed
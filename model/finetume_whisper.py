@@ -1,3 +1,4 @@
+import os
 import torch
 from datasets import load_dataset, Audio
 from transformers import (
@@ -8,8 +9,15 @@ from transformers import (
     Seq2SeqTrainingArguments,
     Seq2SeqTrainer,
 )
-import evaluate
-import numpy as np
+from dataclasses import dataclass
+from typing import Any, Dict, List, Union
+from fast_features import make_prepare_batch, default_num_proc
+from asr_metrics import ErrorRateAccumulator
+from streaming import load_streaming_splits, lazy_map, materialize
+from profiler import maybe_add_profiler
+from export import compare as compare_backends
+from lora import apply_lora, save_adapter_and_merge, trainable_summary
+from diff import create as create_delta, describe as describe_delta
 
 # -----------------------------
 # 1️⃣ Configuration
@@ -21,17 +29,29 @@ dataset_id = "ekacare/eka-medical-asr-evaluation-dataset"
 dataset_subset = "en"                    # use the English subset
 num_train_samples = 3000                 # you may train on ~3,600 samples (use less or more depending on compute)
 eval_samples = 200                       # small eval set
+# Streaming mode: no full download/map before step 1, memory stays flat (STREAMING=1)
+streaming = os.getenv("STREAMING", "0") != "0"
+dataset_subsets = os.getenv("DATASET_SUBSETS", dataset_subset).split(",")  # e.g. "en,hi" (streaming only; ignores num_train_samples)
+shuffle_buffer = int(os.getenv("SHUFFLE_BUFFER", "500"))
+# LoRA adapters instead of updating every weight (LORA=1); adapter saved to ./whisper-finetuned-medical-adapter
+lora = os.getenv("LORA", "0") != "0"
 
 # -----------------------------
 # 2️⃣ Load dataset
 # -----------------------------
-dataset = load_dataset(dataset_id, dataset_subset, split="train")  # check if “train” exists; else use “test” or full
-dataset = dataset.cast_column("audio", Audio(sampling_rate=16000))
-dataset = dataset.shuffle(seed=42).select(range(num_train_samples))
+if streaming:
+    train_dataset, eval_dataset = load_streaming_splits(
+        dataset_id, dataset_subsets, split="train", eval_samples=eval_samples,
+        shuffle_buffer=shuffle_buffer, seed=42,
+    )
+else:
+    dataset = load_dataset(dataset_id, dataset_subset, split="train")  # check if “train” exists; else use “test” or full
+    dataset = dataset.cast_column("audio", Audio(sampling_rate=16000))
+    dataset = dataset.shuffle(seed=42).select(range(num_train_samples))
 
-# Separate out an eval set
-eval_dataset = dataset.select(range(eval_samples))
-train_dataset = dataset.select(range(eval_samples, len(dataset)))
+    # Separate out an eval set
+    eval_dataset = dataset.select(range(eval_samples))
+    train_dataset = dataset.select(range(eval_samples, len(dataset)))
 
 # -----------------------------
 # 3️⃣ Load processor
@@ -53,8 +73,45 @@ def prepare_batch(batch):
     batch["labels"] = tokenizer(batch["text"]).input_ids
     return batch
 
-train_dataset = train_dataset.map(prepare_batch, remove_columns=train_dataset.column_names)
-eval_dataset = eval_dataset.map(prepare_batch, remove_columns=eval_dataset.column_names)
+# Batched log-mel extraction across worker processes (BATCHED_FEATURES=0 restores the per-example map)
+map_kwargs = {}
+if os.getenv("BATCHED_FEATURES", "1") != "0":
+    num_proc = default_num_proc()
+    prepare_batch = make_prepare_batch(feature_extractor, tokenizer, torch_threads=1 if num_proc > 1 else None)
+    map_kwargs = {"batched": True, "batch_size": 32, "num_proc": num_proc if num_proc > 1 else None}
+
+if streaming:
+    # Features are computed lazily as the trainer pulls examples; only the small eval split is cached
+    batched = bool(map_kwargs)
+    train_dataset = lazy_map(train_dataset, prepare_batch, batched=batched)
+    eval_dataset = materialize(lazy_map(eval_dataset, prepare_batch, batched=batched))
+else:
+    train_dataset = train_dataset.map(prepare_batch, remove_columns=train_dataset.column_names, **map_kwargs)
+    eval_dataset = eval_dataset.map(prepare_batch, remove_columns=eval_dataset.column_names, **map_kwargs)
+
+# -----------------------------
+# 📦 Data collator
+# -----------------------------
+@dataclass
+class DataCollatorSpeechSeq2SeqWithPadding:
+    processor: Any
+
+    def __call__(self, features: List[Dict[str, Union[List[int], torch.Tensor]]]) -> Dict[str, torch.Tensor]:
+        input_features = [{"input_features": feature["input_features"]} for feature in features]
+        batch = self.processor.feature_extractor.pad(input_features, return_tensors="pt")
+
+        label_features = [{"input_ids": feature["labels"]} for feature in features]
+        labels_batch = self.processor.tokenizer.pad(label_features, return_tensors="pt")
+
+        labels = labels_batch["input_ids"].masked_fill(labels_batch.attention_mask.ne(1), -100)
+
+        if (labels[:, 0] == self.processor.tokenizer.bos_token_id).all().cpu().item():
+            labels = labels[:, 1:]
+
+        batch["labels"] = labels
+        return batch
+
+data_collator = DataCollatorSpeechSeq2SeqWithPadding(processor=processor)
 
 # -----------------------------
 # 5️⃣ Load model
@@ -62,18 +119,15 @@ eval_dataset = eval_dataset.map(prepare_batch, remove_columns=eval_dataset.colum
 model = WhisperForConditionalGeneration.from_pretrained(model_name)
 model.config.forced_decoder_ids = None
 model.config.suppress_tokens = []
+if lora:
+    model = apply_lora(model, r=int(os.getenv("LORA_R", "16")), alpha=int(os.getenv("LORA_ALPHA", "32")))
+    print(trainable_summary(model))
 
 # -----------------------------
 # 6️⃣ Define metrics
 # -----------------------------
-metric = evaluate.load("wer")
-
-def compute_metrics(pred):
-    pred_ids = np.argmax(pred.predictions, axis=-1)
-    pred_str = tokenizer.batch_decode(pred_ids, skip_special_tokens=True)
-    label_str = tokenizer.batch_decode(pred.label_ids, skip_special_tokens=True)
-    wer = 100 * metric.compute(predictions=pred_str, references=label_str)
-    return {"wer": wer}
+# Generated ids are scored as they are (no argmax) and -100 labels are restored to padding
+error_rates = ErrorRateAccumulator(tokenizer)
 
 # -----------------------------
 # 7️⃣ Training arguments
@@ -82,9 +136,9 @@ training_args = Seq2SeqTrainingArguments(
     output_dir="./whisper-finetuned-medical",
     per_device_train_batch_size=4,
     gradient_accumulation_steps=4,
-    learning_rate=1e-5,
+    learning_rate=float(os.getenv("LORA_LR", "1e-3")) if lora else 1e-5,
     warmup_steps=200,
-    max_steps=1000,
+    max_steps=int(os.getenv("MAX_STEPS", "1000")),  # drives training length (required in streaming mode)
     fp16=torch.cuda.is_available(),
     evaluation_strategy="steps",
     save_strategy="steps",
@@ -94,6 +148,7 @@ training_args = Seq2SeqTrainingArguments(
     save_steps=500,
     eval_steps=500,
     report_to="none",
+    label_names=["labels"],
 )
 
 # -----------------------------
@@ -104,24 +159,38 @@ trainer = Seq2SeqTrainer(
     model=model,
     train_dataset=train_dataset,
     eval_dataset=eval_dataset,
+    data_collator=data_collator,
     tokenizer=processor.feature_extractor,
-    compute_metrics=compute_metrics,
+    compute_metrics=error_rates.compute_metrics,
+    preprocess_logits_for_metrics=error_rates.preprocess_logits_for_metrics,
 )
+maybe_add_profiler(trainer)  # PROFILE=1
 
 trainer.train()
 
 # -----------------------------
 # 9️⃣ Save fine‐tuned model
 # -----------------------------
-trainer.save_model("./whisper-finetuned-medical")
+if lora:
+    print(save_adapter_and_merge(model, processor, "./whisper-finetuned-medical-adapter", "./whisper-finetuned-medical"))
+else:
+    trainer.save_model("./whisper-finetuned-medical")
 print("✅ Fine-tuning complete! Model saved at ./whisper-finetuned-medical")
+# Distributable delta against openai/whisper-small (SAVE_DELTA=int8 or lowrank)
+save_delta = os.getenv("SAVE_DELTA", "0")
+if save_delta != "0":
+    processor.save_pretrained("./whisper-finetuned-medical")
+    print(describe_delta(create_delta("./whisper-finetuned-medical", "./whisper-finetuned-medical-delta",
+                                      base=model_name, mode=save_delta)))
 
 # -----------------------------
-# 🔟 (Optional) Convert to faster-whisper format for inference
-# In terminal run:
-# ct2-transformers-converter --model ./whisper-finetuned-medical --output_dir ./faster-whisper-medical
-#
-# Then use:
-# from faster_whisper import WhisperModel
-# model = WhisperModel("./faster-whisper-medical")
-# segments, info = model.transcribe("audio.wav")
+# 🔟 Export optimized inference engines
+# -----------------------------
+# ONNX (fp32 + int8) and CTranslate2 int8 under ./whisper-finetuned-medical-export, with a WER parity
+# check against PyTorch and a latency/memory table. Opt-in: EXPORT=onnx,ct2 (or just one of them); 0 = skip.
+# The ct2-int8 directory also loads in faster-whisper: WhisperModel("./whisper-finetuned-medical-export/ct2-int8")
+export_backends = os.getenv("EXPORT", "0")
+if export_backends != "0":
+    processor.save_pretrained("./whisper-finetuned-medical")  # converters and backends need the tokenizer
+    parity_rows = [eval_dataset[i] for i in range(min(len(eval_dataset), int(os.getenv("EXPORT_EVAL_SAMPLES", "50"))))]
+    compare_backends("./whisper-finetuned-medical", parity_rows, backends=export_backends.split(","), language=language)
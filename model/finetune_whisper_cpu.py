@@ -1,3 +1,4 @@
+import os
 import torch
 from datasets import load_dataset, Audio
 from transformers import (
@@ -8,8 +9,9 @@ from transformers import (
     Seq2SeqTrainingArguments,
     Seq2SeqTrainer,
 )
-import evaluate
-import numpy as np
+from fast_features import make_prepare_batch, default_num_proc
+from asr_metrics import ErrorRateAccumulator
+from profiler import maybe_add_profiler
 
 # -----------------------------
 # 1️⃣ Config
@@ -49,8 +51,15 @@ def prepare_batch(batch):
     batch["labels"] = tokenizer(batch["text"]).input_ids
     return batch
 
-train_dataset = train_dataset.map(prepare_batch, remove_columns=train_dataset.column_names)
-eval_dataset = eval_dataset.map(prepare_batch, remove_columns=eval_dataset.column_names)
+# Batched log-mel extraction across worker processes (BATCHED_FEATURES=0 restores the per-example map)
+map_kwargs = {}
+if os.getenv("BATCHED_FEATURES", "1") != "0":
+    num_proc = default_num_proc()
+    prepare_batch = make_prepare_batch(feature_extractor, tokenizer, torch_threads=1 if num_proc > 1 else None)
+    map_kwargs = {"batched": True, "batch_size": 32, "num_proc": num_proc if num_proc > 1 else None}
+
+train_dataset = train_dataset.map(prepare_batch, remove_columns=train_dataset.column_names, **map_kwargs)
+eval_dataset = eval_dataset.map(prepare_batch, remove_columns=eval_dataset.column_names, **map_kwargs)
 
 # -----------------------------
 # 5️⃣ Model
@@ -62,14 +71,8 @@ model.config.suppress_tokens = []
 # -----------------------------
 # 6️⃣ Metric
 # -----------------------------
-metric = evaluate.load("wer")
-
-def compute_metrics(pred):
-    pred_ids = np.argmax(pred.predictions, axis=-1)
-    pred_str = tokenizer.batch_decode(pred_ids, skip_special_tokens=True)
-    label_str = tokenizer.batch_decode(pred.label_ids, skip_special_tokens=True)
-    wer = 100 * metric.compute(predictions=pred_str, references=label_str)
-    return {"wer": wer}
+# Generated ids are scored as they are (no argmax) and -100 labels are restored to padding
+error_rates = ErrorRateAccumulator(tokenizer)
 
 # -----------------------------
 # 7️⃣ Training args (CPU)
@@ -98,8 +101,10 @@ trainer = Seq2SeqTrainer(
     train_dataset=train_dataset,
     eval_dataset=eval_dataset,
     tokenizer=processor.feature_extractor,
-    compute_metrics=compute_metrics,
+    compute_metrics=error_rates.compute_metrics,
+    preprocess_logits_for_metrics=error_rates.preprocess_logits_for_metrics,
 )
+maybe_add_profiler(trainer)  # PROFILE=1
 
 trainer.train()
 
@@ -0,0 +1,93 @@
+"""
+Inference helpers for fine-tuned Whisper checkpoints
+Loads what the training scripts save and transcribes batches of 16 kHz clips
+"""
+
+import io
+import os
+import wave
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+import torch
+from transformers import WhisperForConditionalGeneration, WhisperProcessor
+
+from data_pipeline import ffmpeg_decode
+from diff import is_delta_dir, load as load_delta
+
+SAMPLING_RATE = 16000
+
+
+def load_processor(model_dir: str, base_model: str = "openai/whisper-tiny") -> WhisperProcessor:
+    """
+    Processor saved with the checkpoint, else the base model's.
+
+    `finetune_whisper_cpu.py` only saves the feature extractor next to the
+    weights, so its tokenizer comes from `base_model`.
+    """
+    try:
+        return WhisperProcessor.from_pretrained(model_dir)
+    except (OSError, ValueError, TypeError):
+        return WhisperProcessor.from_pretrained(base_model)
+
+
+def read_audio(data: bytes, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """
+    Mono float32 PCM from request bytes: 16-bit WAV is parsed in-process, anything else goes through FFmpeg.
+
+    That includes WAV files the `wave` module rejects (float samples,
+    WAVE_FORMAT_EXTENSIBLE, truncated headers).
+    """
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        try:
+            with wave.open(io.BytesIO(data)) as w:
+                if w.getsampwidth() == 2:
+                    pcm = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2").astype(np.float32) / 32768.0
+                    if w.getnchannels() > 1:
+                        pcm = pcm.reshape(-1, w.getnchannels()).mean(axis=1)
+                    if w.getframerate() == sampling_rate:
+                        return pcm
+        except (wave.Error, EOFError, ValueError):
+            pass
+    return ffmpeg_decode({"bytes": data, "path": None}, sampling_rate)
+
+
+class WhisperEngine:
+    """A fine-tuned checkpoint ready for batched `generate` with the KV cache on."""
+
+    def __init__(self, model_dir: str, device: Optional[str] = None, num_beams: int = 1,
+                 base_model: str = "openai/whisper-tiny", dtype: Optional[torch.dtype] = None):
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.processor = load_processor(model_dir, base_model)
+        if dtype is None:
+            dtype = torch.float16 if self.device == "cuda" else torch.float32
+        if is_delta_dir(model_dir):
+            self.model = load_delta(model_dir, torch_dtype=dtype).to(self.device)
+        else:
+            self.model = WhisperForConditionalGeneration.from_pretrained(model_dir, torch_dtype=dtype).to(self.device).eval()
+        self.model.config.use_cache = self.model.generation_config.use_cache = True
+        self.num_beams = num_beams
+        self.dtype = dtype
+
+    def features(self, arrays: Sequence[np.ndarray]) -> torch.Tensor:
+        return self.processor.feature_extractor(
+            list(arrays), sampling_rate=SAMPLING_RATE, return_tensors="pt"
+        ).input_features.to(self.device, self.dtype)
+
+    @torch.inference_mode()
+    def generate(self, arrays: Sequence[np.ndarray], **kwargs: Any) -> Any:
+        kwargs.setdefault("num_beams", self.num_beams)
+        return self.model.generate(self.features(arrays), use_cache=True, **kwargs)
+
+    def transcribe(self, arrays: Sequence[np.ndarray], **kwargs: Any) -> List[str]:
+        """One transcript per clip (clips longer than 30 s are truncated; see longform.py)."""
+        ids = self.generate(arrays, **kwargs)
+        return [t.strip() for t in self.processor.tokenizer.batch_decode(ids, skip_special_tokens=True)]
+
+
+def default_model_dir() -> str:
+    """First fine-tuned checkpoint the training scripts left behind."""
+    for path in ("./whisper-tiny-test-final", "./whisper-finetuned-cpu", "./whisper-finetuned-medical"):
+        if os.path.isdir(path):
+            return path
+    return "openai/whisper-tiny"
@@ -0,0 +1,99 @@
+"""
+Length-bucketed sampling for seq2seq batches
+Groups transcripts of similar token length (then audio duration) so label padding stays small
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import torch
+
+
+def label_lengths(dataset: Any, column: str = "labels") -> List[int]:
+    """Token count of every label sequence, read without decoding audio."""
+    if isinstance(dataset, list):
+        return [len(row[column]) for row in dataset]
+    if hasattr(dataset, "labels") and column == "labels":
+        return [len(l) for l in dataset.labels]
+    return [len(l) for l in dataset[column]]
+
+
+class BucketSampler(torch.utils.data.Sampler):
+    """
+    Shuffled, length-bucketed index order.
+
+    Each epoch the indices are shuffled and cut into buckets of
+    `batch_size * bucket_batches` examples. Each bucket is sorted by label
+    length (ties broken by audio duration) and split into batches, and the
+    full batches are shuffled across buckets. Indices are yielded flat with
+    every batch aligned to `batch_size` (a ragged remainder goes last), so
+    the Trainer's DataLoader slices exactly these batches.
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, durations: Optional[Sequence[float]] = None,
+                 bucket_batches: int = 50, seed: int = 42):
+        self.lengths = list(lengths)
+        self.durations = list(durations) if durations is not None else [0.0] * len(self.lengths)
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * bucket_batches
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def batches(self, epoch: Optional[int] = None) -> List[List[int]]:
+        g = torch.Generator()
+        g.manual_seed(self.seed + (self.epoch if epoch is None else epoch))
+        order = torch.randperm(len(self.lengths), generator=g).tolist()
+        full, ragged = [], []
+        for start in range(0, len(order), self.bucket_size):
+            bucket = sorted(order[start:start + self.bucket_size],
+                            key=lambda i: (self.lengths[i], self.durations[i]), reverse=True)
+            for b in range(0, len(bucket), self.batch_size):
+                batch = bucket[b:b + self.batch_size]
+                (full if len(batch) == self.batch_size else ragged).append(batch)
+        perm = torch.randperm(len(full), generator=g).tolist()
+        return [full[i] for i in perm] + ([sum(ragged, [])] if ragged else [])
+
+    def __iter__(self) -> Iterator[int]:
+        batches = self.batches()
+        self.epoch += 1  # reshuffle next time even if nobody calls set_epoch
+        for batch in batches:
+            yield from batch
+
+
+def padded_token_ratio(lengths: Sequence[int], batches: Sequence[Sequence[int]], batch_size: int) -> float:
+    """Fraction of label slots that are padding (`-100`) when batches pad to their longest label."""
+    real = padded = 0
+    for batch in batches:
+        for start in range(0, len(batch), batch_size):
+            chunk = [lengths[i] for i in batch[start:start + batch_size]]
+            real += sum(chunk)
+            padded += max(chunk) * len(chunk)
+    return 1.0 - real / padded if padded else 0.0
+
+
+def padding_report(lengths: Sequence[int], batch_size: int, sampler: BucketSampler, seed: int = 42) -> Dict[str, float]:
+    """Padded-token ratio of random batches vs bucketed batches for one epoch."""
+    g = torch.Generator()
+    g.manual_seed(seed)
+    order = torch.randperm(len(lengths), generator=g).tolist()
+    random_batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    return {
+        "random": padded_token_ratio(lengths, random_batches, batch_size),
+        "bucketed": padded_token_ratio(lengths, sampler.batches(epoch=0), batch_size),
+    }
+
+
+class LengthGroupedTrainerMixin:
+    """Trainer mixin: use `self.length_sampler` (a `BucketSampler`) for the training set when set."""
+
+    length_sampler: Optional[BucketSampler] = None
+
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.length_sampler is not None:
+            return self.length_sampler
+        return super()._get_train_sampler(*args, **kwargs)
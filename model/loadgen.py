@@ -0,0 +1,154 @@
+"""
+Load generator for serve.py
+Fires concurrent requests with synthetic speech-like audio and reports client-side latency percentiles
+
+Usage:
+    python loadgen.py --url http://localhost:8000 --requests 200 --concurrency 16
+    python loadgen.py --url http://localhost:8000 --ws --requests 200 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import io
+import time
+import wave
+from typing import Any, Dict, List
+
+import aiohttp
+import numpy as np
+
+SAMPLING_RATE = 16000
+
+
+def percentiles(values: List[float], qs=(50, 95, 99)) -> Dict[str, float]:
+    # Same as serve.percentiles; kept local so the load generator does not need torch
+    if not values:
+        return {f"p{q}": 0.0 for q in qs}
+    return {f"p{q}": float(v) for q, v in zip(qs, np.percentile(values, qs))}
+
+
+def synthetic_wav(seconds: float, rng: np.random.Generator, sampling_rate: int = SAMPLING_RATE) -> bytes:
+    """
+    16-bit mono WAV of formant-like tone bursts separated by short pauses.
+
+    This is not speech, but it exercises the same decode, feature and
+    generate path, and clip length is controlled.
+    """
+    n = int(seconds * sampling_rate)
+    t = np.arange(n) / sampling_rate
+    audio = np.zeros(n, dtype=np.float32)
+    pos = 0
+    while pos < n:
+        syllable = int(rng.uniform(0.08, 0.3) * sampling_rate)
+        end = min(pos + syllable, n)
+        f0 = rng.uniform(100, 220)
+        seg = t[pos:end]
+        tone = sum(np.sin(2 * np.pi * f0 * k * seg) / k for k in (1, 2, 3))
+        audio[pos:end] = 0.3 * tone * np.hanning(end - pos)
+        pos = end + int(rng.uniform(0.02, 0.15) * sampling_rate)
+    audio += 0.005 * rng.standard_normal(n).astype(np.float32)
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sampling_rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+async def _http_worker(session: aiohttp.ClientSession, url: str, clips: "asyncio.Queue[bytes]",
+                       latencies: List[float], errors: List[str]):
+    while True:
+        try:
+            clip = clips.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{url}/transcribe", data=clip, headers={"Content-Type": "audio/wav"}) as resp:
+                if resp.content_type == "application/json":
+                    body = await resp.json()
+                else:  # e.g. a proxy's or aiohttp's plain-text error page
+                    body = {"error": f"HTTP {resp.status}: {(await resp.text())[:200]}"}
+        except aiohttp.ClientError as err:
+            errors.append(f"{type(err).__name__}: {err}")
+            continue
+        if resp.status != 200:
+            errors.append(body.get("error", str(resp.status)))
+            continue
+        latencies.append((time.perf_counter() - start) * 1000.0)
+
+
+async def _ws_worker(session: aiohttp.ClientSession, url: str, clips: "asyncio.Queue[bytes]",
+                     latencies: List[float], errors: List[str]):
+    async with session.ws_connect(f"{url.replace('http', 'ws', 1)}/ws", max_msg_size=0) as ws:
+        while True:
+            try:
+                clip = clips.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            await ws.send_bytes(clip)
+            body = await ws.receive_json()
+            if "error" in body:
+                errors.append(body["error"])
+                continue
+            latencies.append((time.perf_counter() - start) * 1000.0)
+
+
+async def run(url: str, requests: int, concurrency: int, min_s: float, max_s: float,
+              use_ws: bool = False, seed: int = 0) -> Dict[str, Any]:
+    rng = np.random.default_rng(seed)
+    clips: "asyncio.Queue[bytes]" = asyncio.Queue()
+    audio_s = 0.0
+    for _ in range(requests):
+        seconds = float(rng.uniform(min_s, max_s))
+        audio_s += seconds
+        clips.put_nowait(synthetic_wav(seconds, rng))
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    worker = _ws_worker if use_ws else _http_worker
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session, url, clips, latencies, errors) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        async with session.get(f"{url}/stats") as resp:
+            server = await resp.json()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "audio_s_per_s": audio_s / elapsed,
+        "latency_ms": percentiles(latencies),
+        "server": server,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the local Whisper service with synthetic audio")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--min-seconds", type=float, default=2.0)
+    parser.add_argument("--max-seconds", type=float, default=12.0)
+    parser.add_argument("--ws", action="store_true", help="Use the WebSocket endpoint instead of POST /transcribe")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    res = asyncio.run(run(args.url, args.requests, args.concurrency, args.min_seconds, args.max_seconds,
+                          use_ws=args.ws, seed=args.seed))
+    lat, srv = res["latency_ms"], res["server"]
+    print(f"\n📊 {res['requests']} requests ({res['errors']} errors) in {res['elapsed_s']:.1f}s, "
+          f"concurrency={args.concurrency}, {'ws' if args.ws else 'http'}")
+    print(f"   throughput : {res['requests_per_s']:.2f} req/s, {res['audio_s_per_s']:.1f} audio-s/s")
+    print(f"   client     : p50 {lat['p50']:.0f} ms | p95 {lat['p95']:.0f} ms | p99 {lat['p99']:.0f} ms")
+    s = srv["latency_ms"]
+    print(f"   server     : p50 {s['p50']:.0f} ms | p95 {s['p95']:.0f} ms | p99 {s['p99']:.0f} ms, "
+          f"mean batch {srv['mean_batch_size']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Long-form transcription
+Overlapping strided 30 s chunks, decoded in batches across a process pool and merged by token alignment
+
+A consultation is cut into `chunk_s` windows that start every
+`chunk_s - 2 * stride_s` seconds. Neighbouring windows therefore share
+`2 * stride_s` of audio. Each worker process holds its own model and a slice
+of the CPU threads, and decodes batches of windows.
+
+Neighbouring transcripts are joined where their token sequences agree best
+inside the shared audio, and each side keeps the half of the overlap that is
+nearer its own centre. This is the same idea as the `transformers` ASR
+pipeline, so words cut at a window edge come from the window that heard them
+whole.
+
+Usage (RTF of the pool vs sequential decoding on the same machine):
+    python longform.py --model ./whisper-tiny-test-final --wav consult.wav --workers 4
+    python longform.py --minutes 15 --workers 4      # builds a long stream from dataset clips
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from inference import SAMPLING_RATE, WhisperEngine, default_model_dir, load_processor, read_audio
+
+
+# -----------------------------
+# Chunking and merging
+# -----------------------------
+def chunk_audio(audio: np.ndarray, chunk_s: float = 30.0, stride_s: float = 5.0,
+                sampling_rate: int = SAMPLING_RATE) -> List[Tuple[int, np.ndarray]]:
+    """`(start_sample, window)` pairs covering `audio`; neighbours overlap by `2 * stride_s`."""
+    chunk = int(chunk_s * sampling_rate)
+    step = chunk - 2 * int(stride_s * sampling_rate)
+    if step <= 0:
+        raise ValueError(f"stride_s={stride_s} leaves no new audio in a {chunk_s}s chunk")
+    starts = list(range(0, max(len(audio) - 2 * int(stride_s * sampling_rate), 1), step))
+    return [(s, audio[s:s + chunk]) for s in starts]
+
+
+def merge_token_sequences(seqs: Sequence[Sequence[int]], min_matches: int = 2) -> List[int]:
+    """
+    Join per-chunk token sequences in order.
+
+    For each pair, every overlap length `i` is scored by how many of the
+    left's last `i` tokens equal the right's first `i` tokens (with a slight
+    preference for longer overlaps). The join falls in the middle of the best
+    overlap. Pairs with no credible overlap are concatenated.
+    """
+    if not seqs:
+        return []
+    out = np.asarray(seqs[0], dtype=np.int64)
+    for nxt in seqs[1:]:
+        right = np.asarray(nxt, dtype=np.int64)
+        best_score, best_i = 0.0, 0
+        for i in range(1, min(len(out), len(right)) + 1):
+            matches = int(np.count_nonzero(out[-i:] == right[:i]))
+            score = matches / i + i * 1e-4
+            if matches >= min_matches and score > best_score:
+                best_score, best_i = score, i
+        if best_i:
+            half = best_i // 2
+            out = np.concatenate([out[:len(out) - best_i + half], right[half:]])
+        else:
+            out = np.concatenate([out, right])
+    return out.tolist()
+
+
+def _text_tokens(ids: Sequence[int], eot_id: int) -> List[int]:
+    # Whisper's special and timestamp tokens all sit at or above <|endoftext|>
+    return [int(t) for t in ids if t < eot_id]
+
+
+# -----------------------------
+# Worker pool
+# -----------------------------
+_ENGINE: Optional[WhisperEngine] = None
+
+
+def _init_worker(model_dir: str, threads: int, num_beams: int):
+    global _ENGINE
+    torch.set_num_threads(threads)
+    _ENGINE = WhisperEngine(model_dir, device="cpu", num_beams=num_beams)
+
+
+def _decode_batch(windows: List[np.ndarray]) -> List[List[int]]:
+    ids = _ENGINE.generate(windows)
+    eot = _ENGINE.processor.tokenizer.eos_token_id
+    return [_text_tokens(row.tolist(), eot) for row in ids]
+
+
+class LongformTranscriber:
+    """
+    Process pool of `workers` models, each with `threads_per_worker` torch threads.
+
+    Use as a context manager, or call `close()`. `transcribe()` returns the
+    merged text for one long recording.
+    """
+
+    def __init__(self, model_dir: str, workers: int = 2, batch_size: int = 4, chunk_s: float = 30.0,
+                 stride_s: float = 5.0, num_beams: int = 1, threads_per_worker: Optional[int] = None):
+        self.model_dir = model_dir
+        self.workers = workers
+        self.batch_size = batch_size
+        self.chunk_s = chunk_s
+        self.stride_s = stride_s
+        threads = threads_per_worker or max(1, (os.cpu_count() or workers) // workers)
+        # spawn: workers must not inherit the parent's torch thread pools
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=mp.get_context("spawn"),
+            initializer=_init_worker, initargs=(model_dir, threads, num_beams),
+        )
+        self.tokenizer = load_processor(model_dir).tokenizer
+
+    def warm_up(self):
+        """Load the model in every worker so timings exclude start-up."""
+        silence = [np.zeros(SAMPLING_RATE, dtype=np.float32)]
+        list(self.pool.map(_decode_batch, [silence] * self.workers))
+
+    def transcribe(self, audio: np.ndarray) -> str:
+        windows = [w for _, w in chunk_audio(audio, self.chunk_s, self.stride_s)]
+        batches = [windows[i:i + self.batch_size] for i in range(0, len(windows), self.batch_size)]
+        seqs = [seq for batch in self.pool.map(_decode_batch, batches) for seq in batch]
+        return self.tokenizer.decode(merge_token_sequences(seqs), skip_special_tokens=True).strip()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def transcribe_sequential(engine: WhisperEngine, audio: np.ndarray, chunk_s: float = 30.0,
+                          stride_s: float = 5.0) -> str:
+    """Same chunks and merge, one window at a time in this process (the baseline)."""
+    eot = engine.processor.tokenizer.eos_token_id
+    seqs = [_text_tokens(engine.generate([w])[0].tolist(), eot) for _, w in chunk_audio(audio, chunk_s, stride_s)]
+    return engine.processor.tokenizer.decode(merge_token_sequences(seqs), skip_special_tokens=True).strip()
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def _long_stream(minutes: float, dataset: str, subset: str) -> np.ndarray:
+    from datasets import load_dataset, Audio
+
+    ds = load_dataset(dataset, subset, split="test").cast_column("audio", Audio(sampling_rate=SAMPLING_RATE))
+    parts, total = [], 0
+    gap = np.zeros(int(0.5 * SAMPLING_RATE), dtype=np.float32)
+    for row in ds:
+        clip = np.asarray(row["audio"]["array"], dtype=np.float32)
+        parts += [clip, gap]
+        total += len(clip) + len(gap)
+        if total >= minutes * 60 * SAMPLING_RATE:
+            break
+    return np.concatenate(parts)
+
+
+def main():
+    from asr_metrics import ErrorRateAccumulator
+
+    parser = argparse.ArgumentParser(description="Long-form transcription: process pool vs sequential RTF")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--wav", default=None, help="Recording to transcribe (default: dataset clips joined)")
+    parser.add_argument("--minutes", type=float, default=15.0)
+    parser.add_argument("--dataset", default="ekacare/eka-medical-asr-evaluation-dataset")
+    parser.add_argument("--subset", default="hi")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--chunk-s", type=float, default=30.0)
+    parser.add_argument("--stride-s", type=float, default=5.0)
+    parser.add_argument("--beams", type=int, default=1)
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    model_dir = args.model or default_model_dir()
+    if args.wav:
+        with open(args.wav, "rb") as f:
+            audio = read_audio(f.read())
+    else:
+        audio = _long_stream(args.minutes, args.dataset, args.subset)
+    duration = len(audio) / SAMPLING_RATE
+    n_chunks = len(chunk_audio(audio, args.chunk_s, args.stride_s))
+    print(f"🎧 {duration / 60:.1f} min of audio -> {n_chunks} chunks of {args.chunk_s:.0f}s (stride {args.stride_s:.0f}s)")
+
+    with LongformTranscriber(model_dir, workers=args.workers, batch_size=args.batch_size, chunk_s=args.chunk_s,
+                             stride_s=args.stride_s, num_beams=args.beams) as lf:
+        lf.warm_up()
+        start = time.perf_counter()
+        text = lf.transcribe(audio)
+        pool_s = time.perf_counter() - start
+    print(f"\n📊 pool ({args.workers} workers x batch {args.batch_size}): {pool_s:.1f}s, RTF {pool_s / duration:.3f}")
+
+    if not args.skip_sequential:
+        torch.set_num_threads(os.cpu_count() or 1)
+        engine = WhisperEngine(model_dir, device="cpu", num_beams=args.beams)
+        engine.transcribe([audio[:SAMPLING_RATE]])  # warm-up
+        start = time.perf_counter()
+        seq_text = transcribe_sequential(engine, audio, args.chunk_s, args.stride_s)
+        seq_s = time.perf_counter() - start
+        acc = ErrorRateAccumulator()
+        acc.update_text([text], [seq_text])
+        print(f"   sequential (1 process, all cores): {seq_s:.1f}s, RTF {seq_s / duration:.3f}")
+        print(f"   speedup {seq_s / pool_s:.2f}x; pool vs sequential transcript WER {acc.compute()['wer']:.2f}%")
+    print(f"\n📝 {text[:500]}{' ...' if len(text) > 500 else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+LoRA fine-tuning for Whisper
+Low-rank adapters on the attention/MLP projections, adapter-only checkpoints and merge-back for inference
+
+`apply_lora(model)` freezes every base weight and adds rank-`r` adapters to
+q/k/v/out_proj and fc1/fc2. The Trainer builds its optimizer from the
+parameters that require grad, so AdamW state exists only for the adapters.
+Trainer checkpoints of a PEFT model hold only the adapter weights, a few
+MB, plus the generation config that `GenerationConfigCallback` adds.
+
+`save_adapter_and_merge()` writes the adapter directory and a merged copy.
+The merged copy is a plain `WhisperForConditionalGeneration` checkpoint, so
+inference.py, export.py and quantize.py load it unchanged. `load_model()`
+opens either kind of directory.
+
+Requires `peft` (pip install peft).
+"""
+
+import copy
+import os
+from typing import Any, Optional, Sequence
+
+from transformers import TrainerCallback
+
+TARGET_MODULES = ("q_proj", "k_proj", "v_proj", "out_proj", "fc1", "fc2")
+ADAPTER_CONFIG = "adapter_config.json"
+
+
+def apply_lora(model: Any, r: int = 8, alpha: int = 16, dropout: float = 0.05,
+               target_modules: Sequence[str] = TARGET_MODULES, decoder_only: bool = False) -> Any:
+    """
+    Wrap `model` in a PEFT model with LoRA adapters; base weights are frozen.
+
+    `decoder_only=True` leaves the encoder untouched and deterministic. A
+    frozen encoder's cached states (encoder_cache.py) then stay valid.
+    """
+    from peft import LoraConfig, get_peft_model
+
+    names = "|".join(target_modules)
+    targets = rf".*decoder\.layers\.\d+\..*({names})" if decoder_only else list(target_modules)
+    config = LoraConfig(r=r, lora_alpha=alpha, lora_dropout=dropout, target_modules=targets, bias="none")
+    if getattr(model, "is_gradient_checkpointing", False):
+        # Checkpointed blocks need an input that requires grad once the embeddings are frozen
+        model.enable_input_require_grads()
+    return get_peft_model(model, config)
+
+
+def trainable_summary(model: Any) -> str:
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    total = sum(p.numel() for p in model.parameters())
+    return (f"🪶 LoRA: {trainable / 1e6:.2f}M trainable of {total / 1e6:.1f}M params "
+            f"({100 * trainable / max(total, 1):.2f}%), optimizer state for adapters only")
+
+
+def dir_size_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files) / 1024**2
+
+
+def merged_copy(model: Any) -> Any:
+    """Base model with the adapters folded into its weights; `model` itself keeps training/evaluating as is."""
+    return copy.deepcopy(model).merge_and_unload()
+
+
+def save_adapter_and_merge(model: Any, processor: Any, adapter_dir: str, merged_dir: str) -> str:
+    """Write the adapter-only checkpoint and a merged full checkpoint; returns a size summary."""
+    model.save_pretrained(adapter_dir)
+    model.generation_config.save_pretrained(adapter_dir)
+    processor.save_pretrained(adapter_dir)
+    merged = merged_copy(model)
+    merged.save_pretrained(merged_dir)
+    processor.save_pretrained(merged_dir)
+    return (f"💾 Adapter: {adapter_dir} ({dir_size_mb(adapter_dir):.1f} MB), "
+            f"merged: {merged_dir} ({dir_size_mb(merged_dir):.0f} MB)")
+
+
+def load_model(path: str, base_model: Optional[str] = None) -> Any:
+    """
+    A ready-to-generate `WhisperForConditionalGeneration` from a full or an adapter-only directory.
+
+    Adapter directories are merged into their base model, which is read from
+    `adapter_config.json` unless `base_model` is given. A generation config
+    saved next to the adapter replaces the base model's.
+    """
+    from transformers import GenerationConfig, WhisperForConditionalGeneration
+
+    if not os.path.exists(os.path.join(path, ADAPTER_CONFIG)):
+        return WhisperForConditionalGeneration.from_pretrained(path)
+    from peft import PeftConfig, PeftModel
+
+    base = WhisperForConditionalGeneration.from_pretrained(
+        base_model or PeftConfig.from_pretrained(path).base_model_name_or_path
+    )
+    if os.path.exists(os.path.join(path, "generation_config.json")):
+        base.generation_config = GenerationConfig.from_pretrained(path)
+    return PeftModel.from_pretrained(base, path).merge_and_unload()
+
+
+class GenerationConfigCallback(TrainerCallback):
+    """Adapter checkpoints carry no generation config; save it so they decode like the final model."""
+
+    def on_save(self, args, state, control, model=None, **kwargs):
+        if model is not None:
+            model.generation_config.save_pretrained(os.path.join(args.output_dir, f"checkpoint-{state.global_step}"))
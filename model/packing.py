@@ -0,0 +1,157 @@
+"""
+Utterance packing for Whisper's 30-second window
+Concatenates short clips (optionally with timestamped labels) so the encoder sees speech instead of padding
+"""
+
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+TIME_PRECISION = 0.02  # seconds per Whisper timestamp token
+
+
+def clip_durations(dataset: Any, audio_column: str = "audio") -> List[float]:
+    """Duration in seconds of every clip (decodes each clip once unless lengths are known)."""
+    if hasattr(dataset, "durations"):
+        return list(dataset.durations())
+    if "duration" in getattr(dataset, "column_names", []):
+        return [float(d) for d in dataset["duration"]]
+    durations = []
+    for row in dataset:
+        audio = row[audio_column]
+        durations.append(len(audio["array"]) / audio["sampling_rate"])
+    return durations
+
+
+def plan_packs(durations: Sequence[float], label_lengths: Sequence[int], window_s: float = 30.0,
+               gap_s: float = 0.2, max_label_tokens: int = 448, prefix_len: int = 0,
+               timestamps: bool = True) -> List[List[int]]:
+    """
+    First-fit-decreasing bin packing of utterances into windows.
+
+    Each utterance costs its duration plus `gap_s` of silence (and one grid
+    step of alignment slack) and its label tokens plus two timestamp tokens
+    (one separator token with `timestamps=False`). Clips longer than the
+    window get a pack of their own (and are truncated by the collator as
+    before).
+    """
+    order = sorted(range(len(durations)), key=lambda i: durations[i], reverse=True)
+    packs: List[List[int]] = []
+    used_s: List[float] = []
+    used_tok: List[int] = []
+    for i in order:
+        dur = durations[i] + gap_s + TIME_PRECISION
+        tok = label_lengths[i] + (2 if timestamps else 1)
+        for p in range(len(packs)):
+            if used_s[p] + dur <= window_s + gap_s and used_tok[p] + tok <= max_label_tokens:
+                packs[p].append(i)
+                used_s[p] += dur
+                used_tok[p] += tok
+                break
+        else:
+            packs.append([i])
+            used_s.append(dur)
+            used_tok.append(prefix_len + tok)
+    return packs
+
+
+def packing_report(durations: Sequence[float], packs: Sequence[Sequence[int]], window_s: float = 30.0) -> Dict[str, float]:
+    """Real audio seconds per window, packed vs one-clip-per-window baseline."""
+    total = float(sum(min(d, window_s) for d in durations))
+    n_clips, n_packs = len(durations), max(len(packs), 1)
+    return {
+        "clips": n_clips,
+        "windows": len(packs),
+        "audio_s_per_window_padded": total / max(n_clips, 1),
+        "audio_s_per_window_packed": total / n_packs,
+        "efficiency_padded": total / (max(n_clips, 1) * window_s),
+        "efficiency_packed": total / (n_packs * window_s),
+        "encoder_window_reduction": n_clips / n_packs,
+    }
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """
+    Lazily assembled packs with the same row layout as the source dataset.
+
+    Rows are `{"audio": {"array", "sampling_rate"}, "labels": [...]}`, so the
+    existing collators work unchanged. Labels follow Whisper's timestamp layout:
+    `prefix_ids <|t_start|> text <|t_end|> <|t_start|> text <|t_end|> ...`.
+    Clip offsets are snapped to the 20 ms timestamp grid so the tokens are exact.
+    With `timestamps=False` the clip labels are joined by a space instead
+    (`prefix_ids text text ...`), matching scripts that train and decode
+    without timestamps.
+    """
+
+    def __init__(self, base: Any, packs: List[List[int]], tokenizer: Any, window_s: float = 30.0,
+                 gap_s: float = 0.2, prefix_ids: Sequence[int] = (), sampling_rate: int = 16000,
+                 durations: Optional[Sequence[float]] = None, timestamps: bool = True,
+                 audio_column: str = "audio", labels_column: str = "labels"):
+        self.base = base
+        self.packs = packs
+        self.window_s = window_s
+        self.gap_s = gap_s
+        self.prefix_ids = list(prefix_ids)
+        self.sampling_rate = sampling_rate
+        self.audio_column = audio_column
+        self.timestamps = timestamps
+        self.timestamp_begin = tokenizer.convert_tokens_to_ids("<|notimestamps|>") + 1
+        self.separator_ids = [] if timestamps else tokenizer.encode(" ", add_special_tokens=False)
+        self._max_ts = int(round(window_s / TIME_PRECISION))
+        base_labels = base[labels_column]
+        self._clip_labels = [list(base_labels[i]) for i in range(len(base))]
+        self._durations = list(durations) if durations is not None else None
+        h = hashlib.sha1(str(getattr(base, "_fingerprint", len(base))).encode("utf-8"))
+        h.update(repr((packs, window_s, gap_s, self.prefix_ids, timestamps)).encode("utf-8"))
+        self._fingerprint = h.hexdigest()[:16]
+
+    def __len__(self) -> int:
+        return len(self.packs)
+
+    def _timestamp(self, seconds: float) -> int:
+        return self.timestamp_begin + min(int(round(seconds / TIME_PRECISION)), self._max_ts)
+
+    @property
+    def labels(self) -> List[List[int]]:
+        """Packed label sequences; timestamps are derived from the clip lengths."""
+        if self._durations is None:
+            self._durations = clip_durations(self.base, self.audio_column)
+        return [self._layout(pack, [self._durations[i] for i in pack])[1] for pack in self.packs]
+
+    def _layout(self, pack: List[int], durations: List[float]):
+        step = int(round(TIME_PRECISION * self.sampling_rate))
+        gap = int(round(self.gap_s * self.sampling_rate))
+        offsets, labels, cursor = [], list(self.prefix_ids), 0
+        for k, (i, dur) in enumerate(zip(pack, durations)):
+            n = int(round(dur * self.sampling_rate))
+            offsets.append(cursor)
+            if self.timestamps:
+                labels.append(self._timestamp(cursor / self.sampling_rate))
+            elif k:
+                labels.extend(self.separator_ids)
+            labels.extend(self._clip_labels[i])
+            if self.timestamps:
+                labels.append(self._timestamp((cursor + n) / self.sampling_rate))
+            cursor += n + gap
+            cursor = -(-cursor // step) * step  # next utterance starts on the timestamp grid
+        return offsets, labels
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        pack = self.packs[idx]
+        clips = []
+        for i in pack:
+            audio = self.base[i][self.audio_column]
+            if audio["sampling_rate"] != self.sampling_rate:
+                raise ValueError(f"Expected {self.sampling_rate} Hz audio, got {audio['sampling_rate']}")
+            clips.append(np.asarray(audio["array"], dtype=np.float32))
+        offsets, labels = self._layout(pack, [len(c) / self.sampling_rate for c in clips])
+        total = offsets[-1] + len(clips[-1])
+        array = np.zeros(total, dtype=np.float32)
+        for off, clip in zip(offsets, clips):
+            array[off:off + len(clip)] = clip
+        return {
+            "audio": {"array": array, "sampling_rate": self.sampling_rate},
+            "labels": labels,
+        }
@@ -0,0 +1,284 @@
+"""
+Trainable-parameters-only checkpoints
+Periodic checkpoints hold just the parameters that train, plus optimizer/scheduler/RNG state, written off the training thread
+
+With a frozen encoder, every stock checkpoint re-serializes weights that
+never change. `PartialCheckpointTrainerMixin` replaces `_save_checkpoint`:
+
+  * on the training thread it only copies the trainable parameters and the
+    optimizer state to CPU memory, and snapshots the scheduler, RNG and
+    trainer state;
+  * a single background thread writes `trainable.safetensors` next to the
+    stock `optimizer.pt` / `scheduler.pt` / `rng_state.pth` /
+    `trainer_state.json` into a temporary directory and renames it into
+    place. While a write is running, the next save waits for it; old
+    checkpoints are rotated on the training thread once the write is done;
+  * the stock save's bookkeeping is kept: the best checkpoint is recorded
+    (for `load_best_model_at_end` and rotation) and the callbacks' and
+    TrainerControl's state go into `trainer_state.json`.
+
+Resuming (`trainer.train(resume_from_checkpoint=...)`) works unchanged: the
+model is built from the base weights as usual, the trainable tensors are
+loaded over it, and the Trainer restores optimizer, scheduler and RNG from
+the stock files. Frozen parameters must still equal the base weights, which
+is the case for a frozen encoder.
+
+Per-checkpoint timings go to `<output_dir>/partial_checkpoints.jsonl`;
+`benchmark_save()` compares save and resume time with the stock layout.
+"""
+
+import copy
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import numpy as np
+import torch
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+from transformers.training_args import ParallelMode
+
+TRAINABLE_FILE = "trainable.safetensors"
+OPTIMIZER_NAME = "optimizer.pt"
+SCHEDULER_NAME = "scheduler.pt"
+TRAINER_STATE_NAME = "trainer_state.json"
+
+
+def _to_cpu(obj: Any) -> Any:
+    """Deep copy of a (nested) state dict with every tensor detached and cloned to CPU."""
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def trainable_state(model: torch.nn.Module) -> Dict[str, torch.Tensor]:
+    return {n: p.detach().to("cpu", copy=True).contiguous() for n, p in model.named_parameters() if p.requires_grad}
+
+
+def rng_state(args: Any) -> Dict[str, Any]:
+    # Same layout as Trainer._save_rng_state, so Trainer._load_rng_state restores it
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "cpu": torch.random.get_rng_state()}
+    if torch.cuda.is_available():
+        if args.parallel_mode == ParallelMode.DISTRIBUTED:
+            state["cuda"] = torch.cuda.random.get_rng_state_all()
+        else:
+            state["cuda"] = torch.cuda.random.get_rng_state()
+    return state
+
+
+def rng_file(args: Any) -> str:
+    return "rng_state.pth" if args.world_size <= 1 else f"rng_state_{args.process_index}.pth"
+
+
+def load_trainable(model: torch.nn.Module, checkpoint: str):
+    """Load `trainable.safetensors` over `model`; every stored tensor must exist in the model."""
+    from safetensors.torch import load_file
+
+    state = load_file(os.path.join(checkpoint, TRAINABLE_FILE))
+    result = model.load_state_dict(state, strict=False)
+    if result.unexpected_keys:
+        raise ValueError(f"{checkpoint} has tensors the model lacks: {result.unexpected_keys[:5]}")
+    return state
+
+
+def is_partial_checkpoint(path: str) -> bool:
+    return os.path.exists(os.path.join(path, TRAINABLE_FILE))
+
+
+def _dir_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)) / 1024**2
+
+
+class PartialCheckpointTrainerMixin:
+    """
+    Trainer mixin: trainable-only checkpoints written on a background thread.
+
+    Call `wait_for_checkpoints()` before reading a checkpoint from disk;
+    `train()` does so before returning.
+    """
+
+    _checkpoint_pool: Optional[ThreadPoolExecutor] = None
+    _checkpoint_future: Optional[Future] = None
+    _checkpoint_run_dir: Optional[str] = None
+
+    def _update_best_checkpoint(self, run_dir: str, output_dir: str, metrics: Optional[Dict[str, float]]):
+        """The stock `_save_checkpoint` bookkeeping for `load_best_model_at_end` and checkpoint rotation."""
+        if metrics is not None and self.args.metric_for_best_model is not None:
+            # transformers < 4.46 decides the best metric here
+            key = self.args.metric_for_best_model
+            value = metrics[key if key.startswith("eval_") else f"eval_{key}"]
+            better = np.greater if self.args.greater_is_better else np.less
+            if self.state.best_metric is None or self.state.best_model_checkpoint is None or better(value, self.state.best_metric):
+                self.state.best_metric = value
+                self.state.best_model_checkpoint = output_dir
+        best_step = getattr(self.state, "best_global_step", None)
+        if best_step:
+            # Newer versions record the best step in _determine_best_metric; the current
+            # checkpoint is still being written, so it cannot be checked on disk yet
+            best_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{best_step}")
+            if best_dir == output_dir or os.path.exists(best_dir):
+                self.state.best_model_checkpoint = best_dir
+
+    def _update_stateful_callbacks(self):
+        """Store the callbacks' and TrainerControl's current state in `self.state`, as the stock save does."""
+        try:
+            from transformers.trainer_callback import ExportableState
+        except ImportError:  # transformers without resumable callback state
+            return
+        for cb in self.callback_handler.callbacks + [self.control]:
+            if not isinstance(cb, ExportableState):
+                continue
+            name = cb.__class__.__name__
+            if isinstance(self.state.stateful_callbacks.get(name), list):
+                self.state.stateful_callbacks[name].append(cb.state())
+            else:
+                self.state.stateful_callbacks[name] = cb.state()
+
+    def _save_checkpoint(self, model, trial, metrics=None):
+        self.wait_for_checkpoints()
+        start = time.perf_counter()
+        run_dir = self._get_output_dir(trial=trial)
+        output_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}")
+        self._update_best_checkpoint(run_dir, output_dir, metrics)
+        if self.args.should_save:
+            self._update_stateful_callbacks()
+        snapshot = {
+            "trainable": trainable_state(self.model),
+            "optimizer": _to_cpu(self.optimizer.state_dict()) if self.optimizer is not None else None,
+            "scheduler": copy.deepcopy(self.lr_scheduler.state_dict()) if self.lr_scheduler is not None else None,
+            "rng": rng_state(self.args),
+            "state": copy.deepcopy(self.state),
+        }
+        blocking_s = time.perf_counter() - start
+        if self._checkpoint_pool is None:
+            self._checkpoint_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._checkpoint_future = self._checkpoint_pool.submit(
+            self._write_checkpoint, snapshot, run_dir, output_dir, blocking_s
+        )
+        self._checkpoint_run_dir = run_dir
+
+    def _write_checkpoint(self, snapshot: Dict[str, Any], run_dir: str, output_dir: str, blocking_s: float):
+        from safetensors.torch import save_file
+
+        start = time.perf_counter()
+        tmp = f"{output_dir}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        save_file(snapshot["trainable"], os.path.join(tmp, TRAINABLE_FILE),
+                  metadata={"base": str(getattr(self.model.config, "_name_or_path", ""))})
+        if self.args.should_save:
+            if snapshot["optimizer"] is not None:
+                torch.save(snapshot["optimizer"], os.path.join(tmp, OPTIMIZER_NAME))
+            if snapshot["scheduler"] is not None:
+                torch.save(snapshot["scheduler"], os.path.join(tmp, SCHEDULER_NAME))
+            snapshot["state"].save_to_json(os.path.join(tmp, TRAINER_STATE_NAME))
+        torch.save(snapshot["rng"], os.path.join(tmp, rng_file(self.args)))
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(tmp, output_dir)
+        write_s = time.perf_counter() - start
+        record = {"step": snapshot["state"].global_step, "blocking_s": blocking_s, "write_s": write_s,
+                  "size_mb": _dir_mb(output_dir)}
+        with open(os.path.join(run_dir, "partial_checkpoints.jsonl"), "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def wait_for_checkpoints(self):
+        """Block until the running write is done, then rotate old checkpoints on this thread."""
+        if self._checkpoint_future is not None:
+            self._checkpoint_future.result()  # re-raises a failed write
+            self._checkpoint_future = None
+            if self.args.should_save:
+                # Rotation reads Trainer state (best checkpoint, save limit), so it never runs on the writer thread
+                self._rotate_checkpoints(use_mtime=False, output_dir=self._checkpoint_run_dir)
+
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            self.wait_for_checkpoints()
+
+    def _load_from_checkpoint(self, resume_from_checkpoint, model=None):
+        if not is_partial_checkpoint(resume_from_checkpoint):
+            return super()._load_from_checkpoint(resume_from_checkpoint, model=model)
+        start = time.perf_counter()
+        state = load_trainable(model if model is not None else self.model, resume_from_checkpoint)
+        print(f"♻️  Resumed {len(state)} trainable tensors from {resume_from_checkpoint} "
+              f"in {time.perf_counter() - start:.2f}s (frozen weights from the base model)")
+
+    def _load_best_model(self):
+        self.wait_for_checkpoints()  # runs inside train(), possibly while the best checkpoint is still being written
+        best = self.state.best_model_checkpoint
+        if best and is_partial_checkpoint(best):
+            load_trainable(self.model, best)
+            return
+        return super()._load_best_model()
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def benchmark_save(trainer: Any, base_model: str, tmp_root: Optional[str] = None) -> Dict[str, float]:
+    """
+    Save and resume the trainer's current state both ways, in a scratch directory.
+
+    Stock: full `save_model` plus optimizer/scheduler/RNG files; resume loads
+    the full weights and the optimizer. Partial: the blocking snapshot, the
+    background write, and a resume that loads `base_model` plus the trainable
+    tensors and the optimizer.
+    """
+    from transformers import WhisperForConditionalGeneration
+
+    root = tempfile.mkdtemp(prefix="ckpt-bench-", dir=tmp_root)
+    full_dir, part_dir = os.path.join(root, "full"), os.path.join(root, "partial")
+    try:
+        start = time.perf_counter()
+        trainer.save_model(full_dir)
+        torch.save(trainer.optimizer.state_dict(), os.path.join(full_dir, OPTIMIZER_NAME))
+        torch.save(trainer.lr_scheduler.state_dict(), os.path.join(full_dir, SCHEDULER_NAME))
+        torch.save(rng_state(trainer.args), os.path.join(full_dir, rng_file(trainer.args)))
+        full_save_s = time.perf_counter() - start
+
+        from safetensors.torch import save_file
+
+        start = time.perf_counter()
+        trainable = trainable_state(trainer.model)
+        optimizer = _to_cpu(trainer.optimizer.state_dict())
+        blocking_s = time.perf_counter() - start
+        os.makedirs(part_dir)
+        save_file(trainable, os.path.join(part_dir, TRAINABLE_FILE))
+        torch.save(optimizer, os.path.join(part_dir, OPTIMIZER_NAME))
+        torch.save(trainer.lr_scheduler.state_dict(), os.path.join(part_dir, SCHEDULER_NAME))
+        torch.save(rng_state(trainer.args), os.path.join(part_dir, rng_file(trainer.args)))
+        partial_save_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        WhisperForConditionalGeneration.from_pretrained(full_dir)
+        torch.load(os.path.join(full_dir, OPTIMIZER_NAME), map_location="cpu")
+        full_resume_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        load_trainable(WhisperForConditionalGeneration.from_pretrained(base_model), part_dir)
+        torch.load(os.path.join(part_dir, OPTIMIZER_NAME), map_location="cpu")
+        partial_resume_s = time.perf_counter() - start
+
+        return {
+            "full_mb": _dir_mb(full_dir), "partial_mb": _dir_mb(part_dir),
+            "full_save_s": full_save_s, "partial_blocking_s": blocking_s, "partial_save_s": partial_save_s,
+            "full_resume_s": full_resume_s, "partial_resume_s": partial_resume_s,
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def describe(r: Dict[str, float]) -> str:
+    return (f"💾 Checkpoint: stock {r['full_mb']:.0f} MB, {r['full_save_s']:.2f}s blocking | "
+            f"trainable-only {r['partial_mb']:.0f} MB, {r['partial_blocking_s']:.2f}s blocking "
+            f"({r['partial_save_s']:.2f}s incl. background write)\n"
+            f"   Resume: stock {r['full_resume_s']:.2f}s | base + trainable {r['partial_resume_s']:.2f}s")
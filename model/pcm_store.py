@@ -0,0 +1,217 @@
+"""
+Decoded-PCM shard store
+Audio is decoded and resampled once into 16 kHz int16 shards; later epochs read zero-copy memmap slices
+
+Usage (decode throughput vs cached store):
+    python pcm_store.py --subset hi --samples 200
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import torch
+
+from data_pipeline import ffmpeg_decode, default_workers
+
+PCM_SCALE = 32767.0  # float [-1, 1] <-> int16; the same factor is used to write and read
+
+
+class PCMStore:
+    """
+    Read side of the store: `<dir>/pcm-XXXXX.i16` raw int16 shards plus
+    `index.npy` with one `(shard, offset, length)` row per clip.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.sampling_rate = int(self.meta["sampling_rate"])
+        self.index = np.load(os.path.join(path, "index.npy"))
+        self._shards: Dict[int, np.memmap] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _shard(self, n: int) -> np.memmap:
+        shard = self._shards.get(n)
+        if shard is None:
+            shard = np.memmap(os.path.join(self.path, f"pcm-{n:05d}.i16"), dtype=np.int16, mode="r")
+            self._shards[n] = shard
+        return shard
+
+    def pcm(self, i: int) -> np.ndarray:
+        """Zero-copy int16 view of clip `i`."""
+        shard, offset, length = self.index[i]
+        return self._shard(int(shard))[offset:offset + length]
+
+    def array(self, i: int) -> np.ndarray:
+        """Clip `i` as float32 in [-1, 1] (the layout `datasets` returns)."""
+        return self.pcm(i).astype(np.float32) / PCM_SCALE
+
+    def durations(self) -> List[float]:
+        return (self.index[:, 2] / self.sampling_rate).tolist()
+
+    # -----------------------------
+    # Building
+    # -----------------------------
+    @staticmethod
+    def is_complete(path: str) -> bool:
+        meta = os.path.join(path, "meta.json")
+        if not os.path.exists(meta):
+            return False
+        with open(meta) as f:
+            return bool(json.load(f).get("complete"))
+
+    @classmethod
+    def build(cls, dataset: Any, path: str, audio_column: str = "audio", sampling_rate: int = 16000,
+              shard_bytes: int = 256 * 1024 * 1024, num_workers: Optional[int] = None) -> "PCMStore":
+        """
+        Decode every clip of `dataset` once (in parallel) and write the shards.
+
+        Pass a `decode=False` dataset so FFmpeg does the decoding in the
+        worker threads; already-decoded rows are only converted to int16.
+        """
+        os.makedirs(path, exist_ok=True)
+        num_workers = num_workers or default_workers()
+        index = np.zeros((len(dataset), 3), dtype=np.int64)
+        shard_n, shard_fill, fh = 0, 0, None
+
+        def decode(i: int) -> np.ndarray:
+            pcm = ffmpeg_decode(dataset[i][audio_column], sampling_rate)
+            return (np.clip(pcm, -1.0, 1.0) * PCM_SCALE).round().astype(np.int16)
+
+        print(f"💽 Decoding {len(dataset)} clips into PCM shards at {path}")
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            chunk = max(4 * num_workers, 16)
+            for start in range(0, len(dataset), chunk):
+                ids = range(start, min(start + chunk, len(dataset)))
+                for i, pcm in zip(ids, pool.map(decode, ids)):
+                    if fh is None or (shard_fill > 0 and shard_fill + pcm.nbytes > shard_bytes):
+                        if fh is not None:
+                            fh.close()
+                            shard_n += 1
+                        fh, shard_fill = open(os.path.join(path, f"pcm-{shard_n:05d}.i16"), "wb"), 0
+                    index[i] = (shard_n, shard_fill // 2, len(pcm))
+                    fh.write(pcm.tobytes())
+                    shard_fill += pcm.nbytes
+        if fh is not None:
+            fh.close()
+        np.save(os.path.join(path, "index.npy"), index)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"sampling_rate": sampling_rate, "rows": len(dataset), "complete": True}, f)
+        return cls(path)
+
+    @classmethod
+    def open_or_build(cls, dataset: Any, root: str, **kwargs) -> "PCMStore":
+        """Store for `dataset`, keyed on its `datasets` fingerprint."""
+        key = getattr(dataset, "_fingerprint", None) or f"rows-{len(dataset)}"
+        path = os.path.join(root, key)
+        if cls.is_complete(path):
+            return cls(path)
+        return cls.build(dataset, path, **kwargs)
+
+
+class PCMAudioDataset(torch.utils.data.Dataset):
+    """
+    Rows of `dataset` with the audio column served from a `PCMStore`.
+
+    Rows keep the `{"audio": {"array", "sampling_rate"}}` layout, so the
+    collators, packing and caches work unchanged. String keys return columns
+    of the non-audio part (e.g. `ds["labels"]`) without touching audio.
+    """
+
+    def __init__(self, store: PCMStore, dataset: Any, audio_column: str = "audio"):
+        if len(store) != len(dataset):
+            raise ValueError(f"PCM store has {len(store)} clips but dataset has {len(dataset)} rows")
+        self.store = store
+        self.audio_column = audio_column
+        self.rows = dataset.remove_columns([audio_column]) if audio_column in dataset.column_names else dataset
+        self._fingerprint = f"pcm-{getattr(dataset, '_fingerprint', len(dataset))}"
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    @property
+    def column_names(self) -> List[str]:
+        return [self.audio_column] + list(self.rows.column_names)
+
+    @property
+    def labels(self) -> List[Any]:
+        return self.rows["labels"]
+
+    def durations(self) -> List[float]:
+        return self.store.durations()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.rows[key]
+        row = dict(self.rows[key])
+        row[self.audio_column] = {"array": self.store.array(key), "sampling_rate": self.store.sampling_rate}
+        return row
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def benchmark(dataset: Any, store: PCMStore, audio_column: str = "audio") -> Dict[str, float]:
+    """Clips/sec and audio-seconds/sec: `datasets` decode vs PCM store reads."""
+    n = len(store)
+    start = time.perf_counter()
+    audio_s = 0.0
+    for i in range(n):
+        a = dataset[i][audio_column]
+        audio_s += len(a["array"]) / a["sampling_rate"]
+    decode_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(n):
+        store.array(i)
+    store_s = time.perf_counter() - start
+    return {
+        "clips": n,
+        "audio_s": audio_s,
+        "decode_clips_per_s": n / decode_s,
+        "store_clips_per_s": n / store_s,
+        "decode_realtime_x": audio_s / decode_s,
+        "store_realtime_x": audio_s / store_s,
+        "speedup": decode_s / store_s,
+    }
+
+
+def main():
+    from datasets import load_dataset, Audio
+
+    parser = argparse.ArgumentParser(description="Build a PCM store and compare it against on-the-fly decoding")
+    parser.add_argument("--dataset", default="ekacare/eka-medical-asr-evaluation-dataset")
+    parser.add_argument("--subset", default="hi")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--root", default=os.getenv("PCM_STORE_DIR", "./pcm-store"))
+    args = parser.parse_args()
+
+    ds = load_dataset(args.dataset, args.subset, split=args.split)
+    ds = ds.select(range(min(args.samples, len(ds)))).cast_column("audio", Audio(sampling_rate=16000))
+
+    start = time.perf_counter()
+    store = PCMStore.open_or_build(ds.cast_column("audio", Audio(sampling_rate=16000, decode=False)), args.root)
+    print(f"   store ready in {time.perf_counter() - start:.1f}s ({len(store)} clips)")
+
+    res = benchmark(ds, store)
+    print(f"\n📊 {res['clips']} clips, {res['audio_s'] / 60:.1f} min of audio")
+    print(f"   datasets decode : {res['decode_clips_per_s']:.1f} clips/s ({res['decode_realtime_x']:.0f}x realtime)")
+    print(f"   PCM store       : {res['store_clips_per_s']:.1f} clips/s ({res['store_realtime_x']:.0f}x realtime)")
+    print(f"   speedup         : {res['speedup']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
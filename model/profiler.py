@@ -0,0 +1,254 @@
+"""
+Step-level training profiler
+TrainerCallback with a per-step time breakdown, JSONL log and Chrome/Perfetto trace export
+
+Enable in any training script with PROFILE=1 (output goes to
+<output_dir>/profile/). When disabled, nothing is registered, so the
+training loop is untouched.
+"""
+
+import json
+import os
+import resource
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+from transformers import TrainerCallback
+
+FRAME_S = 0.01  # one log-mel frame (hop 160 @ 16 kHz)
+
+
+def profiling_enabled() -> bool:
+    return os.getenv("PROFILE", "0") != "0"
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KiB on Linux
+
+
+def _audio_seconds(features: torch.Tensor) -> float:
+    """Non-padding audio in a log-mel batch: padded frames sit at the per-clip floor value."""
+    floor = features.amin(dim=(1, 2), keepdim=True)
+    frames = (features.amax(dim=1, keepdim=True) > floor + 1e-4).sum()
+    return float(frames) * FRAME_S
+
+
+class StepProfilerCallback(TrainerCallback):
+    """
+    Records, per optimizer step: data wait, forward, backward, optimizer and
+    eval time, peak RSS / CUDA memory, audio-seconds/s and label tokens/s.
+
+    Tokens and audio are counted from each collated batch as it enters
+    `training_step` (see `count_batch`), before `compute_loss` can pop the
+    labels. Batches without `input_features` (e.g. cached encoder states)
+    carry no audio, so `audio_s_per_s` is null for such steps.
+
+    Every micro-batch of a gradient-accumulation step is timed on its own.
+    Its data wait runs from the end of the previous micro-batch (or step) to
+    its forward, and its compute span from there to `on_substep_end` (or
+    `on_pre_optimizer_step` for the last one). Forward time comes from hooks
+    on the model, backward is the rest of the compute spans, and optimizer
+    time is the `on_pre_optimizer_step` -> `on_optimizer_step` span.
+    """
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.records: List[Dict[str, Any]] = []
+        self.events: List[Dict[str, Any]] = []
+        self._hooks = []
+        self._cuda = torch.cuda.is_available()
+        self._t0 = time.perf_counter()
+        self._micro_mark: Optional[float] = None  # end of the previous micro-batch, step or eval
+        self._reset_step()
+        self._last_end: Optional[float] = None
+        self._fh = None
+
+    # -----------------------------
+    # Timing primitives
+    # -----------------------------
+    def _now(self) -> float:
+        if self._cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _event(self, name: str, start: float, end: float, **extra):
+        self.events.append({
+            "name": name, "ph": "X", "pid": os.getpid(), "tid": extra.pop("tid", 0),
+            "ts": (start - self._t0) * 1e6, "dur": (end - start) * 1e6, "args": extra,
+        })
+
+    def _reset_step(self):
+        self._step_begin = None
+        self._fwd_s = 0.0
+        self._fwd_start = None
+        self._fwd_end = None
+        self._micro_start = None   # first forward of the running micro-batch
+        self._data_wait_s = 0.0
+        self._compute_s = 0.0
+        self._opt_start = None
+        self._opt_s = 0.0
+        self._compute_end = None
+        self._audio_s = 0.0
+        self._audio_seen = False
+        self._tokens = 0
+
+    # -----------------------------
+    # Model hooks
+    # -----------------------------
+    def _pre_forward(self, module, args, kwargs):
+        if not module.training:
+            return
+        self._fwd_start = self._now()
+        if self._micro_start is None:
+            wait_from = self._micro_mark if self._micro_mark is not None else self._fwd_start
+            self._data_wait_s += max(self._fwd_start - wait_from, 0.0)
+            self._event("data_wait", wait_from, self._fwd_start)
+            self._micro_start = self._fwd_start
+
+    def _post_forward(self, module, args, kwargs, output):
+        if not module.training or self._fwd_start is None:
+            return
+        end = self._now()
+        self._fwd_s += end - self._fwd_start
+        self._event("forward", self._fwd_start, end, tid=1)
+        self._fwd_start = None
+        self._fwd_end = end
+
+    def count_batch(self, inputs: Dict[str, Any]):
+        """Add one collated micro-batch's label tokens and audio seconds to the running step."""
+        labels = inputs.get("labels")
+        if labels is not None:
+            self._tokens += int((labels != -100).sum())
+        feats = inputs.get("input_features")
+        if feats is not None:
+            self._audio_s += _audio_seconds(feats.detach())
+            self._audio_seen = True
+
+    # -----------------------------
+    # Trainer events
+    # -----------------------------
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._fh = open(os.path.join(self.out_dir, "steps.jsonl"), "w")
+        if model is not None:
+            self._hooks = [
+                model.register_forward_pre_hook(self._pre_forward, with_kwargs=True),
+                model.register_forward_hook(self._post_forward, with_kwargs=True),
+            ]
+        if self._cuda:
+            torch.cuda.reset_peak_memory_stats()
+        self._last_end = self._micro_mark = self._now()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._step_begin = self._now()
+
+    def _end_micro_batch(self) -> float:
+        """Close the running micro-batch's compute span; the next data wait starts here."""
+        end = self._now()
+        if self._micro_start is not None:
+            self._compute_s += end - self._micro_start
+            self._event("backward", self._fwd_end or self._micro_start, end, tid=2)
+        self._micro_start = self._fwd_end = None
+        self._micro_mark = end
+        return end
+
+    def on_substep_end(self, args, state, control, **kwargs):
+        self._end_micro_batch()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._opt_start = self._compute_end = self._end_micro_batch()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        if self._opt_start is not None:
+            end = self._now()
+            self._opt_s = end - self._opt_start
+            self._event("optimizer", self._opt_start, end, tid=1)
+
+    def on_step_end(self, args, state, control, **kwargs):
+        end = self._now()
+        start = self._last_end if self._last_end is not None else (self._step_begin or end)
+        if self._compute_end is None:  # no optimizer-step events (older transformers)
+            self._compute_end = self._end_micro_batch()
+        step_s = end - start
+        data_wait = self._data_wait_s
+        backward = max(self._compute_s - self._fwd_s, 0.0)
+        rec = {
+            "step": state.global_step,
+            "step_s": step_s,
+            "data_wait_s": data_wait,
+            "forward_s": self._fwd_s,
+            "backward_s": backward,
+            "optimizer_s": self._opt_s,
+            "peak_rss_mb": _peak_rss_mb(),
+            "audio_s_per_s": (self._audio_s / step_s if step_s > 0 else 0.0) if self._audio_seen else None,
+            "tokens_per_s": self._tokens / step_s if step_s > 0 else 0.0,
+        }
+        if self._cuda:
+            rec["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 1024**2
+        self._write(rec)
+        self._event(f"step {state.global_step}", start, end, **{k: v for k, v in rec.items() if k != "step"})
+        self._reset_step()
+        self._last_end = self._micro_mark = end
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        # Evaluation runs right after the step that triggered it
+        end = self._now()
+        if self._last_end is not None:
+            self._write({"step": state.global_step, "eval_s": end - self._last_end})
+            self._event("evaluate", self._last_end, end, step=state.global_step)
+        self._last_end = self._micro_mark = end
+
+    def on_save(self, args, state, control, **kwargs):
+        end = self._now()
+        if self._last_end is not None:
+            self._event("save", self._last_end, end, step=state.global_step)
+        self._last_end = self._micro_mark = end
+
+    def on_train_end(self, args, state, control, **kwargs):
+        for h in self._hooks:
+            h.remove()
+        self._hooks = []
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        with open(os.path.join(self.out_dir, "trace.json"), "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        print(self.summary())
+
+    # -----------------------------
+    # Output
+    # -----------------------------
+    def _write(self, rec: Dict[str, Any]):
+        self.records.append(rec)
+        if self._fh is not None:
+            self._fh.write(json.dumps(rec) + "\n")
+            self._fh.flush()
+
+    def summary(self) -> str:
+        steps = [r for r in self.records if "step_s" in r]
+        if not steps:
+            return "🩺 Profiler: no steps recorded"
+        total = sum(r["step_s"] for r in steps) or 1.0
+        parts = ["data_wait_s", "forward_s", "backward_s", "optimizer_s"]
+        shares = ", ".join(f"{p[:-2]} {sum(r[p] for r in steps) / total * 100:.0f}%" for p in parts)
+        eval_s = sum(r.get("eval_s", 0.0) for r in self.records)
+        return (f"🩺 Profiler: {len(steps)} steps, {total / len(steps) * 1000:.0f} ms/step ({shares}); "
+                f"eval {eval_s:.1f}s; trace -> {os.path.join(self.out_dir, 'trace.json')}")
+
+
+def maybe_add_profiler(trainer: Any, out_dir: Optional[str] = None) -> Optional[StepProfilerCallback]:
+    """Attach the profiler when PROFILE=1; otherwise a no-op."""
+    if not profiling_enabled():
+        return None
+    cb = StepProfilerCallback(out_dir or os.path.join(trainer.args.output_dir, "profile"))
+    trainer.add_callback(cb)
+    training_step = trainer.training_step
+
+    def counted_training_step(model, inputs, *args, **kwargs):
+        cb.count_batch(inputs)
+        return training_step(model, inputs, *args, **kwargs)
+
+    trainer.training_step = counted_training_step
+    print(f"🩺 Step profiler on -> {cb.out_dir}")
+    return cb
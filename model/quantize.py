@@ -0,0 +1,184 @@
+"""
+Dynamic int8 quantization for PyTorch CPU inference
+Quantizes every nn.Linear of a fine-tuned Whisper and publishes the artifact only if WER/CER hold up
+
+The artifact directory holds the checkpoint's config, generation config and
+processor, plus `quantized_state.pt` (the int8 state dict) and
+`quantization.json` (what was measured when it was published). Loading
+rebuilds the fp32 module from the config, applies the same dynamic
+quantization and loads the int8 weights. No ONNX or CTranslate2 dependency
+is needed.
+
+Guard: the fp32 and int8 models are scored on the held-out split. If WER or
+CER gets worse by more than the configured number of points, the artifact
+is left at `<out>.rejected` and the command exits non-zero.
+
+Usage:
+    python quantize.py --model ./whisper-tiny-test-final --out ./whisper-tiny-int8 --subset hi --samples 100
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from typing import Any, Dict, Optional, Sequence
+
+import torch
+from transformers import WhisperConfig, WhisperForConditionalGeneration
+
+from export import Backend, PyTorchBackend, eval_rows, evaluate_backend, weights_size_mb
+from inference import load_processor
+
+STATE_FILE = "quantized_state.pt"
+META_FILE = "quantization.json"
+
+
+def _select_engine():
+    engines = torch.backends.quantized.supported_engines
+    for name in ("x86", "fbgemm", "qnnpack"):
+        if name in engines:
+            torch.backends.quantized.engine = name
+            return name
+    return torch.backends.quantized.engine
+
+
+def quantize_model(model: WhisperForConditionalGeneration, skip: Sequence[str] = ()) -> WhisperForConditionalGeneration:
+    """
+    Dynamic int8 (weights int8, activations quantized on the fly) for every nn.Linear not under a name in `skip`.
+
+    `proj_out` (the vocabulary projection) is the largest Linear in small
+    Whisper models, so it is quantized unless listed in `skip`.
+    """
+    _select_engine()
+    model = model.float().eval()
+    targets = {name for name, m in model.named_modules()
+               if isinstance(m, torch.nn.Linear) and not any(name.startswith(s) for s in skip)}
+    return torch.ao.quantization.quantize_dynamic(model, targets, dtype=torch.qint8)
+
+
+def save_quantized(model: torch.nn.Module, source_dir: str, out_dir: str, meta: Dict[str, Any]):
+    os.makedirs(out_dir, exist_ok=True)
+    torch.save(model.state_dict(), os.path.join(out_dir, STATE_FILE))
+    model.config.save_pretrained(out_dir)
+    model.generation_config.save_pretrained(out_dir)
+    load_processor(source_dir).save_pretrained(out_dir)
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_quantized(path: str) -> WhisperForConditionalGeneration:
+    """Rebuild the module from the config, re-apply dynamic quantization and load the int8 weights."""
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    model = WhisperForConditionalGeneration(WhisperConfig.from_pretrained(path))
+    try:
+        from transformers import GenerationConfig
+        model.generation_config = GenerationConfig.from_pretrained(path)
+    except OSError:
+        pass
+    model = quantize_model(model, skip=meta.get("skip", ()))
+    model.load_state_dict(torch.load(os.path.join(path, STATE_FILE), map_location="cpu"))
+    model.config.use_cache = True
+    return model.eval()
+
+
+class QuantizedBackend(PyTorchBackend):
+    """`export.Backend` over a quantized artifact (load_backend kind "pytorch-int8")."""
+
+    name = "pytorch-int8"
+
+    def __init__(self, path: str, processor: Any, model: Optional[torch.nn.Module] = None, **kwargs: Any):
+        Backend.__init__(self, path, processor, **kwargs)
+        self.model = model if model is not None else load_quantized(path)
+
+
+# -----------------------------
+# Guarded publish
+# -----------------------------
+def quantize_and_publish(model_dir: str, out_dir: str, rows: Sequence[Dict[str, Any]], max_wer_delta: float = 1.0,
+                         max_cer_delta: float = 1.0, skip: Sequence[str] = (), language: Optional[str] = None,
+                         num_beams: int = 1) -> Dict[str, Any]:
+    """Quantize, score fp32 vs int8 on `rows`, publish to `out_dir` only if both deltas are within limits."""
+    processor = load_processor(model_dir)
+    fp32 = PyTorchBackend(model_dir, processor, num_beams=num_beams, language=language)
+    ref = evaluate_backend(fp32, rows)
+
+    int8_model = quantize_model(WhisperForConditionalGeneration.from_pretrained(model_dir), skip=skip)
+    int8 = QuantizedBackend(out_dir, processor, model=int8_model, num_beams=num_beams, language=language)
+    res = evaluate_backend(int8, rows)
+
+    report = {
+        "source": os.path.abspath(model_dir),
+        "skip": list(skip),
+        "engine": torch.backends.quantized.engine,
+        "samples": len(rows),
+        "fp32": ref,
+        "int8": res,
+        "wer_delta": res["wer"] - ref["wer"],
+        "cer_delta": res["cer"] - ref["cer"],
+        "max_wer_delta": max_wer_delta,
+        "max_cer_delta": max_cer_delta,
+        "fp32_size_mb": weights_size_mb("pytorch", model_dir),
+    }
+    report["accepted"] = report["wer_delta"] <= max_wer_delta and report["cer_delta"] <= max_cer_delta
+
+    staging = f"{out_dir}.staging"
+    shutil.rmtree(staging, ignore_errors=True)
+    save_quantized(int8_model, model_dir, staging, report)
+    report["int8_size_mb"] = os.path.getsize(os.path.join(staging, STATE_FILE)) / 1024**2
+    with open(os.path.join(staging, META_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+
+    target = out_dir if report["accepted"] else f"{out_dir}.rejected"
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(staging, target)
+    report["path"] = target
+    return report
+
+
+def print_report(r: Dict[str, Any]):
+    fp, q = r["fp32"], r["int8"]
+    print(f"\n📊 Dynamic int8 vs fp32 on {r['samples']} held-out utterances (engine: {r['engine']})")
+    print("| model | size MB | latency ms (mean / p95) | WER | CER |")
+    print("|---|---:|---:|---:|---:|")
+    print(f"| fp32 | {r['fp32_size_mb']:.0f} | {fp['latency_ms_mean']:.0f} / {fp['latency_ms_p95']:.0f} | "
+          f"{fp['wer']:.2f} | {fp['cer']:.2f} |")
+    print(f"| int8 | {r['int8_size_mb']:.0f} | {q['latency_ms_mean']:.0f} / {q['latency_ms_p95']:.0f} | "
+          f"{q['wer']:.2f} | {q['cer']:.2f} |")
+    print(f"   ΔWER {r['wer_delta']:+.2f} (limit {r['max_wer_delta']}), ΔCER {r['cer_delta']:+.2f} "
+          f"(limit {r['max_cer_delta']}), {r['fp32_size_mb'] / max(r['int8_size_mb'], 1e-9):.1f}x smaller, "
+          f"{fp['latency_ms_mean'] / max(q['latency_ms_mean'], 1e-9):.2f}x faster")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dynamic int8 quantization with a WER/CER publish guard")
+    parser.add_argument("--model", required=True, help="Fine-tuned output dir, e.g. ./whisper-tiny-test-final")
+    parser.add_argument("--out", default=None, help="Artifact dir (default: <model>-int8)")
+    parser.add_argument("--dataset", default="ekacare/eka-medical-asr-evaluation-dataset")
+    parser.add_argument("--subset", default="hi")
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--heldout-fraction", type=float, default=0.1,
+                        help="Score on a.py's held-out split (train_test_split(test_size, seed=42)); 0 = first samples")
+    parser.add_argument("--max-wer-delta", type=float, default=float(os.getenv("QUANT_MAX_WER_DELTA", "1.0")))
+    parser.add_argument("--max-cer-delta", type=float, default=float(os.getenv("QUANT_MAX_CER_DELTA", "1.0")))
+    parser.add_argument("--skip", default="", help="Comma-separated module prefixes to keep in fp32, e.g. proj_out")
+    parser.add_argument("--language", default=None)
+    parser.add_argument("--beams", type=int, default=1)
+    args = parser.parse_args()
+
+    out = args.out or f"{args.model.rstrip('/')}-int8"
+    rows = eval_rows(args.dataset, args.subset, args.samples, load_processor(args.model),
+                     test_size=args.heldout_fraction or None)
+    report = quantize_and_publish(args.model, out, rows, args.max_wer_delta, args.max_cer_delta,
+                                  skip=[s for s in args.skip.split(",") if s], language=args.language,
+                                  num_beams=args.beams)
+    print_report(report)
+    if not report["accepted"]:
+        print(f"❌ Degradation over the limit; not published (left at {report['path']})")
+        sys.exit(1)
+    print(f"✅ Published {report['path']}")
+
+
+if __name__ == "__main__":
+    main()
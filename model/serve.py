@@ -0,0 +1,237 @@
+"""
+Local Whisper transcription service
+HTTP + WebSocket endpoints with dynamic micro-batching in front of a fine-tuned checkpoint
+
+Concurrent requests wait in a queue. A batch is dispatched as soon as it has
+`max_batch` clips, or once the oldest request has waited `max_wait_ms`,
+whichever comes first. Batches run one at a time on a single inference thread.
+
+Endpoints:
+    POST /transcribe     body = audio file (WAV or anything FFmpeg reads) -> {"text", "latency_ms", "batch_size"}
+    GET  /ws             WebSocket; each binary message is one clip, each reply is the JSON above
+    GET  /stats          p50/p95/p99 latency, requests/s, mean batch size
+    GET  /health
+
+Usage:
+    python serve.py --model ./whisper-tiny-test-final --max-batch 8 --max-wait-ms 20
+    python loadgen.py --url http://localhost:8000 --requests 200 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from aiohttp import WSMsgType, web
+
+from inference import WhisperEngine, default_model_dir, read_audio
+
+
+def percentiles(values: Any, qs=(50, 95, 99)) -> Dict[str, float]:
+    if len(values) == 0:
+        return {f"p{q}": 0.0 for q in qs}
+    arr = np.percentile(np.asarray(values, dtype=np.float64), qs)
+    return {f"p{q}": float(v) for q, v in zip(qs, arr)}
+
+
+@dataclass
+class ServiceStats:
+    """Rolling latency window plus totals since start."""
+    window: int = 2000
+    started: float = field(default_factory=time.monotonic)
+    requests: int = 0
+    batches: int = 0
+    batched_clips: int = 0
+    latencies_ms: Deque[float] = field(default_factory=deque)
+
+    def record_batch(self, size: int):
+        self.batches += 1
+        self.batched_clips += size
+
+    def record_request(self, latency_ms: float):
+        self.requests += 1
+        self.latencies_ms.append(latency_ms)
+        if len(self.latencies_ms) > self.window:
+            self.latencies_ms.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        return {
+            "requests": self.requests,
+            "requests_per_s": self.requests / elapsed if elapsed > 0 else 0.0,
+            "mean_batch_size": self.batched_clips / max(self.batches, 1),
+            "latency_ms": percentiles(self.latencies_ms),
+        }
+
+
+@dataclass
+class _Pending:
+    audio: np.ndarray
+    future: asyncio.Future
+    arrived: float   # entered the queue (batching deadline)
+    received: float  # request came in (latency)
+
+
+class MicroBatcher:
+    """Collects requests into batches of at most `max_batch`, waiting at most `max_wait_ms` for stragglers."""
+
+    def __init__(self, engine: WhisperEngine, max_batch: int = 8, max_wait_ms: float = 20.0,
+                 stats: Optional[ServiceStats] = None):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000.0
+        self.stats = stats or ServiceStats()
+        self.queue: "asyncio.Queue[_Pending]" = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, audio: np.ndarray, received: Optional[float] = None) -> Dict[str, Any]:
+        now = time.perf_counter()
+        item = _Pending(audio, asyncio.get_running_loop().create_future(), now, received or now)
+        await self.queue.put(item)
+        return await item.future
+
+    async def _collect(self) -> List[_Pending]:
+        batch = [await self.queue.get()]
+        deadline = batch[0].arrived + self.max_wait_s
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            try:
+                texts = await loop.run_in_executor(self._executor, self.engine.transcribe, [b.audio for b in batch])
+            except Exception as err:  # one bad batch must not take the service down
+                for b in batch:
+                    if not b.future.done():
+                        b.future.set_exception(err)
+                continue
+            self.stats.record_batch(len(batch))
+            done = time.perf_counter()
+            for b, text in zip(batch, texts):
+                latency_ms = (done - b.received) * 1000.0
+                self.stats.record_request(latency_ms)
+                if not b.future.done():
+                    b.future.set_result({"text": text, "latency_ms": latency_ms, "batch_size": len(batch)})
+
+
+# -----------------------------
+# HTTP / WebSocket handlers
+# -----------------------------
+class BadAudio(Exception):
+    """The request body could not be decoded as audio."""
+
+
+async def _transcribe_bytes(batcher: MicroBatcher, data: bytes) -> Dict[str, Any]:
+    received = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        audio = await loop.run_in_executor(None, read_audio, data)  # decoding stays off the event loop
+    except Exception as err:
+        raise BadAudio(str(err) or type(err).__name__) from err
+    return await batcher.submit(audio, received)
+
+
+def _error(err: Exception) -> Tuple[Dict[str, str], int]:
+    """JSON error body and HTTP status: 422 for undecodable audio, 500 for anything the service failed at."""
+    if isinstance(err, BadAudio):
+        return {"error": f"cannot decode audio: {err}"}, 422
+    return {"error": f"{type(err).__name__}: {err}"}, 500
+
+
+async def handle_transcribe(request: web.Request) -> web.Response:
+    data = await request.read()
+    if not data:
+        return web.json_response({"error": "empty body"}, status=400)
+    try:
+        return web.json_response(await _transcribe_bytes(request.app["batcher"], data))
+    except Exception as err:
+        body, status = _error(err)
+        return web.json_response(body, status=status)
+
+
+async def handle_ws(request: web.Request) -> web.WebSocketResponse:
+    ws = web.WebSocketResponse(max_msg_size=64 * 1024 * 1024)
+    await ws.prepare(request)
+    async for msg in ws:
+        if msg.type == WSMsgType.BINARY:
+            try:
+                await ws.send_json(await _transcribe_bytes(request.app["batcher"], msg.data))
+            except Exception as err:  # report it and keep the connection open
+                await ws.send_json(_error(err)[0])
+        elif msg.type == WSMsgType.ERROR:
+            break
+    return ws
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app["batcher"].stats.snapshot())
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"ok": True, "model": request.app["model_dir"]})
+
+
+def make_app(engine: WhisperEngine, model_dir: str, max_batch: int = 8, max_wait_ms: float = 20.0) -> web.Application:
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app["model_dir"] = model_dir
+
+    async def on_startup(app: web.Application):
+        app["batcher"] = MicroBatcher(engine, max_batch=max_batch, max_wait_ms=max_wait_ms)
+        app["batcher"].start()
+
+    async def on_cleanup(app: web.Application):
+        await app["batcher"].stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/transcribe", handle_transcribe)
+    app.router.add_get("/ws", handle_ws)
+    app.router.add_get("/stats", handle_stats)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fine-tuned Whisper checkpoint with dynamic batching")
+    parser.add_argument("--model", default=None, help="Checkpoint dir (default: first one the training scripts saved)")
+    parser.add_argument("--base-model", default="openai/whisper-tiny", help="Tokenizer source if the checkpoint has none")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20.0)
+    parser.add_argument("--beams", type=int, default=1)
+    parser.add_argument("--device", default=None)
+    args = parser.parse_args()
+
+    model_dir = args.model or default_model_dir()
+    print(f"🔍 Loading {model_dir}")
+    engine = WhisperEngine(model_dir, device=args.device, num_beams=args.beams, base_model=args.base_model)
+    engine.transcribe([np.zeros(16000, dtype=np.float32)])  # warm-up
+    print(f"🎙️  Serving on http://{args.host}:{args.port} (max_batch={args.max_batch}, max_wait={args.max_wait_ms} ms)")
+    web.run_app(make_app(engine, model_dir, args.max_batch, args.max_wait_ms), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Speculative (assisted) decoding
+The fine-tuned whisper-tiny drafts tokens; the fine-tuned whisper-small verifies them in one forward pass
+
+With greedy decoding, every drafted token the target would also have picked
+is kept. At the first disagreement the target's own token is taken. The
+transcript is therefore token-for-token the target's greedy output, and each
+target forward pass produces one or more tokens instead of exactly one. The
+draft must share the target's tokenizer and log-mel settings. Acceptance is
+best when both were fine-tuned on the same language and domain.
+
+`transformers` runs assisted generation one clip at a time, so this mode is
+aimed at interactive latency rather than batch throughput.
+
+Usage (identity check + accepted tokens per step + speedup on the eval split):
+    python speculative.py --target ./whisper-finetuned-medical --draft ./whisper-tiny-test-final --samples 50
+"""
+
+import argparse
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+from transformers import WhisperForConditionalGeneration
+
+from distill import check_compatible
+from inference import WhisperEngine
+
+
+class ForwardCounter:
+    """Counts forward calls of a module (here: a Whisper decoder, one call per decoding step)."""
+
+    def __init__(self, module: torch.nn.Module):
+        self.calls = 0
+        self._handle = module.register_forward_pre_hook(self._hook)
+
+    def _hook(self, module, args):
+        self.calls += 1
+
+    def reset(self) -> int:
+        calls, self.calls = self.calls, 0
+        return calls
+
+    def remove(self):
+        self._handle.remove()
+
+
+class SpeculativeEngine(WhisperEngine):
+    """
+    A `WhisperEngine` for the target checkpoint with a draft model attached.
+
+    `generate(..., assisted=False)` is plain greedy decoding of the target,
+    the reference that assisted output must match.
+    """
+
+    def __init__(self, target_dir: str, draft_dir: str, device: Optional[str] = None,
+                 base_model: str = "openai/whisper-small", dtype: Optional[torch.dtype] = None):
+        super().__init__(target_dir, device=device, num_beams=1, base_model=base_model, dtype=dtype)
+        self.draft = WhisperForConditionalGeneration.from_pretrained(draft_dir, torch_dtype=self.dtype).to(self.device).eval()
+        self.draft.config.use_cache = self.draft.generation_config.use_cache = True
+        check_compatible(self.draft, self.model)
+        self.target_steps = ForwardCounter(self.model.model.decoder)
+        self.draft_steps = ForwardCounter(self.draft.model.decoder)
+
+    @torch.inference_mode()
+    def generate(self, arrays: Sequence[np.ndarray], assisted: bool = True, **kwargs: Any) -> Any:
+        kwargs.update(num_beams=1, do_sample=False)
+        if not assisted:
+            return self.model.generate(self.features(arrays), use_cache=True, **kwargs)
+        # Assisted generation only supports batch size 1
+        feats = self.features(arrays)
+        out = [self.model.generate(feats[i:i + 1], assistant_model=self.draft, use_cache=True, **kwargs)[0]
+               for i in range(len(feats))]
+        width = max(len(o) for o in out)
+        pad = self.model.generation_config.pad_token_id
+        if pad is None:
+            pad = self.model.generation_config.eos_token_id
+        return torch.stack([torch.nn.functional.pad(o, (0, width - len(o)), value=pad) for o in out])
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def benchmark(engine: SpeculativeEngine, clips: Sequence[np.ndarray], references: Sequence[str],
+              **generate_kwargs: Any) -> Dict[str, Any]:
+    """
+    Decode every clip greedily and assisted, one clip at a time, and compare.
+
+    Accepted tokens per step = target decoder passes under greedy / under
+    assisted decoding. Greedy makes one pass per emitted token, so this is
+    the number of tokens each verification pass yields.
+    """
+    from asr_metrics import ErrorRateAccumulator
+
+    tok = engine.processor.tokenizer
+    engine.generate(clips[:1], assisted=False, **generate_kwargs)  # warm-up
+    engine.generate(clips[:1], assisted=True, **generate_kwargs)
+    engine.target_steps.reset()
+    engine.draft_steps.reset()
+
+    greedy_s, assisted_s, greedy_steps, assisted_steps, draft_steps = [], [], [], [], []
+    mismatches: List[int] = []
+    acc_greedy, acc_assisted = ErrorRateAccumulator(tok), ErrorRateAccumulator(tok)
+    for i, clip in enumerate(clips):
+        start = time.perf_counter()
+        ref_ids = engine.generate([clip], assisted=False, **generate_kwargs)[0]
+        greedy_s.append(time.perf_counter() - start)
+        greedy_steps.append(engine.target_steps.reset())
+
+        start = time.perf_counter()
+        ids = engine.generate([clip], assisted=True, **generate_kwargs)[0]
+        assisted_s.append(time.perf_counter() - start)
+        assisted_steps.append(engine.target_steps.reset())
+        draft_steps.append(engine.draft_steps.reset())
+
+        if ids.tolist() != ref_ids.tolist():
+            mismatches.append(i)
+        acc_greedy.update_text([tok.decode(ref_ids, skip_special_tokens=True)], [references[i]])
+        acc_assisted.update_text([tok.decode(ids, skip_special_tokens=True)], [references[i]])
+
+    return {
+        "clips": len(clips),
+        "identical": len(clips) - len(mismatches),
+        "mismatched_clips": mismatches,
+        "greedy_ms_mean": float(np.mean(greedy_s) * 1000),
+        "assisted_ms_mean": float(np.mean(assisted_s) * 1000),
+        "speedup": float(np.sum(greedy_s) / max(np.sum(assisted_s), 1e-9)),
+        "tokens_per_step": float(np.sum(greedy_steps) / max(np.sum(assisted_steps), 1)),
+        "draft_passes_per_step": float(np.sum(draft_steps) / max(np.sum(assisted_steps), 1)),
+        "greedy": acc_greedy.compute(),
+        "assisted": acc_assisted.compute(),
+    }
+
+
+def main():
+    from datasets import load_dataset, Audio
+
+    parser = argparse.ArgumentParser(description="Speculative decoding: tiny drafts, small verifies")
+    parser.add_argument("--target", default="./whisper-finetuned-medical", help="Fine-tuned whisper-small")
+    parser.add_argument("--draft", default="./whisper-tiny-test-final", help="Fine-tuned whisper-tiny")
+    parser.add_argument("--dataset", default="ekacare/eka-medical-asr-evaluation-dataset")
+    parser.add_argument("--subset", default="en")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--heldout-fraction", type=float, default=0.1,
+                        help="Clips from the held-out part of train_test_split(test_size, seed=42); 0 = first samples")
+    parser.add_argument("--language", default=None)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    ds = load_dataset(args.dataset, args.subset, split="test")
+    if args.heldout_fraction:
+        ds = ds.train_test_split(test_size=args.heldout_fraction, seed=42)["test"]
+    ds = ds.select(range(min(args.samples, len(ds)))).cast_column("audio", Audio(sampling_rate=16000))
+    clips = [np.asarray(r["audio"]["array"], dtype=np.float32) for r in ds]
+    references = list(ds["text"])
+
+    engine = SpeculativeEngine(args.target, args.draft, device=args.device)
+    kwargs = dict(language=args.language, task="transcribe") if args.language else {}
+    r = benchmark(engine, clips, references, **kwargs)
+
+    print(f"\n📊 Speculative decoding on {r['clips']} eval clips ({args.draft} -> {args.target})")
+    print(f"   identical to greedy : {r['identical']}/{r['clips']}")
+    print(f"   tokens per step     : {r['tokens_per_step']:.2f} (draft passes per step {r['draft_passes_per_step']:.2f})")
+    print(f"   latency             : greedy {r['greedy_ms_mean']:.0f} ms -> assisted {r['assisted_ms_mean']:.0f} ms "
+          f"({r['speedup']:.2f}x)")
+    print(f"   WER                 : greedy {r['greedy']['wer']:.2f} | assisted {r['assisted']['wer']:.2f}")
+    if r["mismatched_clips"]:
+        print(f"❌ Assisted output differs from greedy on clips {r['mismatched_clips']}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
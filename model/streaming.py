@@ -0,0 +1,52 @@
+"""
+Streaming dataset helpers for large fine-tuning runs
+Shuffle-buffered IterableDatasets with lazy feature extraction, so memory stays flat
+"""
+
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+from datasets import Audio, Dataset, IterableDataset, interleave_datasets, load_dataset
+
+
+def load_streaming_splits(dataset_id: str, subsets: Sequence[str], split: str = "train",
+                          eval_samples: int = 200, shuffle_buffer: int = 500, seed: int = 42,
+                          sampling_rate: int = 16000,
+                          columns: Sequence[str] = ("audio", "text")) -> Tuple[IterableDataset, IterableDataset]:
+    """
+    Stream one or more language subsets as (train, eval) IterableDatasets.
+
+    Subsets are interleaved (oversampling the shorter ones), the first
+    `eval_samples` rows are held out for evaluation and the rest are shuffled
+    through a `shuffle_buffer`-row buffer of still-encoded audio.
+    """
+    streams = [
+        load_dataset(dataset_id, subset, split=split, streaming=True).select_columns(list(columns))
+        for subset in subsets
+    ]
+    if len(streams) == 1:
+        stream = streams[0]
+    else:
+        stream = interleave_datasets(streams, seed=seed, stopping_strategy="all_exhausted")
+    stream = stream.cast_column("audio", Audio(sampling_rate=sampling_rate))
+    eval_stream = stream.take(eval_samples)
+    train_stream = stream.skip(eval_samples).shuffle(seed=seed, buffer_size=shuffle_buffer)
+    return train_stream, eval_stream
+
+
+def lazy_map(stream: IterableDataset, prepare_batch: Callable, batched: bool = False,
+             batch_size: int = 32) -> IterableDataset:
+    """Apply `prepare_batch` on the fly, dropping the raw audio/text columns."""
+    columns = stream.column_names
+    if columns is None:
+        columns = list(next(iter(stream.take(1))).keys())
+    kwargs: Dict[str, Any] = {"batched": True, "batch_size": batch_size} if batched else {}
+    return stream.map(prepare_batch, remove_columns=columns, **kwargs)
+
+
+def _iterate(stream: IterableDataset) -> Iterator[Dict[str, Any]]:
+    yield from stream
+
+
+def materialize(stream: IterableDataset, cache_dir: Optional[str] = None) -> Dataset:
+    """Write a small, finite stream (the eval split) to an Arrow cache so it is fetched only once."""
+    return Dataset.from_generator(_iterate, gen_kwargs={"stream": stream}, cache_dir=cache_dir)
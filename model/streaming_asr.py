@@ -0,0 +1,329 @@
+"""
+Low-latency streaming recognition
+Energy VAD, a growing window over uncommitted audio, LocalAgreement commits and buffer trimming
+
+Audio arrives in small chunks. Leading silence is dropped before it reaches
+the model. Every `step_s` of new speech, the uncommitted window is decoded
+again. The words on which two consecutive hypotheses agree become
+committed, and the rest is shown as a tentative tail.
+
+Each decode returns Whisper timestamp segments. After every commit the
+window is cut after the last segment whose words are all committed, so
+committed audio is never decoded again. When the VAD sees an end of
+utterance (a pause of `endpoint_s`), the whole window is committed and
+dropped. A window that grows past `max_window_s` without a fully committed
+segment commits its hypothesis and starts over. Committed text from earlier
+windows is passed as the decoder prompt.
+
+Benchmark (time-to-first-token and real-time factor on a simulated live stream):
+    python streaming_asr.py --model ./whisper-tiny-test-final --clips 8
+"""
+
+import argparse
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from inference import SAMPLING_RATE, WhisperEngine, default_model_dir
+
+
+# -----------------------------
+# Voice activity
+# -----------------------------
+class EnergyVAD:
+    """
+    Frame-level energy VAD with an adaptive noise floor.
+
+    A frame counts as speech when its RMS level is `margin_db` above the
+    running noise floor. `hangover_frames` keeps short dips inside a word
+    from ending the speech region.
+    """
+
+    def __init__(self, frame_ms: float = 30.0, margin_db: float = 9.0, floor_db: float = -60.0,
+                 hangover_frames: int = 8, sampling_rate: int = SAMPLING_RATE):
+        self.frame = int(sampling_rate * frame_ms / 1000)
+        self.margin_db = margin_db
+        self.noise_db = floor_db
+        self.min_floor_db = floor_db
+        self.hangover_frames = hangover_frames
+        self._hang = 0
+        self._rest = np.zeros(0, dtype=np.float32)
+
+    def __call__(self, pcm: np.ndarray) -> np.ndarray:
+        """Per-frame speech flags for `pcm` (partial frames carry over to the next call)."""
+        pcm = np.concatenate([self._rest, pcm])
+        n = len(pcm) // self.frame
+        self._rest = pcm[n * self.frame:]
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        frames = pcm[:n * self.frame].reshape(n, self.frame)
+        level = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        flags = np.zeros(n, dtype=bool)
+        for i, db in enumerate(level):
+            if db > self.noise_db + self.margin_db:
+                flags[i] = True
+                self._hang = self.hangover_frames
+            else:
+                # Track the floor quickly downwards, slowly upwards
+                rate = 0.3 if db < self.noise_db else 0.02
+                self.noise_db = max(self.min_floor_db, self.noise_db + rate * (db - self.noise_db))
+                if self._hang > 0:
+                    flags[i] = True
+                    self._hang -= 1
+        return flags
+
+
+# -----------------------------
+# Recognizer
+# -----------------------------
+@dataclass
+class StreamUpdate:
+    committed: str          # newly committed text (append to the transcript)
+    tentative: str          # current unstable tail (replace the previous one)
+    audio_end_s: float      # stream time covered by this update
+    decoded: bool = False   # whether the model ran for this update
+
+
+def _common_prefix(a: List[str], b: List[str]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+@dataclass
+class StreamingRecognizer:
+    engine: WhisperEngine
+    step_s: float = 0.5
+    endpoint_s: float = 0.6
+    max_window_s: float = 20.0
+    prompt_chars: int = 200
+    vad: EnergyVAD = field(default_factory=EnergyVAD)
+
+    def __post_init__(self):
+        self.window = np.zeros(0, dtype=np.float32)   # uncommitted audio
+        self.window_start_s = 0.0                     # stream time of window[0]
+        self.stream_s = 0.0
+        self.transcript: List[str] = []               # committed words, all windows
+        self.window_committed: List[str] = []         # committed words from the current window
+        self.previous: List[str] = []                 # last hypothesis for the current window
+        self._since_decode = 0.0
+        self._silence_s = 0.0
+        self._in_speech = False
+        self.decodes = 0
+
+    # -----------------------------
+    # Decoding
+    # -----------------------------
+    def _prompt_ids(self) -> Optional[torch.Tensor]:
+        text = " ".join(self.transcript)[-self.prompt_chars:]
+        if not text:
+            return None
+        ids = self.engine.processor.get_prompt_ids(text, return_tensors="pt")
+        return ids.to(self.engine.device)
+
+    def _decode(self) -> List[Tuple[List[str], Tuple[float, Optional[float]]]]:
+        """Timestamped segments `(words, (start_s, end_s))` of the window; times are relative to window[0]."""
+        self.decodes += 1
+        tok = self.engine.processor.tokenizer
+        kwargs = {"prompt_ids": self._prompt_ids()} if self.transcript else {}
+        ids = self.engine.generate([self.window], return_timestamps=True, **kwargs)[0].tolist()
+        sot = tok.convert_tokens_to_ids("<|startoftranscript|>")
+        if sot in ids:  # older transformers return the prompt with the output
+            ids = ids[ids.index(sot):]
+        out = tok.decode(ids, skip_special_tokens=True, output_offsets=True)
+        return [(o["text"].split(), o["timestamp"]) for o in out["offsets"]]
+
+    def _commit(self, words: List[str]) -> str:
+        self.window_committed.extend(words)
+        self.transcript.extend(words)
+        return " ".join(words)
+
+    def _trim_committed(self, segments: List[Tuple[List[str], Tuple[float, Optional[float]]]]) -> str:
+        """
+        Drop the audio of the leading segments whose words are all committed.
+
+        A window that is still longer than `max_window_s` (no segment is
+        fully committed) commits its current hypothesis and starts over.
+        """
+        covered, cut_s = 0, None
+        for words, (_, end) in segments:
+            if end is None or covered + len(words) > len(self.window_committed):
+                break
+            covered += len(words)
+            cut_s = end
+        if cut_s is not None and cut_s > 0:
+            self._reset_window(int(cut_s * SAMPLING_RATE), keep_words=self.window_committed[covered:],
+                               previous=self.previous[covered:])
+            return ""
+        if len(self.window) / SAMPLING_RATE > self.max_window_s:
+            committed = self._commit(self.previous[len(self.window_committed):])
+            self._reset_window(len(self.window))
+            return committed
+        return ""
+
+    def _reset_window(self, drop_samples: int, keep_words: Optional[List[str]] = None,
+                      previous: Optional[List[str]] = None):
+        self.window = self.window[drop_samples:]
+        self.window_start_s += drop_samples / SAMPLING_RATE
+        self.window_committed = list(keep_words or [])
+        self.previous = list(previous) if previous is not None else list(self.window_committed)
+
+    # -----------------------------
+    # Streaming API
+    # -----------------------------
+    def feed(self, pcm: np.ndarray) -> StreamUpdate:
+        """Push the next chunk of 16 kHz float32 audio."""
+        pcm = np.asarray(pcm, dtype=np.float32)
+        flags = self.vad(pcm)
+        self.stream_s += len(pcm) / SAMPLING_RATE
+        speech = bool(flags.any())
+
+        if not self._in_speech and not speech:
+            # Silence before an utterance never reaches the model
+            self.window_start_s = self.stream_s
+            return StreamUpdate("", "", self.stream_s)
+        self._in_speech = True
+        self.window = np.concatenate([self.window, pcm])
+        self._since_decode += len(pcm) / SAMPLING_RATE
+        self._silence_s = 0.0 if speech else self._silence_s + len(pcm) / SAMPLING_RATE
+
+        if self._silence_s >= self.endpoint_s:
+            return self._endpoint()
+        if self._since_decode < self.step_s:
+            return StreamUpdate("", " ".join(self.previous[len(self.window_committed):]), self.stream_s)
+
+        self._since_decode = 0.0
+        segments = self._decode()
+        hyp = [w for words, _ in segments for w in words]
+        n = len(self.window_committed)
+        agreed = _common_prefix(hyp[n:], self.previous[n:])
+        committed = self._commit(hyp[n:n + agreed])
+        self.previous = hyp
+        # Committed audio leaves the window right away, so it is never decoded again
+        committed = " ".join(filter(None, [committed, self._trim_committed(segments)]))
+        tentative = " ".join(self.previous[len(self.window_committed):])
+        return StreamUpdate(committed, tentative, self.stream_s, decoded=True)
+
+    def _endpoint(self) -> StreamUpdate:
+        """End of utterance: final decode of the window, commit everything, drop the audio."""
+        words: List[str] = []
+        if len(self.window) and self._since_decode > 0:
+            words = [w for seg, _ in self._decode() for w in seg][len(self.window_committed):]
+        elif self.previous:
+            words = self.previous[len(self.window_committed):]
+        committed = self._commit(words)
+        self._reset_window(len(self.window))
+        self._in_speech = False
+        self._since_decode = self._silence_s = 0.0
+        return StreamUpdate(committed, "", self.stream_s, decoded=bool(words))
+
+    def finish(self) -> StreamUpdate:
+        """Flush at end of stream."""
+        if not len(self.window):
+            return StreamUpdate("", "", self.stream_s)
+        self._since_decode = max(self._since_decode, 1e-6)
+        return self._endpoint()
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.transcript)
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def simulate(recognizer: StreamingRecognizer, audio: np.ndarray, chunk_s: float = 0.1) -> Dict[str, float]:
+    """
+    Play `audio` as a live stream and measure latency on a simulated clock.
+
+    A chunk becomes available at its stream time, and processing starts
+    once both the chunk and the recognizer are ready. This charges real
+    compute time without sleeping. TTFT is measured from the first speech
+    frame to the first visible word, both tentative and committed.
+    """
+    chunk = int(chunk_s * SAMPLING_RATE)
+    onset = _speech_onset(audio)
+    clock = compute = 0.0
+    first_partial = first_commit = None
+    for start in range(0, len(audio), chunk):
+        available = (start + chunk) / SAMPLING_RATE
+        t0 = time.perf_counter()
+        upd = recognizer.feed(audio[start:start + chunk])
+        spent = time.perf_counter() - t0
+        compute += spent
+        clock = max(clock, available) + spent
+        if first_partial is None and (upd.tentative or upd.committed):
+            first_partial = clock
+        if first_commit is None and upd.committed:
+            first_commit = clock
+    t0 = time.perf_counter()
+    recognizer.finish()
+    compute += time.perf_counter() - t0
+    duration = len(audio) / SAMPLING_RATE
+    return {
+        "audio_s": duration,
+        "ttft_partial_s": (first_partial - onset) if first_partial is not None else float("nan"),
+        "ttft_commit_s": (first_commit - onset) if first_commit is not None else float("nan"),
+        "rtf": compute / duration,
+        "decodes": recognizer.decodes,
+    }
+
+
+def _speech_onset(audio: np.ndarray) -> float:
+    vad = EnergyVAD()
+    flags = vad(audio)
+    idx = np.flatnonzero(flags)
+    return float(idx[0] * vad.frame / SAMPLING_RATE) if len(idx) else 0.0
+
+
+def offline_rtf(engine: WhisperEngine, audio: np.ndarray) -> Tuple[float, str]:
+    """RTF of the current path: one padded 30 s window per clip, decoded once."""
+    start = time.perf_counter()
+    texts = []
+    for s in range(0, len(audio), 30 * SAMPLING_RATE):
+        texts += engine.transcribe([audio[s:s + 30 * SAMPLING_RATE]])
+    return (time.perf_counter() - start) / (len(audio) / SAMPLING_RATE), " ".join(texts)
+
+
+def main():
+    from datasets import load_dataset, Audio
+
+    parser = argparse.ArgumentParser(description="Streaming recognition benchmark (TTFT / RTF on CPU)")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--dataset", default="ekacare/eka-medical-asr-evaluation-dataset")
+    parser.add_argument("--subset", default="hi")
+    parser.add_argument("--clips", type=int, default=8, help="Clips joined (with pauses) into one stream")
+    parser.add_argument("--chunk-ms", type=float, default=100.0)
+    parser.add_argument("--step-ms", type=float, default=500.0)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    engine = WhisperEngine(args.model or default_model_dir(), device=args.device, num_beams=1)
+    ds = load_dataset(args.dataset, args.subset, split="test").select(range(args.clips))
+    ds = ds.cast_column("audio", Audio(sampling_rate=SAMPLING_RATE))
+    pause = np.zeros(int(0.8 * SAMPLING_RATE), dtype=np.float32)
+    audio = np.concatenate([np.concatenate([np.asarray(r["audio"]["array"], dtype=np.float32), pause]) for r in ds])
+
+    engine.transcribe([audio[:SAMPLING_RATE]])  # warm-up
+    rec = StreamingRecognizer(engine, step_s=args.step_ms / 1000.0)
+    res = simulate(rec, audio, chunk_s=args.chunk_ms / 1000.0)
+    base_rtf, _ = offline_rtf(engine, audio)
+    print(f"\n📊 {res['audio_s']:.1f}s stream, {args.chunk_ms:.0f} ms chunks, decode every {args.step_ms:.0f} ms")
+    print(f"   TTFT (partial)  : {res['ttft_partial_s'] * 1000:.0f} ms")
+    print(f"   TTFT (committed): {res['ttft_commit_s'] * 1000:.0f} ms")
+    print(f"   streaming RTF   : {res['rtf']:.3f} ({res['decodes']} decodes)")
+    print(f"   offline RTF     : {base_rtf:.3f} (30 s windows, no partials)")
+    print(f"\n📝 {rec.text}")
+
+
+if __name__ == "__main__":
+    main()
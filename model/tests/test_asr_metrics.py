@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+pytest.importorskip("torch")
+
+from asr_metrics import ErrorRateAccumulator, levenshtein
+
+
+def _reference_distance(a, b):
+    prev = list(range(len(b) + 1))
+    for i, x in enumerate(a, start=1):
+        cur = [i]
+        for j, y in enumerate(b, start=1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (x != y)))
+        prev = cur
+    return prev[-1]
+
+
+@pytest.mark.parametrize("ref, hyp, expected", [
+    ([], [], 0),
+    ([1, 2, 3], [], 3),
+    ([], [4, 5], 2),
+    ([1, 2, 3], [1, 2, 3], 0),
+    ([1, 2, 3], [1, 3], 1),
+    ([1, 2, 3], [1, 4, 3], 1),
+    ([1, 2], [3, 1, 2, 4], 2),
+])
+def test_levenshtein_known_cases(ref, hyp, expected):
+    assert levenshtein(ref, hyp) == expected
+    assert levenshtein(hyp, ref) == expected
+
+
+def test_levenshtein_matches_reference_dp():
+    rng = random.Random(0)
+    for _ in range(200):
+        a = [rng.randrange(4) for _ in range(rng.randrange(12))]
+        b = [rng.randrange(4) for _ in range(rng.randrange(12))]
+        assert levenshtein(a, b) == _reference_distance(a, b)
+
+
+def test_error_rates_are_corpus_level():
+    acc = ErrorRateAccumulator()
+    acc.update_text(["the cat sat"], ["the cat sat down"])  # 1 deletion / 4 words
+    acc.update_text(["a dog"], ["a frog"])                  # 1 substitution / 2 words
+    assert acc.word_edits == 2 and acc.words == 6
+    assert acc.compute()["wer"] == pytest.approx(100 * 2 / 6)
+
+
+def test_reset_clears_counters_and_vocabulary():
+    acc = ErrorRateAccumulator()
+    acc.update_text(["x y"], ["x z"])
+    acc.reset()
+    assert acc.words == acc.word_edits == acc.samples == 0
+    assert acc._vocab.ids == {}
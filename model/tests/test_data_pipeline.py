@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("accelerate")
+pytest.importorskip("transformers")
+
+from data_pipeline import PrefetchLoader, skip_first_batches
+from ddp_cpu import RankShardSampler
+
+
+def _loader(n=10, batch_size=4, sampler=None, **kwargs):
+    return PrefetchLoader(list(range(n)), lambda rows: list(rows), batch_size, shuffle=False, sampler=sampler,
+                          num_workers=2, **kwargs)
+
+
+def test_without_sampler_covers_the_dataset():
+    loader = _loader()
+    batches = list(loader)
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert len(loader) == 3
+    assert len(_loader(drop_last=True)) == len(list(_loader(drop_last=True))) == 2
+
+
+@pytest.mark.parametrize("rank", [0, 1])
+def test_rank_shard_sampler_sets_batches_and_length(rank):
+    dataset = list(range(20))
+    sampler = RankShardSampler(list(range(20)), batch_size=4, rank=rank, world_size=2)
+    loader = _loader(len(dataset), sampler=sampler)
+    batches = list(loader)
+    assert len(loader) == len(batches) == 2
+    assert all(batches)  # no empty tail batches for the collator
+    assert batches == [list(range(s, s + 4)) for s in ((0 + rank) * 4, (2 + rank) * 4)]
+
+
+def test_end_of_dataloader_flags_the_last_batch():
+    loader = _loader()
+    flags = [loader.end_of_dataloader for _ in loader]
+    assert flags == [False, False, True]
+
+
+def test_skip_first_batches_resumes_mid_epoch():
+    loader = PrefetchLoader(list(range(20)), lambda rows: list(rows), 4, shuffle=True, num_workers=2)
+    loader.set_epoch(3)
+    full = list(loader)
+    resumed = skip_first_batches(loader, 2)
+    assert isinstance(resumed, PrefetchLoader)
+    assert list(resumed) == full[2:]
+    assert len(resumed) == len(loader) - 2
+    assert len(loader) == 5  # the original loader is untouched
@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("torch")
+
+from length_sampler import BucketSampler
+
+
+def _sampler(n=103, batch_size=8, bucket_batches=4, seed=42):
+    lengths = [(i * 37) % 50 + 1 for i in range(n)]
+    durations = [float(i % 7) for i in range(n)]
+    return BucketSampler(lengths, batch_size, durations=durations, bucket_batches=bucket_batches, seed=seed)
+
+
+def test_each_epoch_is_a_permutation():
+    sampler = _sampler()
+    for _ in range(3):
+        order = list(sampler)
+        assert sorted(order) == list(range(103))
+        assert len(order) == len(sampler)
+
+
+def test_batches_are_aligned_to_batch_size():
+    sampler = _sampler()
+    batches = sampler.batches(epoch=0)
+    assert all(len(b) == 8 for b in batches[:-1])
+    assert sum(len(b) for b in batches) == 103
+    flat = list(sampler)  # epoch 0
+    assert [flat[i:i + 8] for i in range(0, len(flat), 8)] == batches
+
+
+def test_full_batches_hold_similar_lengths():
+    sampler = _sampler()
+    for batch in sampler.batches(epoch=0)[:-1]:
+        keys = [(sampler.lengths[i], sampler.durations[i]) for i in batch]
+        assert keys == sorted(keys, reverse=True)
+
+
+def test_order_is_seeded_per_epoch():
+    a, b = _sampler(), _sampler()
+    assert a.batches(epoch=0) == b.batches(epoch=0)
+    assert a.batches(epoch=0) != a.batches(epoch=1)
+    first = list(a)
+    assert list(a) != first  # iterating advances the epoch
+    a.set_epoch(0)
+    assert list(a) == first
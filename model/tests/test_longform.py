@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from longform import merge_token_sequences
+
+
+def test_overlap_is_joined_once():
+    left = [1, 2, 3, 4, 5, 6]
+    right = [4, 5, 6, 7, 8]
+    assert merge_token_sequences([left, right]) == [1, 2, 3, 4, 5, 6, 7, 8]
+
+
+def test_overlap_with_a_disagreeing_token_joins_in_the_middle():
+    # The chunks disagree on one overlapping token; the join keeps the left's first half
+    # of the overlap and the right's second half
+    left = [1, 2, 3, 9, 5, 6]
+    right = [3, 4, 5, 6, 7]
+    assert merge_token_sequences([left, right]) == [1, 2, 3, 9, 5, 6, 7]
+
+
+def test_no_credible_overlap_concatenates():
+    assert merge_token_sequences([[1, 2, 3], [7, 8, 9]]) == [1, 2, 3, 7, 8, 9]
+    # a single matching token is below min_matches
+    assert merge_token_sequences([[1, 2, 3], [3, 8, 9]]) == [1, 2, 3, 3, 8, 9]
+
+
+def test_three_chunks_and_trivial_inputs():
+    assert merge_token_sequences([]) == []
+    assert merge_token_sequences([[5, 6]]) == [5, 6]
+    chunks = [[1, 2, 3, 4], [3, 4, 5, 6], [5, 6, 7, 8]]
+    assert merge_token_sequences(chunks) == [1, 2, 3, 4, 5, 6, 7, 8]
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from packing import TIME_PRECISION, PackedDataset, plan_packs
+
+SR = 16000
+
+
+class _Tokenizer:
+    NOTIMESTAMPS = 50363
+    SPACE = 220
+
+    def convert_tokens_to_ids(self, token):
+        assert token == "<|notimestamps|>"
+        return self.NOTIMESTAMPS
+
+    def encode(self, text, add_special_tokens=True):
+        assert text == " " and not add_special_tokens
+        return [self.SPACE]
+
+
+class _Clips:
+    """Minimal `datasets`-like source: `ds["labels"]`, `ds[i]`, `len(ds)`."""
+
+    def __init__(self, durations, labels):
+        self.rows = [
+            {"audio": {"array": np.full(int(round(d * SR)), k + 1, dtype=np.float32), "sampling_rate": SR},
+             "labels": l}
+            for k, (d, l) in enumerate(zip(durations, labels))
+        ]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return [r[key] for r in self.rows]
+        return self.rows[key]
+
+
+def test_every_clip_is_packed_exactly_once():
+    rng = np.random.default_rng(0)
+    durations = rng.uniform(0.5, 12.0, size=60).tolist()
+    lengths = rng.integers(1, 40, size=60).tolist()
+    packs = plan_packs(durations, lengths, window_s=30.0)
+    assert sorted(i for p in packs for i in p) == list(range(60))
+
+
+def test_packs_respect_window_and_token_budget():
+    rng = np.random.default_rng(1)
+    durations = rng.uniform(0.5, 12.0, size=60).tolist()
+    lengths = rng.integers(1, 120, size=60).tolist()
+    gap = 0.2
+    packs = plan_packs(durations, lengths, window_s=30.0, gap_s=gap, max_label_tokens=200, prefix_len=3)
+    for p in packs:
+        if len(p) == 1:
+            continue
+        assert sum(durations[i] + gap + TIME_PRECISION for i in p) <= 30.0 + gap + 1e-9
+        assert 3 + sum(lengths[i] + 2 for i in p) <= 200
+
+
+def test_first_fit_decreasing_fills_windows():
+    # 20 s + 9 s share one window, 15 s + 14 s the next; FFD places the longest clips first
+    packs = plan_packs([9.0, 15.0, 20.0, 14.0], [5, 5, 5, 5], window_s=30.0, gap_s=0.0)
+    assert sorted(sorted(p) for p in packs) == [[0, 2], [1, 3]]
+
+
+def test_clip_longer_than_window_gets_its_own_pack():
+    packs = plan_packs([45.0, 2.0, 2.0], [5, 5, 5], window_s=30.0)
+    assert [0] in packs
+    assert sorted(i for p in packs for i in p) == [0, 1, 2]
+
+
+def test_separator_costs_one_token_without_timestamps():
+    # Two 3-token clips: 2 * (3 + 2) = 10 tokens with timestamps, 2 * (3 + 1) = 8 without
+    assert len(plan_packs([1.0, 1.0], [3, 3], max_label_tokens=9)) == 2
+    assert len(plan_packs([1.0, 1.0], [3, 3], max_label_tokens=9, timestamps=False)) == 1
+
+
+def test_packed_labels_without_timestamps_match_unpacked_layout():
+    clips = _Clips([1.0, 0.5], [[11, 12], [21]])
+    ds = PackedDataset(clips, [[0, 1]], _Tokenizer(), timestamps=False)
+    row = ds[0]
+    assert row["labels"] == [11, 12, _Tokenizer.SPACE, 21]
+    assert ds.labels == [row["labels"]]
+
+
+def test_packed_labels_with_timestamps_and_audio_offsets():
+    clips = _Clips([1.0, 0.5], [[11, 12], [21]])
+    prefix = [7, 8]
+    ds = PackedDataset(clips, [[0, 1]], _Tokenizer(), gap_s=0.2, prefix_ids=prefix)
+    row = ds[0]
+    ts = _Tokenizer.NOTIMESTAMPS + 1
+    second = int(round(1.2 / TIME_PRECISION))  # 1.0 s clip + 0.2 s gap, already on the 20 ms grid
+    assert row["labels"] == prefix + [ts, 11, 12, ts + 50, ts + second, 21, ts + second + 25]
+    audio = row["audio"]["array"]
+    assert len(audio) == int(1.2 * SR) + int(0.5 * SR)
+    assert np.all(audio[:SR] == 1) and np.all(audio[SR:int(1.2 * SR)] == 0) and np.all(audio[int(1.2 * SR):] == 2)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("accelerate")
+pytest.importorskip("transformers")
+
+from pcm_store import PCM_SCALE, PCMStore
+
+SR = 16000
+
+
+def _decoded_rows(arrays):
+    # Already-decoded rows at the store's rate skip FFmpeg
+    return [{"audio": {"array": a, "sampling_rate": SR}} for a in arrays]
+
+
+def test_round_trip_within_one_quantization_step(tmp_path):
+    rng = np.random.default_rng(0)
+    arrays = [rng.uniform(-1.0, 1.0, size=n).astype(np.float32) for n in (1600, 0, 4000, 321)]
+    store = PCMStore.build(_decoded_rows(arrays), str(tmp_path / "store"), num_workers=2)
+    assert len(store) == len(arrays)
+    for i, a in enumerate(arrays):
+        out = store.array(i)
+        assert out.dtype == np.float32 and out.shape == a.shape
+        assert np.max(np.abs(out - a), initial=0.0) <= 0.5 / PCM_SCALE + 1e-7
+
+
+def test_full_scale_is_preserved_and_overshoot_clipped(tmp_path):
+    a = np.array([-1.5, -1.0, -0.5, 0.0, 0.5, 1.0, 1.5], dtype=np.float32)
+    store = PCMStore.build(_decoded_rows([a]), str(tmp_path / "store"), num_workers=1)
+    np.testing.assert_allclose(store.array(0), np.clip(a, -1.0, 1.0), atol=0.5 / PCM_SCALE)
+    assert store.array(0)[1] == -1.0 and store.array(0)[5] == 1.0
+
+
+def test_rows_span_shards_and_reopen(tmp_path):
+    arrays = [np.full(1000, k / 10, dtype=np.float32) for k in range(5)]
+    path = str(tmp_path / "store")
+    PCMStore.build(_decoded_rows(arrays), path, shard_bytes=3000, num_workers=1)
+    assert PCMStore.is_complete(path)
+    store = PCMStore(path)
+    assert len(set(store.index[:, 0].tolist())) > 1
+    for k, a in enumerate(arrays):
+        np.testing.assert_allclose(store.array(k), a, atol=0.5 / PCM_SCALE)
+    assert store.durations() == [1000 / SR] * 5
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from streaming_asr import SAMPLING_RATE, StreamingRecognizer, _common_prefix
+
+
+def test_common_prefix():
+    assert _common_prefix([], ["a"]) == 0
+    assert _common_prefix(["a", "b", "c"], ["a", "b", "d"]) == 2
+    assert _common_prefix(["a", "b"], ["a", "b", "c"]) == 2
+    assert _common_prefix(["x"], ["a"]) == 0
+
+
+def _recognizer(hypotheses):
+    """Recognizer whose decodes return the scripted timestamped segments in turn."""
+    rec = StreamingRecognizer(engine=None, step_s=0.5, vad=lambda pcm: np.ones(1, dtype=bool))
+    script = iter(hypotheses)
+
+    def decode():
+        rec.decodes += 1
+        return next(script)
+
+    rec._decode = decode
+    return rec
+
+
+def _chunk(seconds=0.5):
+    return np.full(int(seconds * SAMPLING_RATE), 0.1, dtype=np.float32)
+
+
+def test_words_commit_once_two_decodes_agree():
+    rec = _recognizer([
+        [(["a", "b"], (0.0, 0.4)), (["c"], (0.4, None))],
+        [(["a", "b"], (0.0, 0.4)), (["d"], (0.4, None))],
+    ])
+    first = rec.feed(_chunk())
+    assert first.decoded and first.committed == "" and first.tentative == "a b c"
+    second = rec.feed(_chunk())
+    assert second.committed == "a b" and second.tentative == "d"
+    assert rec.text == "a b"
+
+
+def test_committed_segments_leave_the_window():
+    rec = _recognizer([
+        [(["a", "b"], (0.0, 0.4)), (["c"], (0.4, None))],
+        [(["a", "b"], (0.0, 0.4)), (["c"], (0.4, None))],
+        [(["c", "e"], (0.0, None))],
+    ])
+    rec.feed(_chunk())
+    update = rec.feed(_chunk())
+    assert update.committed == "a b c"
+    # "a b" ends at 0.4 s; the open last segment keeps its audio
+    assert rec.window_start_s == pytest.approx(0.4)
+    assert len(rec.window) == int(0.6 * SAMPLING_RATE)
+    assert rec.window_committed == ["c"]
+    update = rec.feed(_chunk())
+    assert update.committed == "" and update.tentative == "e"
+    assert rec.text == "a b c"
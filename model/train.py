@@ -24,11 +24,18 @@ from transformers import (
     Seq2SeqTrainingArguments,
     Seq2SeqTrainer,
 )
-import evaluate
-import numpy as np
 from dataclasses import dataclass
 from typing import Any, Dict, List, Union
 from huggingface_hub import login
+from fast_features import make_prepare_batch, default_num_proc
+from data_pipeline import DecodingCollator, PrefetchTrainerMixin, StallLogCallback, default_workers
+from pcm_store import PCMStore, PCMAudioDataset
+from length_sampler import BucketSampler, LengthGroupedTrainerMixin, label_lengths, padding_report
+from profiler import maybe_add_profiler
+from fast_eval import FastEvalTrainerMixin
+from asr_metrics import ErrorRateAccumulator
+from cpu_fastpath import CpuFastPathTrainerMixin, describe as describe_cpu, plan_cpu_fastpath
+from ddp_cpu import RankShardTrainerMixin, RunSummaryCallback, init_rank, release_main, wait_for_main
 
 # -----------------------------
 # 🔑 Authentication
@@ -66,6 +73,31 @@ learning_rate = 1e-5
 # Output
 output_dir = "./whisper-finetuned-cpu"
 
+# Data pipeline: decode + features in a thread pool with a bounded prefetch queue (DATA_PIPELINE=1)
+data_pipeline = os.getenv("DATA_PIPELINE", "0") != "0"
+# With the pipeline, decode each clip once into memory-mapped int16 PCM shards (PCM_STORE=1)
+pcm_store = data_pipeline and os.getenv("PCM_STORE", "0") != "0"
+pcm_store_dir = os.getenv("PCM_STORE_DIR", "./pcm-store")
+
+# Bucket training batches by label length to cut label padding (LENGTH_GROUPING=1)
+length_grouping = os.getenv("LENGTH_GROUPING", "0") != "0"
+
+# Batched, length-sorted eval with the KV cache on (FAST_EVAL=1)
+fast_eval = os.getenv("FAST_EVAL", "0") != "0"
+eval_batch_size = int(os.getenv("EVAL_BATCH", str(batch_size)))
+eval_beams = int(os.getenv("EVAL_BEAMS", "1"))  # 1 = greedy
+
+# CPU fast path: bf16 autocast (if native), one thread per physical core, fused AdamW (CPU_FASTPATH=1, CPU_COMPILE=1)
+cpu_fastpath = os.getenv("CPU_FASTPATH", "0") != "0"
+cpu_compile = os.getenv("CPU_COMPILE", "0") != "0"
+
+# Started by ddp_cpu.py: this process is one gloo DDP rank on its own cores and data shard
+ddp = init_rank()
+if ddp:
+    # Keep the global batch as with one process
+    gradient_accumulation = max(1, gradient_accumulation // ddp.world_size)
+    print(f"\n🧵 DDP rank {ddp.rank}/{ddp.world_size} on {len(ddp.cores)} cores, grad accumulation {gradient_accumulation}")
+
 print(f"\n📋 Settings:")
 print(f"   Model: {model_name}")
 print(f"   Dataset samples: {num_samples}")
@@ -81,10 +113,17 @@ print(f"\n🚀 Device: {device}")
 if device == "cpu":
     print("   ⚠️  Training on CPU will be slower (2-4 hours expected)")
     print("   💡 Consider using Google Colab with GPU for faster training")
+cpu_plan = None
+if cpu_fastpath and device == "cpu":
+    # Before any torch work: inter-op threads can only be set once
+    cpu_plan = plan_cpu_fastpath(compile_model=cpu_compile)
+    cpu_plan.apply()
+    print(f"   {describe_cpu(cpu_plan)}")
 
 # -----------------------------
 # 📥 Load Dataset
 # -----------------------------
+wait_for_main(ddp)  # other ranks reuse the main rank's datasets cache
 print("\n📥 Loading dataset...")
 print("   Using FFmpeg for audio decoding")
 
@@ -93,7 +132,8 @@ try:
     print(f"   Total available: {len(dataset)} samples")
     
     # Cast audio to correct format - FFmpeg will handle decoding
-    dataset = dataset.cast_column("audio", Audio(sampling_rate=16000))
+    # (the data pipeline decodes itself, so datasets only hands over the encoded bytes)
+    dataset = dataset.cast_column("audio", Audio(sampling_rate=16000, decode=not data_pipeline))
     
     # Select subset
     dataset = dataset.shuffle(seed=42).select(range(num_samples))
@@ -147,6 +187,8 @@ class DataCollatorSpeechSeq2SeqWithPadding:
         return batch
 
 data_collator = DataCollatorSpeechSeq2SeqWithPadding(processor=processor)
+if data_pipeline:
+    data_collator = DecodingCollator(processor=processor)
 
 # -----------------------------
 # ⚙️ Prepare Dataset
@@ -161,21 +203,40 @@ def prepare_batch(batch):
     batch["labels"] = tokenizer(batch["text"]).input_ids
     return batch
 
-print("   Processing training data...")
-train_dataset = train_dataset.map(
-    prepare_batch,
-    remove_columns=train_dataset.column_names,
-    desc="Training"
-)
-
-print("   Processing validation data...")
-eval_dataset = eval_dataset.map(
-    prepare_batch,
-    remove_columns=eval_dataset.column_names,
-    desc="Validation"
-)
+# Batched log-mel extraction across worker processes (BATCHED_FEATURES=0 restores the per-example map)
+batched_features = os.getenv("BATCHED_FEATURES", "1") != "0"
+num_proc = default_num_proc()
+map_kwargs = {}
+if batched_features:
+    prepare_batch = make_prepare_batch(feature_extractor, tokenizer, torch_threads=1 if num_proc > 1 else None)
+    map_kwargs = {"batched": True, "batch_size": 32, "num_proc": num_proc if num_proc > 1 else None}
+    print(f"   Batched feature extraction (num_proc={num_proc})")
+
+if data_pipeline:
+    if pcm_store:
+        train_dataset = PCMAudioDataset(PCMStore.open_or_build(train_dataset, pcm_store_dir), train_dataset)
+        eval_dataset = PCMAudioDataset(PCMStore.open_or_build(eval_dataset, pcm_store_dir), eval_dataset)
+        print(f"   Audio served from PCM store at {pcm_store_dir}")
+    print(f"   Decoding + features run on the fly in {default_workers()} pipeline workers")
+else:
+    print("   Processing training data...")
+    train_dataset = train_dataset.map(
+        prepare_batch,
+        remove_columns=train_dataset.column_names,
+        desc="Training",
+        **map_kwargs,
+    )
+
+    print("   Processing validation data...")
+    eval_dataset = eval_dataset.map(
+        prepare_batch,
+        remove_columns=eval_dataset.column_names,
+        desc="Validation",
+        **map_kwargs,
+    )
 
 print("✅ Dataset prepared")
+release_main(ddp)
 
 # -----------------------------
 # 🤖 Load Model
@@ -191,22 +252,9 @@ print(f"✅ Model loaded ({sum(p.numel() for p in model.parameters())/1e6:.1f}M
 # -----------------------------
 # 📊 Evaluation Metric
 # -----------------------------
-print("\n📊 Loading evaluation metric...")
-metric = evaluate.load("wer")
-
-def compute_metrics(pred):
-    pred_ids = pred.predictions
-    label_ids = pred.label_ids
-
-    label_ids[label_ids == -100] = tokenizer.pad_token_id
-
-    pred_str = tokenizer.batch_decode(pred_ids, skip_special_tokens=True)
-    label_str = tokenizer.batch_decode(label_ids, skip_special_tokens=True)
-
-    wer = 100 * metric.compute(predictions=pred_str, references=label_str)
-    return {"wer": wer}
-
-print("✅ Metric loaded")
+# Local WER/CER, accumulated per eval batch (no metric download, flat memory)
+error_rates = ErrorRateAccumulator(tokenizer)
+print("\n📊 Using local streaming WER/CER")
 
 # -----------------------------
 # 🏋️ Training Arguments
@@ -223,7 +271,8 @@ training_args = Seq2SeqTrainingArguments(
     gradient_checkpointing=False,  # Disable for CPU
     fp16=False,  # No mixed precision on CPU
     evaluation_strategy="epoch",
-    per_device_eval_batch_size=batch_size,
+    per_device_eval_batch_size=eval_batch_size,
+    generation_num_beams=eval_beams,
     predict_with_generate=True,
     generation_max_length=225,
     save_strategy="epoch",
@@ -237,20 +286,53 @@ training_args = Seq2SeqTrainingArguments(
     push_to_hub=False,
     remove_unused_columns=False,
     dataloader_num_workers=0,  # No multiprocessing on CPU
+    **(cpu_plan.training_args() if cpu_plan else {}),  # bf16 autocast / torch_compile
+    **(ddp.training_args() if ddp else {}),  # gloo
 )
 
 # -----------------------------
 # 🎯 Initialize Trainer
 # -----------------------------
-trainer = Seq2SeqTrainer(
+trainer_mixins = []
+if cpu_plan:
+    trainer_mixins.append(CpuFastPathTrainerMixin)
+if ddp and data_pipeline:
+    trainer_mixins.append(RankShardTrainerMixin)  # the prefetch loader bypasses accelerate's sharding
+if fast_eval:
+    trainer_mixins.append(FastEvalTrainerMixin)
+if length_grouping:
+    trainer_mixins.append(LengthGroupedTrainerMixin)
+if data_pipeline:
+    trainer_mixins.append(PrefetchTrainerMixin)
+trainer_cls = type("WhisperTrainer", (*trainer_mixins, Seq2SeqTrainer), {})
+trainer = trainer_cls(
     args=training_args,
     model=model,
     train_dataset=train_dataset,
     eval_dataset=eval_dataset,
     data_collator=data_collator,
-    compute_metrics=compute_metrics,
+    compute_metrics=error_rates.compute_metrics,
+    preprocess_logits_for_metrics=error_rates.preprocess_logits_for_metrics,
     tokenizer=processor.feature_extractor,
 )
+if length_grouping:
+    if data_pipeline:
+        # Raw rows: count label tokens from the transcripts
+        lengths = [len(ids) for ids in tokenizer(train_dataset["text"]).input_ids]
+    else:
+        lengths = label_lengths(train_dataset)
+    durations = train_dataset.durations() if hasattr(train_dataset, "durations") else None
+    trainer.length_sampler = BucketSampler(lengths, batch_size, durations=durations, seed=training_args.seed)
+    pad = padding_report(lengths, batch_size, trainer.length_sampler, seed=training_args.seed)
+    print(f"📏 Label padding: {pad['random'] * 100:.1f}% of tokens with random batches -> "
+          f"{pad['bucketed'] * 100:.1f}% with length buckets")
+if cpu_plan:
+    trainer.cpu_plan = cpu_plan
+if data_pipeline:
+    trainer.add_callback(StallLogCallback(os.path.join(output_dir, "step_timing.jsonl")))
+if os.getenv("DDP_SUMMARY"):
+    trainer.add_callback(RunSummaryCallback(os.environ["DDP_SUMMARY"]))
+maybe_add_profiler(trainer)  # PROFILE=1
 
 print("✅ Trainer initialized")
 
@@ -288,7 +370,8 @@ except KeyboardInterrupt:
 # -----------------------------
 print("\n💾 Saving final model...")
 trainer.save_model(output_dir)
-processor.save_pretrained(output_dir)
+if training_args.should_save:
+    processor.save_pretrained(output_dir)
 print(f"✅ Model saved to {output_dir}")
 
 # -----------------------------
@@ -297,13 +380,20 @@ print(f"✅ Model saved to {output_dir}")
 print("\n📊 Running final evaluation...")
 metrics = trainer.evaluate()
 print(f"\n🎯 Final WER: {metrics['eval_wer']:.2f}%")
+if ddp and not ddp.is_main:
+    sys.exit(0)
 
 # -----------------------------
 # 🧪 Test Sample
 # -----------------------------
 print("\n🧪 Testing on a sample...")
 sample = eval_dataset[0]
-input_features = torch.tensor([sample["input_features"]]).unsqueeze(0)
+if data_pipeline:
+    prepared = data_collator([sample])
+    input_features = prepared["input_features"]
+    sample = {"labels": prepared["labels"][0][prepared["labels"][0] != -100].tolist()}
+else:
+    input_features = torch.tensor([sample["input_features"]]).unsqueeze(0)
 
 model.eval()
 with torch.no_grad():